@@ -0,0 +1,377 @@
+import os
+import sys
+import json
+import time
+import zlib
+import shutil
+import hashlib
+import argparse
+import threading
+
+import lmdb
+
+from cache import to_cacheable
+from thumbnails import remove_pyramid
+from utils import FileManager, FileLock
+
+# 归档默认保存位置，LMDB 环境目录
+DEFAULT_ARCHIVE_PATH = os.path.join("output", "archive.lmdb")
+# 初始映射大小，写满时自动翻倍（字节）
+INITIAL_MAP_SIZE = 64 * 1024 * 1024
+# 每个写事务打包的记录数
+PACK_BATCH = 500
+# 结果 JSON 的 zlib 压缩级别
+COMPRESSION_LEVEL = 6
+
+# 进程内共享的归档，LMDB 不允许同一进程重复打开同一环境
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def open_archive(path=DEFAULT_ARCHIVE_PATH, create=False):
+    """返回进程内共享的归档，不存在且 create 为 False 时返回 None"""
+    key = os.path.abspath(path)
+    with _archives_lock:
+        archive = _archives.get(key)
+        if archive is None:
+            if not create and not os.path.exists(path):
+                return None
+            archive = HistoryArchive(path)
+            _archives[key] = archive
+        return archive
+
+
+def encode_record(result, digest):
+    data = {"result": to_cacheable(result), "image": digest}
+    text = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    return zlib.compress(text.encode("utf-8"), COMPRESSION_LEVEL)
+
+
+def decode_record(value):
+    return json.loads(zlib.decompress(value).decode("utf-8"))
+
+
+class HistoryArchive:
+    """把历史记录打包到一个 LMDB 环境中
+
+    records: 记录 ID -> 压缩后的结果和图片摘要
+    images: 图片 SHA-256 -> PNG 数据，相同图片只保存一份
+    refs: 图片 SHA-256 -> 引用该图片的记录数
+    """
+
+    def __init__(self, path=DEFAULT_ARCHIVE_PATH):
+        self.path = path
+        self._open()
+
+    def _open(self):
+        data_file = os.path.join(self.path, "data.mdb")
+        size = os.path.getsize(data_file) if os.path.exists(data_file) else 0
+        self.env = lmdb.open(
+            self.path,
+            map_size=max(INITIAL_MAP_SIZE, size * 2),
+            max_dbs=3,
+            subdir=True,
+        )
+        self.records = self.env.open_db(b"records")
+        self.images = self.env.open_db(b"images")
+        self.refs = self.env.open_db(b"refs")
+
+    def _begin(self, write=False):
+        """开始事务，其他进程扩大映射空间后先采用新的大小"""
+        try:
+            return self.env.begin(write=write)
+        except lmdb.MapResizedError:
+            self.env.set_mapsize(0)
+            return self.env.begin(write=write)
+
+    def _write(self, func):
+        """执行写事务，映射空间写满时扩大后重试"""
+        while True:
+            try:
+                with self._begin(write=True) as txn:
+                    return func(txn)
+            except lmdb.MapFullError:
+                self.env.set_mapsize(self.env.info()["map_size"] * 2)
+
+    def _add_ref(self, txn, digest, delta):
+        key = digest.encode("ascii")
+        count = int(txn.get(key, b"0", db=self.refs)) + delta
+        if count > 0:
+            txn.put(key, str(count).encode("ascii"), db=self.refs)
+        else:
+            txn.delete(key, db=self.refs)
+            txn.delete(key, db=self.images)
+
+    def _put(self, txn, record_id, result, image_data):
+        """写入一条记录，返回图片是否为新图片"""
+        key = record_id.encode("utf-8")
+        digest = hashlib.sha256(image_data).hexdigest() if image_data else None
+        old = txn.get(key, db=self.records)
+        old_digest = decode_record(old)["image"] if old is not None else None
+
+        stored = False
+        # 图片未变时保留原来的引用计数
+        if old_digest != digest:
+            if old_digest:
+                self._add_ref(txn, old_digest, -1)
+            if digest:
+                stored = txn.put(
+                    digest.encode("ascii"), image_data, db=self.images, overwrite=False
+                )
+                self._add_ref(txn, digest, 1)
+        txn.put(key, encode_record(result, digest), db=self.records)
+        return stored
+
+    def put_many(self, items):
+        """在一个事务中写入多条 (记录 ID, 结果, PNG 数据)，返回新保存的图片数"""
+        return self._write(
+            lambda txn: sum(
+                self._put(txn, record_id, result, image_data)
+                for record_id, result, image_data in items
+            )
+        )
+
+    def put(self, record_id, result, image_data=None):
+        return self.put_many([(record_id, result, image_data)])
+
+    def get(self, record_id):
+        """返回 (结果, PNG 数据)，记录不存在时返回 (None, None)"""
+        with self._begin() as txn:
+            value = txn.get(record_id.encode("utf-8"), db=self.records)
+            if value is None:
+                return None, None
+            record = decode_record(value)
+            image_data = None
+            if record["image"]:
+                image_data = txn.get(record["image"].encode("ascii"), db=self.images)
+            return record["result"], image_data
+
+    def get_result(self, record_id):
+        with self._begin() as txn:
+            value = txn.get(record_id.encode("utf-8"), db=self.records)
+        return decode_record(value)["result"] if value is not None else None
+
+    def __contains__(self, record_id):
+        with self._begin() as txn:
+            return txn.get(record_id.encode("utf-8"), db=self.records) is not None
+
+    def items(self):
+        """逐条返回 (记录 ID, 结果)"""
+        with self._begin() as txn:
+            for key, value in txn.cursor(db=self.records):
+                yield key.decode("utf-8"), decode_record(value)["result"]
+
+    def update_titles(self, titles):
+        """修改已归档记录的标题，titles 为 {记录 ID: 标题}"""
+
+        def update(txn):
+            for record_id, title in titles.items():
+                key = record_id.encode("utf-8")
+                value = txn.get(key, db=self.records)
+                if value is None:
+                    continue
+                record = decode_record(value)
+                record["result"]["title"] = title
+                value = encode_record(record["result"], record["image"])
+                txn.put(key, value, db=self.records)
+
+        self._write(update)
+
+    def delete(self, record_ids):
+        """删除多条记录，没有记录引用的图片一并删除，返回删除的记录数"""
+
+        def delete(txn):
+            count = 0
+            for record_id in record_ids:
+                key = record_id.encode("utf-8")
+                value = txn.get(key, db=self.records)
+                if value is None:
+                    continue
+                digest = decode_record(value)["image"]
+                if digest:
+                    self._add_ref(txn, digest, -1)
+                txn.delete(key, db=self.records)
+                count += 1
+            return count
+
+        return self._write(delete)
+
+    def stats(self):
+        with self._begin() as txn:
+            records = txn.stat(self.records)["entries"]
+            images = txn.stat(self.images)["entries"]
+            references = sum(int(value) for _, value in txn.cursor(db=self.refs))
+        data_file = os.path.join(self.path, "data.mdb")
+        return {
+            "records": records,
+            "images": images,
+            "deduplicated_images": references - images,
+            "file_bytes": os.path.getsize(data_file) if os.path.exists(data_file) else 0,
+        }
+
+    def compact(self):
+        """复制出不含空闲页的新环境并替换，返回 (压缩前, 压缩后) 的字节数
+
+        替换期间其他进程不能打开该归档
+        """
+        data_file = os.path.join(self.path, "data.mdb")
+        before = os.path.getsize(data_file)
+        compact_path = self.path + ".compact"
+        old_path = self.path + ".old"
+        for path in (compact_path, old_path):
+            if os.path.exists(path):
+                shutil.rmtree(path)
+        os.makedirs(compact_path)
+        self.env.copy(compact_path, compact=True)
+        self.env.close()
+        os.replace(self.path, old_path)
+        os.replace(compact_path, self.path)
+        shutil.rmtree(old_path)
+        self._open()
+        return before, os.path.getsize(data_file)
+
+    def close(self):
+        with _archives_lock:
+            if _archives.get(os.path.abspath(self.path)) is self:
+                del _archives[os.path.abspath(self.path)]
+        self.env.close()
+
+
+def loose_record_ids(output_dir="output"):
+    """output/ 中仍以单独文件保存的记录 ID"""
+    return sorted(
+        name[: -len("_result.json")]
+        for name in os.listdir(output_dir)
+        if name.endswith("_result.json") and ".tmp" not in name
+    )
+
+
+def pack_output(archive, output_dir="output", before=None, keep=False):
+    """把 output/ 中的记录打包进归档，返回统计信息
+
+    before 为时间戳，只打包更早创建的记录；keep 为 False 时打包后删除原文件和缩小图。
+    每批记录在 output/ 锁内读取、写入并删除，不会与正在保存的编辑交错
+    """
+    from history import parse_timestamp
+
+    record_ids = [
+        record_id
+        for record_id in loose_record_ids(output_dir)
+        if before is None or parse_timestamp(record_id) < before
+    ]
+    stats = {"records": 0, "new_images": 0, "loose_bytes": 0}
+    for start in range(0, len(record_ids), PACK_BATCH):
+        with FileLock(os.path.join(output_dir, ".lock")):
+            items = []
+            for record_id in record_ids[start : start + PACK_BATCH]:
+                result_path = os.path.join(output_dir, f"{record_id}_result.json")
+                image_path = os.path.join(output_dir, f"{record_id}_image.png")
+                try:
+                    with open(result_path, "r", encoding="utf-8") as f:
+                        result = json.load(f)
+                    stats["loose_bytes"] += os.path.getsize(result_path)
+                    image_data = None
+                    if os.path.exists(image_path):
+                        with open(image_path, "rb") as f:
+                            image_data = f.read()
+                        stats["loose_bytes"] += len(image_data)
+                except Exception as e:
+                    print(f"读取记录出错: {record_id}: {str(e)}")
+                    continue
+                items.append((record_id, result, image_data))
+            stats["new_images"] += archive.put_many(items)
+            stats["records"] += len(items)
+            if keep:
+                continue
+            for record_id, _, _ in items:
+                os.remove(os.path.join(output_dir, f"{record_id}_result.json"))
+                remove_pyramid(os.path.join(output_dir, f"{record_id}_image.png"))
+    if not keep:
+        # 查看已归档记录时还原出的图片，归档中已有原样的副本
+        loose = set(loose_record_ids(output_dir))
+        for name in os.listdir(output_dir):
+            if not name.endswith("_image.png"):
+                continue
+            record_id = name[: -len("_image.png")]
+            if record_id not in loose and record_id in archive:
+                remove_pyramid(os.path.join(output_dir, name))
+    return stats
+
+
+def unpack_archive(archive, record_ids=None, output_dir="output", remove=False):
+    """把归档中的记录还原为 output/ 中的单独文件，返回还原的记录数"""
+    if record_ids is None:
+        record_ids = [record_id for record_id, _ in archive.items()]
+    restored = []
+    with FileLock(os.path.join(output_dir, ".lock")):
+        for record_id in record_ids:
+            result, image_data = archive.get(record_id)
+            if result is None:
+                continue
+            result_path = os.path.join(output_dir, f"{record_id}_result.json")
+            # 单独文件比归档更新时保留单独文件
+            if not os.path.exists(result_path):
+                FileManager.write_json_atomic(result_path, result)
+            image_path = os.path.join(output_dir, f"{record_id}_image.png")
+            if image_data and not os.path.exists(image_path):
+                FileManager.write_bytes_atomic(image_path, image_data)
+            restored.append(record_id)
+    if remove:
+        archive.delete(restored)
+    return len(restored)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="打包、压缩和还原历史记录归档")
+    parser.add_argument("--output-dir", default="output", help="历史记录目录")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    pack = subparsers.add_parser("pack", help="把单独保存的记录打包进归档")
+    pack.add_argument(
+        "--older-than", type=float, help="只打包创建超过该天数的记录"
+    )
+    pack.add_argument("--keep", action="store_true", help="打包后保留原文件")
+    subparsers.add_parser("compact", help="回收已删除记录占用的空间（需先关闭程序）")
+    subparsers.add_parser("stats", help="显示归档统计信息")
+    unpack = subparsers.add_parser("unpack", help="把归档中的记录还原为单独文件")
+    unpack.add_argument("ids", nargs="*", help="要还原的记录 ID，默认全部")
+    unpack.add_argument(
+        "--remove", action="store_true", help="还原后从归档中删除这些记录"
+    )
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.output_dir):
+        parser.error(f"目录不存在: {args.output_dir}")
+    path = os.path.join(args.output_dir, "archive.lmdb")
+    archive = open_archive(path, create=args.command == "pack")
+    if archive is None:
+        print(f"归档不存在: {path}", file=sys.stderr)
+        return 1
+
+    try:
+        if args.command == "pack":
+            before = None
+            if args.older_than is not None:
+                before = time.time() - args.older_than * 86400
+            start = time.perf_counter()
+            stats = pack_output(archive, args.output_dir, before, args.keep)
+            stats["seconds"] = time.perf_counter() - start
+            stats.update(archive.stats())
+            print(json.dumps(stats, ensure_ascii=False, indent=4))
+        elif args.command == "compact":
+            before, after = archive.compact()
+            print(f"已压缩归档: {before} -> {after} 字节", file=sys.stderr)
+        elif args.command == "stats":
+            print(json.dumps(archive.stats(), ensure_ascii=False, indent=4))
+        else:
+            count = unpack_archive(
+                archive, args.ids or None, args.output_dir, args.remove
+            )
+            print(f"已还原 {count} 条记录", file=sys.stderr)
+    finally:
+        archive.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from PyQt6.QtCore import QObject, QTimer
+
+from utils import FileManager, FileLock
+
+# 编辑停止后多久写入磁盘（毫秒）
+DEFAULT_DEBOUNCE_MS = 500
+
+
+class AutoSaver(QObject):
+    """在内存中维护当前记录，合并一段时间内的编辑后在后台原子写入"""
+
+    def __init__(self, store, debounce_ms=DEFAULT_DEBOUNCE_MS, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.record_id = None
+        self._record = None
+        self._dirty = False
+        # 单线程写入，保证同一文件的写入顺序
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(debounce_ms)
+        self._timer.timeout.connect(self.flush)
+
+    def set_record(self, record_id):
+        """切换当前编辑的记录，切换前写入未保存的修改，返回记录内容的副本"""
+        if record_id is not None and record_id == self.record_id and self._record:
+            # 仍是当前记录时内存中的内容最新，无需重新读取
+            return dict(self._record)
+        # 等待写入完成，避免读到修改前的内容
+        self.sync()
+        self.record_id = record_id
+        self._record = None
+        if record_id is None:
+            return None
+
+        # 已归档的记录修改后重新写为单独文件，下次打包时更新归档
+        self._record, _ = FileManager.load_result(record_id, load_image=False)
+        if not self._record:
+            # 读取失败时没有可保存的记录
+            self.record_id = None
+            return None
+        return dict(self._record)
+
+    def update(self, **fields):
+        """修改当前记录的字段，延迟写入"""
+        if self._record is None:
+            return
+        if all(self._record.get(key) == value for key, value in fields.items()):
+            return
+        self._record.update(fields)
+        self._dirty = True
+        self._timer.start()
+
+    def save(self, record_id, **fields):
+        """修改非当前记录的字段并在后台写入，是当前记录时同 update()"""
+        if record_id == self.record_id:
+            self.update(**fields)
+            return
+        self._executor.submit(self._save, record_id, fields)
+
+    def _save(self, record_id, fields):
+        record, _ = FileManager.load_result(record_id, load_image=False)
+        if record is None:
+            print(f"保存编辑内容时出错: 找不到记录 {record_id}")
+            return
+        record.update(fields)
+        self._write(record_id, record)
+
+    def flush(self):
+        """立即提交未保存的修改到后台写入"""
+        self._timer.stop()
+        if not self._dirty or self._record is None:
+            return
+        self._dirty = False
+        self._executor.submit(self._write, self.record_id, dict(self._record))
+
+    def sync(self):
+        """立即写入未保存的修改并等待完成"""
+        self.flush()
+        self._executor.submit(lambda: None).result()
+
+    def discard(self):
+        """放弃未保存的修改并等待正在进行的写入完成"""
+        self._timer.stop()
+        self._dirty = False
+        self.record_id = None
+        self._record = None
+        self._executor.submit(lambda: None).result()
+
+    def shutdown(self):
+        """写入所有修改并停止后台线程"""
+        self.flush()
+        self._executor.shutdown(wait=True)
+
+    def _write(self, record_id, record):
+        try:
+            with FileLock():
+                FileManager.write_json_atomic(self._result_path(record_id), record)
+            self.store.update_formula(record_id, record.get("rec_formula") or "")
+            self.store.update_title(record_id, record.get("title"))
+        except Exception as e:
+            print(f"保存编辑内容时出错: {str(e)}")
+
+    @staticmethod
+    def _result_path(record_id):
+        return os.path.join("output", f"{record_id}_result.json")
@@ -0,0 +1,438 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import statistics
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+# 相对基准允许的默认波动比例
+DEFAULT_TOLERANCE = 0.2
+
+_app = None
+
+
+@contextmanager
+def working_directory(path):
+    """临时切换工作目录，识别和历史记录都写入相对路径 output/"""
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def summarize(samples_ms):
+    """汇总耗时样本（毫秒）"""
+    return {
+        "mean_ms": statistics.fmean(samples_ms),
+        "p50_ms": percentile(samples_ms, 50),
+        "p95_ms": percentile(samples_ms, 95),
+    }
+
+
+def synthetic_formula(width, height, seed=0):
+    """生成一张白底黑字的合成公式图片"""
+    image = np.full((height, width, 3), 255, dtype=np.uint8)
+    rng = random.Random(seed)
+    text = "".join(rng.choice("abcxyz+-=^") for _ in range(max(4, width // 40)))
+    scale = height / 60
+    cv2.putText(
+        image,
+        text,
+        (height // 4, height * 2 // 3),
+        cv2.FONT_HERSHEY_SIMPLEX,
+        scale,
+        (0, 0, 0),
+        max(1, int(scale * 2)),
+    )
+    return image
+
+
+def bench_recognition(args):
+    """识别延迟和吞吐随批次大小、图片尺寸的变化"""
+    from model import FormulaRecognizer
+
+    recognizer = FormulaRecognizer(model_name=args.model, stub=args.stub)
+    recognizer.warm_up()
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir, working_directory(workdir):
+        os.makedirs("output")
+        for size in args.image_sizes:
+            width, height = size
+            images = [
+                synthetic_formula(width, height, seed) for seed in range(args.images)
+            ]
+            prefix = f"recognize.{width}x{height}"
+
+            # 单张识别，包含写入结果文件
+            samples = []
+            for index, image in enumerate(images[: args.repeat]):
+                start = time.perf_counter()
+                recognizer.recognize(image, f"bench_{index}")
+                samples.append((time.perf_counter() - start) * 1000)
+            for key, value in summarize(samples).items():
+                results[f"{prefix}.single.{key}"] = value
+
+            for batch_size in args.batch_sizes:
+                start = time.perf_counter()
+                recognizer.recognize_batch(images, batch_size=batch_size)
+                elapsed = time.perf_counter() - start
+                results[f"{prefix}.batch{batch_size}.per_image_ms"] = (
+                    elapsed * 1000 / len(images)
+                )
+                results[f"{prefix}.batch{batch_size}.images_per_s"] = (
+                    len(images) / elapsed if elapsed else 0.0
+                )
+    return results
+
+
+def make_synthetic_history(count, output_dir="output"):
+    """生成包含 count 条记录的 output/ 目录"""
+    os.makedirs(output_dir, exist_ok=True)
+    base = time.mktime((2024, 1, 1, 0, 0, 0, 0, 0, -1))
+    for index in range(count):
+        record_id = time.strftime("%Y%m%d_%H%M%S", time.localtime(base + index))
+        with open(
+            os.path.join(output_dir, f"{record_id}_result.json"), "w", encoding="utf-8"
+        ) as f:
+            json.dump(
+                {"rec_formula": f"x_{{{index}}}^2 + \\frac{{a}}{{b}}"},
+                f,
+                ensure_ascii=False,
+            )
+
+
+def ensure_qt_application():
+    """创建 QApplication，没有显示器时使用 offscreen 平台"""
+    global _app
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt6.QtWidgets import QApplication
+
+    # 保留引用，避免 QApplication 被回收后定时器失效
+    _app = QApplication.instance() or QApplication([])
+    return _app
+
+
+def bench_history(args):
+    """历史记录加载和查询耗时随记录数的变化"""
+    app = ensure_qt_application()
+    from PyQt6.QtCore import QItemSelection, QItemSelectionModel
+    from PyQt6.QtWidgets import QTableView
+    from history import HistoryManager, HistoryStore
+
+    results = {}
+    for count in args.history_sizes:
+        prefix = f"history.{count}"
+        with tempfile.TemporaryDirectory() as workdir, working_directory(workdir):
+            make_synthetic_history(count)
+
+            # 首次打开时从 JSON 文件导入
+            start = time.perf_counter()
+            store = HistoryStore()
+            results[f"{prefix}.migrate_ms"] = (time.perf_counter() - start) * 1000
+
+            view = QTableView()
+            manager = HistoryManager(view, store)
+            start = time.perf_counter()
+            manager.load_history()
+            app.processEvents()
+            results[f"{prefix}.load_history_ms"] = (time.perf_counter() - start) * 1000
+
+            rng = random.Random(0)
+            samples = []
+            for _ in range(args.repeat):
+                index = manager.model.index(rng.randrange(count))
+                start = time.perf_counter()
+                manager.get_selected_item_info(index)
+                samples.append((time.perf_counter() - start) * 1000)
+            results[f"{prefix}.get_selected_item_info_ms"] = statistics.fmean(samples)
+
+            # 搜索：过滤列表时需要统计匹配数并读取第一页
+            for name, query in (("substring", "x_{42}"), ("command", "\\frac")):
+                start = time.perf_counter()
+                manager.search(query)
+                manager.model.record(0)
+                results[f"{prefix}.search_{name}_ms"] = (
+                    time.perf_counter() - start
+                ) * 1000
+            manager.search("")
+
+            # 批量操作：重命名和删除前一半记录，再清空剩余记录
+            half = max(1, count // 2)
+            selection = QItemSelection(
+                manager.model.index(0), manager.model.index(half - 1)
+            )
+            view.selectionModel().select(
+                selection, QItemSelectionModel.SelectionFlag.Select
+            )
+            start = time.perf_counter()
+            selected = manager.selected_records()
+            manager.rename_records(
+                {record_id: f"renamed {row}" for row, record_id in selected}
+            )
+            results[f"{prefix}.bulk_rename_ms"] = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            manager.delete_records(manager.selected_records())
+            app.processEvents()
+            results[f"{prefix}.bulk_delete_ms"] = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            manager.clear_records()
+            app.processEvents()
+            results[f"{prefix}.clear_ms"] = (time.perf_counter() - start) * 1000
+            store.close()
+    return results
+
+
+def bench_autosave(args):
+    """编辑时每次按键的保存开销，以及合并后的后台写入耗时"""
+    ensure_qt_application()
+    from autosave import AutoSaver
+    from history import HistoryStore
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir, working_directory(workdir):
+        make_synthetic_history(1)
+        store = HistoryStore()
+        record_id = store.list_records(limit=1)[0]["id"]
+        saver = AutoSaver(store)
+        saver.set_record(record_id)
+
+        text = ""
+        samples = []
+        for index in range(args.keystrokes):
+            text += "x" if index % 5 else "\\"
+            start = time.perf_counter()
+            saver.update(rec_formula=text)
+            samples.append((time.perf_counter() - start) * 1000)
+        for key, value in summarize(samples).items():
+            results[f"save_current_edit.keystroke.{key}"] = value
+
+        start = time.perf_counter()
+        saver.flush()
+        saver.shutdown()
+        results["save_current_edit.flush_ms"] = (time.perf_counter() - start) * 1000
+        store.close()
+    return results
+
+
+def stress_image_size(index):
+    """每个任务使用不同尺寸的图片，占位模型的结果可以反推出是哪个任务"""
+    return 8 + index % 128, 8 + index // 128
+
+
+def _stress_worker(indices, threads):
+    """模拟一个实例：多个线程同时识别、保存结果并写入历史记录"""
+    from history import HistoryStore
+    from model import FormulaRecognizer
+    from utils import FileManager
+
+    recognizer = FormulaRecognizer(stub=True)
+    store = HistoryStore()
+
+    def task(index):
+        width, height = stress_image_size(index)
+        record_id = FileManager.new_record_id()
+        image = np.zeros((height, width, 3), dtype=np.uint8)
+        res = recognizer.recognize(image, record_id)
+        if res is not None:
+            store.add(record_id, {"rec_formula": res["rec_formula"]})
+        return record_id, index
+
+    try:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            return list(executor.map(task, indices))
+    finally:
+        store.close()
+
+
+def bench_stress(args):
+    """多个实例、多个线程同时识别，检查记录 ID 不重复且结果没有丢失"""
+    from history import HistoryStore
+
+    count = args.stress_count
+    processes = max(1, args.stress_processes)
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir, working_directory(workdir):
+        os.makedirs("output")
+        # 先建好数据库，避免各进程同时创建表
+        HistoryStore().close()
+        chunks = [list(range(i, count, processes)) for i in range(processes)]
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [
+                executor.submit(_stress_worker, chunk, args.stress_threads)
+                for chunk in chunks
+            ]
+            outcomes = [item for future in futures for item in future.result()]
+        elapsed = time.perf_counter() - start
+
+        ids = [record_id for record_id, _ in outcomes]
+        store = HistoryStore()
+        lost = 0
+        for record_id, index in outcomes:
+            width, height = stress_image_size(index)
+            expected = f"\\text{{{width}x{height}}}"
+            path = os.path.join("output", f"{record_id}_result.json")
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    saved = json.load(f)["rec_formula"]
+            except (OSError, ValueError, KeyError):
+                saved = None
+            record = store.get(record_id)
+            if saved != expected or record is None or record["rec_formula"] != expected:
+                lost += 1
+        store.close()
+        leftovers = [name for name in os.listdir("output") if ".tmp" in name]
+
+    results["stress.recognitions_per_s"] = count / elapsed if elapsed else 0.0
+    results["stress.duplicate_ids"] = len(ids) - len(set(ids))
+    results["stress.lost"] = lost + count - len(outcomes)
+    results["stress.temp_files"] = len(leftovers)
+    # 旧的秒级时间戳方案在同样负载下会冲突的记录数，仅作对比
+    results["stress.second_resolution_collisions"] = len(ids) - len(
+        {record_id[:15] for record_id in ids}
+    )
+    return results
+
+
+SCENARIOS = {
+    "recognition": bench_recognition,
+    "history": bench_history,
+    "autosave": bench_autosave,
+    "stress": bench_stress,
+}
+
+# 压力测试中必须为 0 的指标
+STRESS_FAILURES = ("stress.duplicate_ids", "stress.lost", "stress.temp_files")
+
+
+def compare(results, baseline, tolerance):
+    """与基准对比，返回退化的指标列表
+
+    以 _ms 结尾的指标越小越好，以 _per_s 结尾的指标越大越好
+    """
+    regressions = []
+    for key, base in baseline.get("results", {}).items():
+        current = results.get(key)
+        if current is None or not base:
+            continue
+        ratio = current / base
+        if key.endswith("_ms") and ratio > 1 + tolerance:
+            regressions.append({"metric": key, "baseline": base, "current": current})
+        elif key.endswith("_per_s") and ratio < 1 - tolerance:
+            regressions.append({"metric": key, "baseline": base, "current": current})
+    return regressions
+
+
+def parse_size(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def parse_list(value, convert=int):
+    return [convert(item) for item in value.split(",") if item]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="识别、历史记录和编辑保存的性能基准")
+    parser.add_argument(
+        "scenarios",
+        nargs="*",
+        default=list(SCENARIOS),
+        help=f"要运行的场景（{', '.join(SCENARIOS)}），默认全部运行",
+    )
+    parser.add_argument("-o", "--output", help="结果 JSON 输出文件")
+    parser.add_argument("--baseline", help="用于对比的基准结果 JSON")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="允许的退化比例，超出时返回非零退出码",
+    )
+    parser.add_argument("--model", default="PP-FormulaNet-S", help="模型名称")
+    parser.add_argument(
+        "--stub", action="store_true", help="使用占位模型，无需 PaddleX 权重"
+    )
+    parser.add_argument(
+        "--batch-sizes", type=parse_list, default=[1, 4, 8, 16], help="批次大小列表"
+    )
+    parser.add_argument(
+        "--image-sizes",
+        type=lambda v: parse_list(v, parse_size),
+        default=[(256, 64), (1024, 256)],
+        help="图片尺寸列表，如 256x64,1024x256",
+    )
+    parser.add_argument("--images", type=int, default=32, help="每种尺寸的图片数")
+    parser.add_argument(
+        "--history-sizes",
+        type=parse_list,
+        default=[1000, 10000],
+        help="历史记录数列表，如 1000,10000,100000",
+    )
+    parser.add_argument("--keystrokes", type=int, default=1000, help="模拟按键次数")
+    parser.add_argument("--repeat", type=int, default=20, help="单项测量的重复次数")
+    parser.add_argument(
+        "--stress-count", type=int, default=2000, help="压力测试的识别次数"
+    )
+    parser.add_argument(
+        "--stress-processes", type=int, default=4, help="压力测试模拟的实例数"
+    )
+    parser.add_argument(
+        "--stress-threads", type=int, default=8, help="压力测试每个实例的线程数"
+    )
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"未知场景: {', '.join(unknown)}")
+
+    results = {}
+    for name in args.scenarios:
+        print(f"运行场景: {name}", file=sys.stderr)
+        results.update(SCENARIOS[name](args))
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "stub": args.stub,
+            "model": args.model,
+        },
+        "results": results,
+    }
+
+    exit_code = 0
+    failures = [key for key in STRESS_FAILURES if results.get(key)]
+    if failures:
+        report["failures"] = {key: results[key] for key in failures}
+        exit_code = 1
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        report["regressions"] = compare(results, baseline, args.tolerance)
+        if report["regressions"]:
+            exit_code = 1
+
+    output = json.dumps(report, ensure_ascii=False, indent=4)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
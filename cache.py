@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import cv2
+import numpy as np
+
+# 缓存默认保存位置
+DEFAULT_CACHE_PATH = os.path.join("output", "recognition_cache.db")
+# 默认最多缓存的结果数量
+DEFAULT_MAX_ENTRIES = 10000
+
+
+def to_cacheable(result):
+    """提取识别结果中可序列化的字段"""
+    return {
+        key: value
+        for key, value in dict(result).items()
+        if isinstance(value, (str, int, float, bool)) or value is None
+    }
+
+
+class RecognitionCache:
+    """按图片像素内容和模型寻址的持久化识别缓存，超出容量时淘汰最久未使用的结果"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(image, model_id):
+        """根据解码后的像素数据和模型标识计算缓存键"""
+        if isinstance(image, str):
+            image = cv2.imread(image, cv2.IMREAD_UNCHANGED)
+            if image is None:
+                return None
+        digest = hashlib.sha256()
+        digest.update(model_id.encode("utf-8"))
+        digest.update(f"{image.shape}{image.dtype}".encode("utf-8"))
+        digest.update(np.ascontiguousarray(image).data)
+        return digest.hexdigest()
+
+    def get(self, key):
+        """查询缓存，未命中时返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key, result):
+        """写入缓存并淘汰超出容量的旧结果"""
+        value = json.dumps(to_cacheable(result), ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, last_access) VALUES (?, ?, ?)",
+                (key, value, time.time()),
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            if count > self.max_entries:
+                removed = self._conn.execute(
+                    """
+                    DELETE FROM entries WHERE key IN (
+                        SELECT key FROM entries ORDER BY last_access LIMIT ?
+                    )
+                    """,
+                    (count - self.max_entries,),
+                ).rowcount
+                self.evictions += removed
+            self._conn.commit()
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+
+    def stats(self):
+        """返回缓存命中统计"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": entries,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,312 @@
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import metrics
+from cache import RecognitionCache
+from preprocess import Preprocessor
+from page import PageRecognizer, LayoutDetector
+from engine import EngineConfig, add_engine_arguments, engine_from_args
+from registry import create_recognizer, parse_models
+from utils import IMAGE_EXTENSIONS
+
+CSV_FIELDS = ["path", "rec_formula", "error"]
+# 整页模式下每个区域一行
+PAGE_CSV_FIELDS = ["path", "bbox", "rec_formula", "error"]
+
+# 每个工作进程内的识别器，只在进程启动时加载一次
+_recognizer = None
+_page_recognizer = None
+
+
+def _init_worker(
+    model_name, stub, cache_path, preprocess, page, layout_model, engine
+):
+    """工作进程初始化，加载模型"""
+    global _recognizer, _page_recognizer
+    # 各阶段耗时随每批结果返回给主进程汇总
+    metrics.REGISTRY.enable_export()
+    cache = RecognitionCache(cache_path) if cache_path else None
+    preprocessor = Preprocessor() if preprocess else None
+    _recognizer = create_recognizer(
+        parse_models(model_name),
+        stub=stub,
+        cache=cache,
+        preprocessor=preprocessor,
+        engine=engine,
+    )
+    if page:
+        detector = LayoutDetector(layout_model) if layout_model else None
+        _page_recognizer = PageRecognizer(_recognizer, detector)
+
+
+def _recognize_chunk(paths, batch_size):
+    """在工作进程中识别一批图片，返回 (记录列表, 本批次的耗时样本)"""
+    if _page_recognizer is not None:
+        records = _recognize_pages(paths, batch_size)
+    else:
+        records = _recognize_images(paths, batch_size)
+    return records, metrics.REGISTRY.export_samples()
+
+
+def _recognize_images(paths, batch_size):
+    """识别每张图片中的单个公式"""
+    records = []
+    for path, (res, error) in zip(
+        paths, _recognizer.recognize_batch(paths, batch_size=batch_size)
+    ):
+        records.append(
+            {
+                "path": path,
+                "rec_formula": res["rec_formula"] if res else None,
+                "error": error,
+            }
+        )
+    return records
+
+
+def _recognize_pages(paths, batch_size):
+    """整页模式下识别每张图片中的所有公式区域"""
+    records = []
+    for path in paths:
+        try:
+            regions = _page_recognizer.recognize_page(path, batch_size=batch_size)
+            records.append({"path": path, "regions": regions, "error": None})
+        except Exception as e:
+            records.append({"path": path, "regions": None, "error": str(e)})
+    return records
+
+
+def collect_images(inputs, recursive=True):
+    """收集目录、通配符或文件列表中的图片"""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, dirs, files in os.walk(item):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        paths.append(os.path.join(root, name))
+                if not recursive:
+                    break
+        elif os.path.isfile(item):
+            paths.append(item)
+        else:
+            for path in sorted(glob.glob(item, recursive=True)):
+                if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS):
+                    paths.append(path)
+    # 去重并保持顺序
+    return list(dict.fromkeys(os.path.normpath(p) for p in paths))
+
+
+def load_checkpoint(output_path, output_format):
+    """读取已有输出文件中已完成的图片，用于断点续跑"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+
+    # 崩溃时最后一行可能只写了一半，截断到最后一个完整行
+    with open(output_path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+    with open(output_path, "r", encoding="utf-8", newline="") as f:
+        if output_format == "csv":
+            for row in csv.DictReader(f):
+                if row.get("path"):
+                    done.add(row["path"])
+        else:
+            for line in f:
+                try:
+                    done.add(json.loads(line)["path"])
+                except (ValueError, KeyError):
+                    continue
+    return done
+
+
+class ResultWriter:
+    """以 JSONL 或 CSV 格式逐条写入结果"""
+
+    def __init__(self, output_path, output_format, append, fieldnames=CSV_FIELDS):
+        exists = append and os.path.exists(output_path)
+        has_header = exists and os.path.getsize(output_path) > 0
+        self.file = open(
+            output_path, "a" if append else "w", encoding="utf-8", newline=""
+        )
+        self.output_format = output_format
+        if output_format == "csv":
+            self.csv_writer = csv.DictWriter(self.file, fieldnames=fieldnames)
+            if not has_header:
+                self.csv_writer.writeheader()
+
+    def write(self, record):
+        if self.output_format == "csv" and "regions" in record:
+            # 整页结果按区域展开为多行
+            for region in record["regions"] or [{"bbox": None, "rec_formula": None}]:
+                self.csv_writer.writerow(
+                    {
+                        "path": record["path"],
+                        "bbox": json.dumps(region["bbox"]),
+                        "rec_formula": region["rec_formula"],
+                        "error": region.get("error") or record["error"],
+                    }
+                )
+        elif self.output_format == "csv":
+            self.csv_writer.writerow(record)
+        else:
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        # 每条结果立即落盘，作为断点
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def run(args):
+    paths = collect_images(args.inputs, recursive=not args.no_recursive)
+    output_format = args.format or (
+        "csv" if args.output.lower().endswith(".csv") else "jsonl"
+    )
+
+    done = load_checkpoint(args.output, output_format) if args.resume else set()
+    pending = [p for p in paths if p not in done]
+    print(
+        f"共 {len(paths)} 张图片，已完成 {len(paths) - len(pending)} 张，"
+        f"待识别 {len(pending)} 张",
+        file=sys.stderr,
+    )
+    if not pending:
+        return 0
+
+    chunk_size = args.batch_size or 8
+    chunks = [
+        pending[i : i + chunk_size] for i in range(0, len(pending), chunk_size)
+    ]
+
+    writer = ResultWriter(
+        args.output,
+        output_format,
+        append=args.resume,
+        fieldnames=PAGE_CSV_FIELDS if args.page else CSV_FIELDS,
+    )
+    # 多个工作进程平分 CPU 核心，避免线程数超过核心数
+    engine = engine_from_args(args)
+    if args.workers > 1 and (engine is None or engine.cpu_threads is None):
+        engine = engine or EngineConfig()
+        engine.cpu_threads = max(1, (os.cpu_count() or 1) // args.workers)
+
+    start_time = time.perf_counter()
+    completed = 0
+    failed = 0
+    try:
+        with ProcessPoolExecutor(
+            max_workers=args.workers,
+            initializer=_init_worker,
+            initargs=(
+                args.model,
+                args.stub,
+                args.cache,
+                args.preprocess,
+                args.page,
+                args.layout_model,
+                engine,
+            ),
+        ) as executor:
+            # 限制同时提交的批次数，避免大目录占用过多内存
+            max_in_flight = args.workers * 2
+            chunk_iter = iter(chunks)
+            in_flight = set()
+            while True:
+                for chunk in chunk_iter:
+                    in_flight.add(
+                        executor.submit(_recognize_chunk, chunk, args.batch_size)
+                    )
+                    if len(in_flight) >= max_in_flight:
+                        break
+                if not in_flight:
+                    break
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    records, samples = future.result()
+                    metrics.REGISTRY.merge(samples)
+                    for record in records:
+                        writer.write(record)
+                        completed += 1
+                        if record["error"]:
+                            failed += 1
+                print(f"进度: {completed}/{len(pending)}", file=sys.stderr)
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start_time
+    print(
+        f"完成 {completed} 张，失败 {failed} 张，耗时 {elapsed:.2f}s "
+        f"({completed / elapsed if elapsed else 0:.2f} 张/秒)",
+        file=sys.stderr,
+    )
+    if args.metrics:
+        write_metrics(args.metrics, completed, failed, elapsed)
+    return 1 if failed else 0
+
+
+def write_metrics(path, completed, failed, elapsed):
+    """把所有工作进程汇总的各阶段耗时写为 Prometheus 文本格式"""
+    text = metrics.REGISTRY.to_prometheus(
+        gauges={
+            "images": completed,
+            "failed": failed,
+            "elapsed_seconds": round(elapsed, 6),
+        }
+    )
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    print(f"各阶段耗时已写入 {path}", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量将公式图片转换为 LaTeX")
+    parser.add_argument("inputs", nargs="+", help="图片目录、通配符或图片文件")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="输出文件")
+    parser.add_argument(
+        "--format", choices=["jsonl", "csv"], help="输出格式，默认按扩展名判断"
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=os.cpu_count() or 1, help="工作进程数"
+    )
+    parser.add_argument("-b", "--batch-size", type=int, help="每次推理的批次大小")
+    parser.add_argument(
+        "--model",
+        default="PP-FormulaNet-S",
+        help="模型名称，逗号分隔多个模型时先用前面的模型，结果无效再换下一个",
+    )
+    parser.add_argument("--cache", help="识别缓存数据库路径，重复图片跳过推理")
+    parser.add_argument(
+        "--preprocess", action="store_true", help="识别前裁剪空白边距并归一化图片"
+    )
+    parser.add_argument(
+        "--page", action="store_true", help="整页模式，识别图片中的所有公式区域"
+    )
+    parser.add_argument(
+        "--layout-model",
+        help="整页模式下使用的 PaddleX 版面分析模型，默认使用连通域检测",
+    )
+    add_engine_arguments(parser)
+    parser.add_argument("--resume", action="store_true", help="从输出文件断点续跑")
+    parser.add_argument("--no-recursive", action="store_true", help="不递归子目录")
+    parser.add_argument(
+        "--metrics", help="结束后把各阶段耗时分位数写入该文件（Prometheus 文本格式）"
+    )
+    parser.add_argument(
+        "--stub", action="store_true", help="使用占位模型，无需 PaddleX 权重"
+    )
+    return run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+import psutil
+
+# 可选的推理后端，auto 表示由 PaddleX 按设备选择
+BACKENDS = ("auto", "paddle", "mkldnn", "onnxruntime")
+# 可选的权重精度，int8/fp16 需要通过 model_dir 指定量化后的权重
+PRECISIONS = ("fp32", "bf16", "int8", "fp16")
+# 自动调优结果的默认保存位置
+DEFAULT_ENGINE_CONFIG = os.path.join("output", "engine.json")
+
+
+class EngineConfig:
+    """推理引擎配置：后端、CPU 线程数和权重精度"""
+
+    def __init__(
+        self,
+        backend="auto",
+        cpu_threads=None,
+        precision="fp32",
+        model_dir=None,
+    ):
+        if backend not in BACKENDS:
+            raise ValueError(f"unknown backend: {backend}")
+        if precision not in PRECISIONS:
+            raise ValueError(f"unknown precision: {precision}")
+        if precision == "bf16" and backend != "mkldnn":
+            raise ValueError("bf16 precision requires the mkldnn backend")
+        if precision in ("int8", "fp16") and not model_dir:
+            raise ValueError(f"{precision} precision requires quantized model_dir")
+        self.backend = backend
+        self.cpu_threads = cpu_threads
+        self.precision = precision
+        self.model_dir = model_dir
+
+    def signature(self):
+        """引擎配置标识"""
+        parts = [self.backend, self.precision]
+        if self.cpu_threads:
+            parts.append(f"t{self.cpu_threads}")
+        return "engine:" + ",".join(parts)
+
+    def weights_id(self):
+        """权重标识，使用默认权重时返回 None
+
+        量化或导出的权重会改变识别结果，需要与默认权重分开缓存；线程数不影响结果
+        """
+        if self.precision == "fp32" and not self.model_dir:
+            return None
+        return f"weights:{self.precision},{os.path.abspath(self.model_dir or '')}"
+
+    def create_model_kwargs(self):
+        """生成 paddlex.create_model 的参数"""
+        kwargs = {"device": "cpu"}
+        if self.model_dir:
+            kwargs["model_dir"] = self.model_dir
+
+        if self.backend == "onnxruntime":
+            # 通过 PaddleX 高性能推理插件使用导出的 ONNX 模型
+            backend_config = {}
+            if self.cpu_threads:
+                backend_config["cpu_num_threads"] = self.cpu_threads
+            kwargs["use_hpip"] = True
+            kwargs["hpi_config"] = {
+                "backend": "onnxruntime",
+                "backend_config": backend_config,
+            }
+            return kwargs
+
+        from paddlex.inference import PaddlePredictorOption
+
+        option = PaddlePredictorOption()
+        if self.backend == "paddle":
+            option.run_mode = "paddle"
+        elif self.backend == "mkldnn":
+            option.run_mode = "mkldnn_bf16" if self.precision == "bf16" else "mkldnn"
+        if self.cpu_threads:
+            option.cpu_threads = self.cpu_threads
+        kwargs["pp_option"] = option
+        return kwargs
+
+    def to_dict(self):
+        return {
+            "backend": self.backend,
+            "cpu_threads": self.cpu_threads,
+            "precision": self.precision,
+            "model_dir": self.model_dir,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{key: data.get(key) for key in cls().to_dict() if key in data})
+
+    def save(self, path=DEFAULT_ENGINE_CONFIG):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=4)
+
+    @classmethod
+    def load(cls, path=DEFAULT_ENGINE_CONFIG):
+        """读取保存的引擎配置，文件不存在或无效时返回 None"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return cls.from_dict(json.load(f))
+        except Exception as e:
+            print(f"读取引擎配置出错: {str(e)}")
+            return None
+
+    def __repr__(self):
+        return f"EngineConfig({self.signature()})"
+
+
+def add_engine_arguments(parser):
+    """为命令行添加引擎相关参数"""
+    parser.add_argument(
+        "--engine", choices=BACKENDS, help="推理后端，默认读取自动调优结果"
+    )
+    parser.add_argument(
+        "--threads", type=int, help="每个模型实例使用的 CPU 线程数（算子内并行）"
+    )
+    parser.add_argument(
+        "--precision", choices=PRECISIONS, help="权重精度，默认 fp32 或自动调优结果"
+    )
+    parser.add_argument("--model-dir", help="导出或量化后的模型目录")
+
+
+def engine_from_args(args):
+    """根据命令行参数创建引擎配置，未指定后端时使用自动调优结果
+
+    只指定 --precision 时在自动调优结果上修改精度
+    """
+    if args.engine is None and args.threads is None and args.model_dir is None:
+        tuned = EngineConfig.load()
+        if args.precision is None:
+            return tuned
+        if tuned is not None:
+            return EngineConfig(
+                tuned.backend, tuned.cpu_threads, args.precision, tuned.model_dir
+            )
+    return EngineConfig(
+        backend=args.engine or "auto",
+        cpu_threads=args.threads,
+        precision=args.precision or "fp32",
+        model_dir=args.model_dir,
+    )
+
+
+def candidate_configs(precision="fp32", model_dir=None):
+    """生成待比较的引擎配置，线程数覆盖 1 到物理核心数"""
+    cores = psutil.cpu_count(logical=False) or os.cpu_count() or 1
+    threads = sorted({1, max(1, cores // 2), cores})
+    candidates = []
+    for backend in BACKENDS[1:]:
+        for count in threads:
+            try:
+                candidates.append(
+                    EngineConfig(backend, count, precision, model_dir)
+                )
+            except ValueError:
+                continue
+    return candidates
+
+
+def autotune(
+    images, model_name="PP-FormulaNet-S", candidates=None, repeat=3, stub=False
+):
+    """逐个加载候选配置并测量平均识别耗时，返回按耗时排序的结果"""
+    from model import FormulaRecognizer
+
+    results = []
+    for config in candidates or candidate_configs():
+        try:
+            recognizer = FormulaRecognizer(
+                model_name=model_name, stub=stub, engine=config
+            )
+            recognizer.warm_up()
+            start = time.perf_counter()
+            for _ in range(repeat):
+                recognizer.recognize_batch(images)
+            elapsed = (time.perf_counter() - start) * 1000 / (repeat * len(images))
+            results.append({"config": config, "per_image_ms": elapsed, "error": None})
+        except Exception as e:
+            results.append({"config": config, "per_image_ms": None, "error": str(e)})
+        outcome = results[-1]
+        if outcome["error"]:
+            print(f"{config.signature()} 加载失败: {outcome['error']}")
+        else:
+            print(f"{config.signature()}: {outcome['per_image_ms']:.1f}ms/张")
+    results.sort(
+        key=lambda item: (item["per_image_ms"] is None, item["per_image_ms"] or 0)
+    )
+    return results
+
+
+def main(argv=None):
+    from cli import collect_images
+
+    parser = argparse.ArgumentParser(description="比较推理引擎配置并保存最快的一种")
+    parser.add_argument(
+        "inputs", nargs="+", help="用于测速的图片目录、通配符或图片文件"
+    )
+    parser.add_argument("--model", default="PP-FormulaNet-S", help="模型名称")
+    parser.add_argument(
+        "--precision", choices=PRECISIONS, default="fp32", help="权重精度"
+    )
+    parser.add_argument("--model-dir", help="导出或量化后的模型目录")
+    parser.add_argument("--repeat", type=int, default=3, help="重复次数")
+    parser.add_argument(
+        "-o", "--output", default=DEFAULT_ENGINE_CONFIG, help="最快配置的保存位置"
+    )
+    parser.add_argument(
+        "--stub", action="store_true", help="使用占位模型，无需 PaddleX 权重"
+    )
+    args = parser.parse_args(argv)
+
+    paths = collect_images(args.inputs)
+    if not paths:
+        print("没有找到图片", file=sys.stderr)
+        return 1
+    candidates = candidate_configs(args.precision, args.model_dir)
+    results = autotune(paths, args.model, candidates, args.repeat, args.stub)
+    best = results[0] if results and results[0]["error"] is None else None
+    if best is None:
+        print("所有引擎配置都加载失败", file=sys.stderr)
+        return 1
+
+    best["config"].save(args.output)
+    report = {
+        "best": best["config"].to_dict(),
+        "results": [dict(item, config=item["config"].to_dict()) for item in results],
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=4))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
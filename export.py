@@ -0,0 +1,196 @@
+import os
+import sys
+import json
+import tempfile
+import argparse
+from datetime import datetime, timedelta
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal
+
+from history import DEFAULT_STORE_PATH, HistoryStore
+
+TEX_PREAMBLE = """\\documentclass{article}
+\\usepackage{amsmath}
+\\usepackage{amssymb}
+\\begin{document}
+
+"""
+TEX_END = "\\end{document}\n"
+# 标题中需要转义的 LaTeX 特殊字符
+TEX_SPECIAL_CHARS = {
+    "\\": "\\textbackslash{}",
+    "{": "\\{",
+    "}": "\\}",
+    "#": "\\#",
+    "$": "\\$",
+    "%": "\\%",
+    "&": "\\&",
+    "_": "\\_",
+    "^": "\\^{}",
+    "~": "\\~{}",
+}
+
+
+def escape_tex(text):
+    return "".join(TEX_SPECIAL_CHARS.get(char, char) for char in text)
+
+
+def record_title(record):
+    """记录标题，无标题时使用记录 ID"""
+    return record["title"] or record["id"]
+
+
+def tex_chunks(records):
+    """生成 LaTeX 文档，每条记录一个带标题的行间公式"""
+    yield TEX_PREAMBLE
+    for record in records:
+        yield f"\\paragraph{{{escape_tex(record_title(record))}}}\n"
+        yield f"\\[\n{record['rec_formula']}\n\\]\n\n"
+    yield TEX_END
+
+
+def markdown_chunks(records):
+    """生成 Markdown，每条记录一个标题和 $$ 公式块"""
+    for record in records:
+        yield f"## {record_title(record)}\n\n$$\n{record['rec_formula']}\n$$\n\n"
+
+
+def jsonl_chunks(records):
+    """生成 JSONL，每行一条记录"""
+    for record in records:
+        item = {
+            "id": record["id"],
+            "created": datetime.fromtimestamp(record["created"]).isoformat(),
+            "title": record["title"],
+            "rec_formula": record["rec_formula"],
+        }
+        yield json.dumps(item, ensure_ascii=False) + "\n"
+
+
+# 格式名称 -> (生成函数, 扩展名)
+FORMATS = {
+    "tex": (tex_chunks, ".tex"),
+    "markdown": (markdown_chunks, ".md"),
+    "jsonl": (jsonl_chunks, ".jsonl"),
+}
+
+
+def guess_format(path):
+    """按扩展名判断导出格式"""
+    extension = os.path.splitext(path)[1].lower()
+    for name, (_, format_extension) in FORMATS.items():
+        if extension == format_extension:
+            return name
+    return "jsonl"
+
+
+def export_records(records, path, format=None):
+    """把记录流式写入文件，返回导出的记录数
+
+    先写入同目录的临时文件再替换，导出中断时不会留下不完整的文件
+    """
+    format = format or guess_format(path)
+    generate = FORMATS[format][0]
+    count = 0
+
+    def counted(records):
+        nonlocal count
+        for record in records:
+            count += 1
+            yield record
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="\n") as f:
+            for chunk in generate(counted(records)):
+                f.write(chunk)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return count
+
+
+def export_history(store, path, format=None, since=None, until=None, title=None):
+    """导出历史记录，since/until 为时间戳"""
+    records = store.iter_records(since=since, until=until, title=title)
+    return export_records(records, path, format)
+
+
+class ExportSignals(QObject):
+    """导出完成信号"""
+
+    # 输出文件, 导出记录数, 错误信息（成功时为空字符串）
+    finished = pyqtSignal(str, int, str)
+
+
+class ExportTask(QRunnable):
+    """在线程池中导出历史记录，不阻塞界面"""
+
+    def __init__(self, store, path, format=None, since=None, until=None, title=None):
+        super().__init__()
+        self.store = store
+        self.path = path
+        self.format = format
+        self.since = since
+        self.until = until
+        self.title = title
+        self.signals = ExportSignals()
+
+    def run(self):
+        try:
+            count = export_history(
+                self.store, self.path, self.format, self.since, self.until, self.title
+            )
+        except Exception as e:
+            print(f"导出历史记录出错: {str(e)}")
+            self.signals.finished.emit(self.path, 0, str(e))
+            return
+        self.signals.finished.emit(self.path, count, "")
+
+
+def parse_date(value, end=False):
+    """解析日期或日期时间，end 为 True 时只有日期的值取当天结束"""
+    for pattern in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M"):
+        try:
+            return datetime.strptime(value, pattern).timestamp()
+        except ValueError:
+            continue
+    day = datetime.strptime(value, "%Y-%m-%d")
+    if end:
+        day += timedelta(days=1)
+    return day.timestamp()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="导出历史记录中的公式")
+    parser.add_argument("-o", "--output", required=True, help="输出文件")
+    parser.add_argument(
+        "--format", choices=list(FORMATS), help="输出格式，默认按扩展名判断"
+    )
+    parser.add_argument("--since", help="起始日期，如 2024-01-01")
+    parser.add_argument("--until", help="结束日期（包含当天），如 2024-12-31")
+    parser.add_argument("--title", help="只导出标题包含该文字的记录")
+    parser.add_argument("--store", default=DEFAULT_STORE_PATH, help="历史记录数据库")
+    args = parser.parse_args(argv)
+
+    try:
+        since = parse_date(args.since) if args.since else None
+        until = parse_date(args.until, end=True) if args.until else None
+    except ValueError as e:
+        parser.error(f"无法解析日期: {e}")
+
+    store = HistoryStore(args.store, os.path.dirname(args.store) or ".")
+    try:
+        count = export_history(
+            store, args.output, args.format, since, until, args.title
+        )
+    finally:
+        store.close()
+    print(f"已导出 {count} 条记录到 {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
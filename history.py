@@ -1,49 +1,739 @@
 import os
+import re
 import json
-from PyQt6.QtWidgets import QListWidget
+import sqlite3
+import threading
+from datetime import datetime
+from collections import OrderedDict
+from PyQt6.QtCore import (
+    Qt,
+    QAbstractListModel,
+    QModelIndex,
+    QObject,
+    QRunnable,
+    QSize,
+    QThreadPool,
+    pyqtSignal,
+)
+from PyQt6.QtGui import QIcon, QImage, QImageReader, QPixmap
+from PyQt6.QtWidgets import QAbstractItemView, QHeaderView
 
+from thumbnails import smallest_level_path
+from archive import open_archive
+import metrics
 
-class HistoryManager:
-    def __init__(self, list_widget):
-        self.list_widget = list_widget
+# 历史记录索引数据库
+DEFAULT_STORE_PATH = os.path.join("output", "history.db")
+# 每次从数据库读取的记录数
+PAGE_SIZE = 200
+# 内存中最多保留的分页数
+MAX_PAGES = 10
+# 批量删除时每条 SQL 语句包含的记录数，不超过 SQLite 的参数个数限制
+DELETE_CHUNK = 500
+# 历史列表缩略图尺寸
+THUMBNAIL_SIZE = 32
+# 内存中最多保留的缩略图数
+MAX_THUMBNAILS = 500
+# trigram 索引只能匹配不少于 3 个字符的子串
+MIN_TRIGRAM_LENGTH = 3
 
-    def load_history(self):
-        """加载历史记录"""
-        self.list_widget.clear()
-        if os.path.exists("output"):
-            # 获取所有结果文件并按时间戳排序
-            files = [f for f in os.listdir("output") if f.endswith("_result.json")]
-            # 提取时间戳并排序
-            files.sort(key=lambda x: x.split("_result.json")[0], reverse=True)
-
-            for file in files:
+_COMMAND_PATTERN = re.compile(r"\\([A-Za-z]+)")
+_COMMAND_TERM_PATTERN = re.compile(r"\\[A-Za-z]+")
+
+
+def latex_commands(latex):
+    """提取公式中用到的 LaTeX 命令名，按名称排序后用空格分隔"""
+    return " ".join(sorted(set(_COMMAND_PATTERN.findall(latex or ""))))
+
+
+def fts_phrase(text):
+    """转换为 FTS5 短语，避免查询中的特殊字符被当作语法"""
+    return '"' + text.replace('"', '""') + '"'
+
+
+def parse_query(query):
+    """把搜索文本拆分为 LaTeX 命令（如 \\int）和普通子串"""
+    commands = []
+    substrings = []
+    for term in query.split():
+        if _COMMAND_TERM_PATTERN.fullmatch(term):
+            commands.append(term[1:])
+        else:
+            substrings.append(term)
+    return commands, substrings
+
+
+def parse_timestamp(record_id):
+    """从记录 ID 中解析创建时间，包含微秒时精确到微秒"""
+    try:
+        created = datetime.strptime(record_id[:15], "%Y%m%d_%H%M%S").timestamp()
+    except ValueError:
+        return 0.0
+    microsecond = record_id[16:22]
+    if len(microsecond) == 6 and microsecond.isdigit():
+        created += int(microsecond) / 1e6
+    return created
+
+
+class HistoryStore:
+    """基于 SQLite 的历史记录索引，按记录 ID 查询"""
+
+    def __init__(self, path=DEFAULT_STORE_PATH, output_dir="output"):
+        self.path = path
+        self.output_dir = output_dir
+        self._lock = threading.Lock()
+
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS records (
+                id TEXT PRIMARY KEY,
+                created REAL NOT NULL,
+                title TEXT,
+                rec_formula TEXT NOT NULL DEFAULT '',
+                image TEXT
+            );
+            CREATE INDEX IF NOT EXISTS records_created ON records (created);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS records_text
+                USING fts5(title, rec_formula, tokenize = 'trigram');
+            CREATE VIRTUAL TABLE IF NOT EXISTS records_commands
+                USING fts5(commands);
+            """
+        )
+        self._conn.commit()
+        self.migrate()
+        self.build_search_index()
+
+    def migrate(self):
+        """首次使用时从 output/ 中已有的 JSON 文件导入历史记录"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'migrated'"
+            ).fetchone()
+            if row:
+                return
+
+            rows = []
+            for file in os.listdir(self.output_dir):
+                if not file.endswith("_result.json"):
+                    continue
+                record_id = file.split("_result.json")[0]
                 try:
-                    with open(os.path.join("output", file), "r", encoding="utf-8") as f:
+                    with open(
+                        os.path.join(self.output_dir, file), "r", encoding="utf-8"
+                    ) as f:
                         result = json.load(f)
-                        timestamp = file.split("_result.json")[0]
-                        # 如果有标题就显示标题，否则显示时间戳
-                        display_text = result.get("title", timestamp)
-                        self.list_widget.addItem(display_text)
-                except:
+                except Exception as e:
+                    print(f"导入历史记录出错: {str(e)}")
                     continue
+                rows.append(self._to_row(record_id, result))
 
-    def get_selected_item_info(self, item):
-        """获取选中项的信息"""
-        if not item:
+            # 已打包进归档的记录
+            archive = open_archive(os.path.join(self.output_dir, "archive.lmdb"))
+            if archive is not None:
+                loose = {row[0] for row in rows}
+                for record_id, result in archive.items():
+                    if record_id not in loose:
+                        image_file = f"{record_id}_image.png"
+                        rows.append(self._to_row(record_id, result, image_file))
+
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO records VALUES (?, ?, ?, ?, ?)", rows
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('migrated', ?)",
+                (datetime.now().isoformat(),),
+            )
+            self._conn.commit()
+
+    def build_search_index(self, force=False):
+        """为已有记录建立搜索索引，之后随记录的增删改增量更新"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'search_indexed'"
+            ).fetchone()
+            if row and not force:
+                return
+            self._conn.execute("DELETE FROM records_text")
+            self._conn.execute("DELETE FROM records_commands")
+            cursor = self._conn.execute(
+                "SELECT rowid, title, rec_formula FROM records"
+            )
+            while True:
+                rows = cursor.fetchmany(PAGE_SIZE * 10)
+                if not rows:
+                    break
+                for rowid, title, rec_formula in rows:
+                    self._index(rowid, title, rec_formula)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('search_indexed', ?)",
+                (datetime.now().isoformat(),),
+            )
+            self._conn.commit()
+
+    def _index(self, rowid, title, rec_formula):
+        """写入一条记录的搜索索引，调用方持有锁"""
+        self._conn.execute(
+            "INSERT INTO records_text (rowid, title, rec_formula) VALUES (?, ?, ?)",
+            (rowid, title or "", rec_formula or ""),
+        )
+        self._conn.execute(
+            "INSERT INTO records_commands (rowid, commands) VALUES (?, ?)",
+            (rowid, latex_commands(rec_formula)),
+        )
+
+    def _unindex(self, record_id):
+        """删除一条记录的搜索索引，调用方持有锁"""
+        row = self._conn.execute(
+            "SELECT rowid FROM records WHERE id = ?", (record_id,)
+        ).fetchone()
+        if row:
+            self._conn.execute("DELETE FROM records_text WHERE rowid = ?", row)
+            self._conn.execute("DELETE FROM records_commands WHERE rowid = ?", row)
+
+    def _to_row(self, record_id, result, image_file=None):
+        if image_file is None:
+            image_file = f"{record_id}_image.png"
+            if not os.path.exists(os.path.join(self.output_dir, image_file)):
+                image_file = None
+        return (
+            record_id,
+            parse_timestamp(record_id),
+            result.get("title"),
+            result.get("rec_formula") or "",
+            image_file,
+        )
+
+    def add(self, record_id, result, image_file=None):
+        """新增或覆盖一条记录，未指定图片时按文件名查找"""
+        row = self._to_row(record_id, result, image_file)
+        with self._lock:
+            self._unindex(record_id)
+            cursor = self._conn.execute(
+                "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?)", row
+            )
+            self._index(cursor.lastrowid, row[2], row[3])
+            self._conn.commit()
+
+    def get(self, record_id):
+        """按 ID 获取记录"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, created, title, rec_formula, image FROM records WHERE id = ?",
+                (record_id,),
+            ).fetchone()
+        return self._to_record(row) if row else None
+
+    def list_records(self, limit=-1, offset=0, query=None):
+        """按时间倒序列出记录，指定 query 时只列出匹配的记录"""
+        where, params = self._search_condition(query)
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                SELECT id, created, title, rec_formula, image FROM records
+                {where} ORDER BY created DESC, id DESC LIMIT ? OFFSET ?
+                """,
+                (*params, limit, offset),
+            ).fetchall()
+        return [self._to_record(row) for row in rows]
+
+    def search(self, query, limit=-1, offset=0):
+        """搜索公式和标题
+
+        以反斜杠开头的词（如 \\int \\sum）匹配用到该命令的公式，其他词按子串匹配，
+        多个词需要同时满足
+        """
+        return self.list_records(limit, offset, query)
+
+    @staticmethod
+    def _search_condition(query):
+        """生成搜索条件，长子串和命令走全文索引，短子串逐条比较"""
+        if not query or not query.strip():
+            return "", ()
+        commands, substrings = parse_query(query)
+        conditions = []
+        params = []
+        if commands:
+            conditions.append(
+                "rowid IN (SELECT rowid FROM records_commands "
+                "WHERE records_commands MATCH ?)"
+            )
+            params.append(" AND ".join(fts_phrase(name) for name in commands))
+        long_terms = [term for term in substrings if len(term) >= MIN_TRIGRAM_LENGTH]
+        if long_terms:
+            conditions.append(
+                "rowid IN (SELECT rowid FROM records_text WHERE records_text MATCH ?)"
+            )
+            params.append(" AND ".join(fts_phrase(term) for term in long_terms))
+        for term in substrings:
+            if len(term) < MIN_TRIGRAM_LENGTH:
+                conditions.append(
+                    "(instr(lower(rec_formula), lower(?)) > 0 "
+                    "OR instr(lower(COALESCE(title, id)), lower(?)) > 0)"
+                )
+                params.extend((term, term))
+        return "WHERE " + " AND ".join(conditions), tuple(params)
+
+    def iter_records(self, since=None, until=None, title=None, batch_size=PAGE_SIZE):
+        """按时间顺序逐批读取记录，内存占用与记录总数无关
+
+        since/until 为时间戳，包含 since 不包含 until；title 按标题（无标题时按 ID）
+        模糊匹配。使用 (created, id) 定位下一批，不在两批之间持有锁
+        """
+        conditions = ["(created, id) > (?, ?)"]
+        params = []
+        if since is not None:
+            conditions.append("created >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("created < ?")
+            params.append(until)
+        if title:
+            escaped = (
+                title.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            )
+            conditions.append("COALESCE(title, id) LIKE ? ESCAPE '\\'")
+            params.append(f"%{escaped}%")
+        query = f"""
+            SELECT id, created, title, rec_formula, image FROM records
+            WHERE {" AND ".join(conditions)}
+            ORDER BY created, id LIMIT ?
+        """
+
+        last = (float("-inf"), "")
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    query, (*last, *params, batch_size)
+                ).fetchall()
+            for row in rows:
+                yield self._to_record(row)
+            if len(rows) < batch_size:
+                return
+            last = (rows[-1][1], rows[-1][0])
+
+    def count(self, query=None):
+        """返回记录总数，指定 query 时返回匹配的记录数"""
+        where, params = self._search_condition(query)
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT COUNT(*) FROM records {where}", params
+            ).fetchone()[0]
+
+    def update_title(self, record_id, title):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE records SET title = ? WHERE id = ?", (title, record_id)
+            )
+            self._conn.execute(
+                """
+                UPDATE records_text SET title = ?
+                WHERE rowid = (SELECT rowid FROM records WHERE id = ?)
+                """,
+                (title or "", record_id),
+            )
+            self._conn.commit()
+
+    def update_formula(self, record_id, rec_formula):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE records SET rec_formula = ? WHERE id = ?",
+                (rec_formula, record_id),
+            )
+            self._conn.execute(
+                """
+                UPDATE records_text SET rec_formula = ?
+                WHERE rowid = (SELECT rowid FROM records WHERE id = ?)
+                """,
+                (rec_formula, record_id),
+            )
+            self._conn.execute(
+                """
+                UPDATE records_commands SET commands = ?
+                WHERE rowid = (SELECT rowid FROM records WHERE id = ?)
+                """,
+                (latex_commands(rec_formula), record_id),
+            )
+            self._conn.commit()
+
+    def update_titles(self, titles):
+        """在一个事务中修改多条记录的标题，titles 为 {记录 ID: 标题}"""
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE records SET title = ? WHERE id = ?",
+                [(title, record_id) for record_id, title in titles.items()],
+            )
+            self._conn.executemany(
+                """
+                UPDATE records_text SET title = ?
+                WHERE rowid = (SELECT rowid FROM records WHERE id = ?)
+                """,
+                [(title or "", record_id) for record_id, title in titles.items()],
+            )
+            self._conn.commit()
+
+    def delete(self, record_ids):
+        """在一个事务中删除多条记录，按批使用 IN 条件"""
+        record_ids = list(record_ids)
+        with self._lock:
+            for start in range(0, len(record_ids), DELETE_CHUNK):
+                chunk = record_ids[start : start + DELETE_CHUNK]
+                marks = ", ".join("?" * len(chunk))
+                rowids = f"SELECT rowid FROM records WHERE id IN ({marks})"
+                self._conn.execute(
+                    f"DELETE FROM records_text WHERE rowid IN ({rowids})", chunk
+                )
+                self._conn.execute(
+                    f"DELETE FROM records_commands WHERE rowid IN ({rowids})", chunk
+                )
+                self._conn.execute(
+                    f"DELETE FROM records WHERE id IN ({marks})", chunk
+                )
+            self._conn.commit()
+
+    def clear(self):
+        """删除所有记录，返回被删除的记录 ID"""
+        with self._lock:
+            record_ids = [
+                row[0] for row in self._conn.execute("SELECT id FROM records")
+            ]
+            self._conn.execute("DELETE FROM records_text")
+            self._conn.execute("DELETE FROM records_commands")
+            self._conn.execute("DELETE FROM records")
+            self._conn.commit()
+        return record_ids
+
+    @staticmethod
+    def _to_record(row):
+        record_id, created, title, rec_formula, image = row
+        return {
+            "id": record_id,
+            "created": created,
+            "title": title,
+            "rec_formula": rec_formula,
+            "image": image,
+        }
+
+    def all_ids(self):
+        """返回所有记录 ID"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT id FROM records")]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ThumbnailSignals(QObject):
+    """缩略图加载完成信号"""
+
+    # record_id, 缩略图
+    loaded = pyqtSignal(str, QImage)
+
+
+class ThumbnailLoader(QRunnable):
+    """在线程池中解码并缩放历史记录图片"""
+
+    def __init__(self, record_id, image_path, size):
+        super().__init__()
+        self.record_id = record_id
+        self.image_path = image_path
+        self.size = size
+        self.signals = ThumbnailSignals()
+
+    def run(self):
+        # 优先读取最小的缩小图，避免为缩略图解码原图
+        image = QImageReader(smallest_level_path(self.image_path, self.size)).read()
+        if image.isNull() and not os.path.exists(self.image_path):
+            # 图片只在归档中时直接解码，不写入磁盘
+            archive = open_archive(
+                os.path.join(os.path.dirname(self.image_path), "archive.lmdb")
+            )
+            if archive is not None:
+                _, image_data = archive.get(self.record_id)
+                if image_data:
+                    image = QImage.fromData(image_data)
+        if not image.isNull():
+            image = image.scaled(
+                self.size,
+                self.size,
+                Qt.AspectRatioMode.KeepAspectRatio,
+                Qt.TransformationMode.SmoothTransformation,
+            )
+        self.signals.loaded.emit(self.record_id, image)
+
+
+class HistoryListModel(QAbstractListModel):
+    """按需分页读取历史记录的列表模型，只加载可见行附近的数据"""
+
+    def __init__(self, store, page_size=PAGE_SIZE, max_pages=MAX_PAGES, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.page_size = page_size
+        self.max_pages = max_pages
+        # 搜索条件，为空时列出全部记录
+        self.query = ""
+        self._count = store.count()
+        self._pages = OrderedDict()
+        self._thumbnails = OrderedDict()
+        self._loading = set()
+        self._thread_pool = QThreadPool.globalInstance()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self._count
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        record = self.record(index.row())
+        if record is None:
+            return None
+
+        if role == Qt.ItemDataRole.DisplayRole:
+            # 如果有标题就显示标题，否则显示时间戳
+            return record["title"] or record["id"]
+        if role == Qt.ItemDataRole.UserRole:
+            return record["id"]
+        if role == Qt.ItemDataRole.DecorationRole and record["image"]:
+            return self._thumbnail(record)
+        return None
+
+    def record(self, row):
+        """获取指定行的记录，所在分页不在内存中时从数据库读取"""
+        if row < 0 or row >= self._count:
             return None
+        page_no = row // self.page_size
+        page = self._pages.get(page_no)
+        if page is None:
+            page = self._fetch_page(page_no)
+            # 预取下一页，滚动时无需等待
+            if (page_no + 1) * self.page_size < self._count:
+                self._fetch_page(page_no + 1)
+        else:
+            self._pages.move_to_end(page_no)
+        offset = row - page_no * self.page_size
+        return page[offset] if offset < len(page) else None
 
-        # 获取文件名
-        files = [f for f in os.listdir("output") if f.endswith("_result.json")]
-        for file in files:
-            try:
-                with open(os.path.join("output", file), "r", encoding="utf-8") as f:
-                    result = json.load(f)
-                    timestamp = file.split("_result.json")[0]
-                    # 如果标题匹配，或者没有标题且时间戳匹配
-                    if result.get("title") == item.text() or (
-                        not result.get("title") and timestamp == item.text()
-                    ):
-                        return timestamp
-            except:
-                continue
+    def _fetch_page(self, page_no):
+        page = self._pages.get(page_no)
+        if page is None:
+            with metrics.span("history_page"):
+                page = self.store.list_records(
+                    limit=self.page_size,
+                    offset=page_no * self.page_size,
+                    query=self.query,
+                )
+            self._pages[page_no] = page
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+        return page
+
+    def _thumbnail(self, record):
+        record_id = record["id"]
+        icon = self._thumbnails.get(record_id)
+        if icon is not None:
+            self._thumbnails.move_to_end(record_id)
+            return icon
+
+        # 异步加载缩略图，完成后刷新对应行
+        if record_id not in self._loading:
+            self._loading.add(record_id)
+            loader = ThumbnailLoader(
+                record_id,
+                os.path.join(self.store.output_dir, record["image"]),
+                THUMBNAIL_SIZE,
+            )
+            loader.signals.loaded.connect(self._on_thumbnail_loaded)
+            self._thread_pool.start(loader)
         return None
+
+    def _on_thumbnail_loaded(self, record_id, image):
+        self._loading.discard(record_id)
+        if image.isNull():
+            return
+        self._thumbnails[record_id] = QIcon(QPixmap.fromImage(image))
+        while len(self._thumbnails) > MAX_THUMBNAILS:
+            self._thumbnails.popitem(last=False)
+        row = self.row_of(record_id)
+        if row is not None:
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.ItemDataRole.DecorationRole])
+
+    def row_of(self, record_id):
+        """在已加载的分页中查找记录所在行"""
+        for page_no, page in self._pages.items():
+            for offset, record in enumerate(page):
+                if record["id"] == record_id:
+                    return page_no * self.page_size + offset
+        return None
+
+    def reload(self):
+        """重新读取记录总数并清空分页缓存"""
+        self.beginResetModel()
+        self._pages.clear()
+        self._count = self.store.count(self.query)
+        self.endResetModel()
+
+    def set_query(self, query):
+        """按搜索条件过滤列表"""
+        self.query = query.strip()
+        self.reload()
+
+    def insert_record(self, record_id):
+        """在顶部插入新记录"""
+        # 搜索时新记录不一定匹配，重新读取
+        if self.query:
+            self.reload()
+            return
+        # 其他线程（如监视文件夹）可能同时写入了记录，按实际增加的行数插入
+        count = self.store.count()
+        delta = count - self._count
+        if delta <= 0:
+            self.reload()
+            return
+        self.beginInsertRows(QModelIndex(), 0, delta - 1)
+        self._pages.clear()
+        self._count = count
+        self.endInsertRows()
+
+    def remove_rows(self, rows, record_ids=()):
+        """记录已从数据库删除后移除对应行，连续的行合并为一次通知"""
+        ranges = []
+        for row in sorted(set(rows), reverse=True):
+            if ranges and ranges[-1][0] == row + 1:
+                ranges[-1][0] = row
+            else:
+                ranges.append([row, row])
+        # 分页缓存以数据库为准，之后按需重新读取
+        self._pages.clear()
+        for record_id in record_ids:
+            self._thumbnails.pop(record_id, None)
+        # 从后往前删除，前面的行号不受影响
+        for first, last in ranges:
+            self.beginRemoveRows(QModelIndex(), first, last)
+            self._count -= last - first + 1
+            self.endRemoveRows()
+        if self._count != self.store.count(self.query):
+            self.reload()
+
+    def clear(self):
+        """记录已全部删除后清空列表"""
+        self.beginResetModel()
+        self._pages.clear()
+        self._thumbnails.clear()
+        self._count = 0
+        self.endResetModel()
+
+    def update_records(self):
+        """多条记录内容变化后清空分页缓存，可见行按需重新读取"""
+        self._pages.clear()
+        if self._count:
+            self.dataChanged.emit(
+                self.index(0),
+                self.index(self._count - 1),
+                [Qt.ItemDataRole.DisplayRole],
+            )
+
+    def update_record(self, record_id):
+        """记录内容变化后刷新对应行"""
+        row = self.row_of(record_id)
+        if row is None:
+            return
+        page_no = row // self.page_size
+        self._pages.pop(page_no, None)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.ItemDataRole.DisplayRole])
+
+
+class HistoryManager:
+    def __init__(self, list_view, store=None):
+        self.list_view = list_view
+        self.store = store or HistoryStore()
+        self.model = HistoryListModel(self.store, parent=list_view)
+        self.list_view.setModel(self.model)
+
+        # 使用固定行高的表格视图，布局开销与记录总数无关
+        self.list_view.horizontalHeader().hide()
+        self.list_view.horizontalHeader().setStretchLastSection(True)
+        self.list_view.verticalHeader().hide()
+        self.list_view.verticalHeader().setSectionResizeMode(
+            QHeaderView.ResizeMode.Fixed
+        )
+        self.list_view.verticalHeader().setDefaultSectionSize(THUMBNAIL_SIZE + 4)
+        self.list_view.setShowGrid(False)
+        self.list_view.setWordWrap(False)
+        self.list_view.setSelectionBehavior(
+            QAbstractItemView.SelectionBehavior.SelectRows
+        )
+        self.list_view.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.list_view.setIconSize(QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+
+    def load_history(self):
+        """加载历史记录"""
+        with metrics.span("load_history"):
+            self.model.reload()
+
+    def add_record(self, record_id, result, image_file=None):
+        """新增记录并插入到列表顶部"""
+        self.store.add(record_id, result, image_file)
+        self.model.insert_record(record_id)
+
+    def record_added(self, record_id):
+        """记录已由其他线程写入数据库，只更新列表"""
+        self.model.insert_record(record_id)
+
+    def search(self, query):
+        """只显示匹配搜索条件的记录，query 为空时显示全部"""
+        self.model.set_query(query)
+
+    def rename_record(self, record_id, title):
+        """修改记录标题"""
+        self.store.update_title(record_id, title)
+        self.model.update_record(record_id)
+
+    def rename_records(self, titles):
+        """批量修改标题，titles 为 {记录 ID: 标题}"""
+        self.store.update_titles(titles)
+        if len(titles) == 1:
+            self.model.update_record(next(iter(titles)))
+        else:
+            self.model.update_records()
+
+    def selected_records(self):
+        """一次性解析选中的行，返回 [(行号, 记录 ID)]，按行号排列"""
+        selection = self.list_view.selectionModel()
+        if selection is None:
+            return []
+        rows = sorted({index.row() for index in selection.selectedRows()})
+        selected = []
+        for row in rows:
+            record = self.model.record(row)
+            if record is not None:
+                selected.append((row, record["id"]))
+        return selected
+
+    def delete_records(self, selected):
+        """删除 selected_records() 返回的记录，只移除对应的行"""
+        record_ids = [record_id for _, record_id in selected]
+        self.store.delete(record_ids)
+        self.model.remove_rows([row for row, _ in selected], record_ids)
+
+    def clear_records(self):
+        """删除所有记录，返回被删除的记录 ID"""
+        record_ids = self.store.clear()
+        self.model.clear()
+        return record_ids
+
+    def get_selected_item_info(self, index):
+        """获取选中项的信息"""
+        if index is None or not index.isValid():
+            return None
+        return self.model.data(index, Qt.ItemDataRole.UserRole)
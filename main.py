@@ -1,4 +1,9 @@
 import sys
+import time
+
+# 程序启动时间，用于统计启动各阶段耗时
+STARTUP_TIME = time.perf_counter()
+
 from PyQt6.QtWidgets import (
     QApplication,
     QMainWindow,
@@ -9,15 +14,25 @@ from PyQt6.QtWidgets import (
     QLabel,
     QFileDialog,
     QTextEdit,
-    QListWidget,
+    QTableView,
+    QAbstractItemView,
     QSplitter,
     QSizePolicy,
     QMenu,
     QMessageBox,
     QInputDialog,
     QLineEdit,
+    QComboBox,
+    QDialog,
+    QTableWidget,
+    QTableWidgetItem,
+    QHeaderView,
+    QFormLayout,
+    QCheckBox,
+    QDateEdit,
+    QDialogButtonBox,
 )
-from PyQt6.QtCore import Qt, QUrl, QRegularExpression
+from PyQt6.QtCore import Qt, QUrl, QRegularExpression, QTimer, QThreadPool, QDate
 from PyQt6.QtGui import (
     QPixmap,
     QClipboard,
@@ -30,13 +45,39 @@ from PyQt6.QtGui import (
 )
 from PyQt6.QtWebEngineWidgets import QWebEngineView
 import os
-import json
 import re
 import platform
+from datetime import datetime, timedelta
 
-from utils import FileManager, ClipboardManager
+from utils import (
+    FileManager,
+    ClipboardManager,
+    ImageConverter,
+    ImageWriter,
+)
 from model import FormulaRecognizer
+from engine import EngineConfig
+from registry import (
+    PRESETS,
+    ModelPool,
+    CascadeRecognizer,
+    load_model_config,
+    load_preprocess_config,
+    save_model_config,
+)
+from cache import RecognitionCache
+from preprocess import Preprocessor
 from history import HistoryManager
+from worker import RecognitionWorker
+from autosave import AutoSaver
+from preview import FormulaPreview
+from export import ExportTask
+from watch import WatchThread
+from thumbnails import ImageCache
+from metrics import REGISTRY, format_spans
+
+# 关闭窗口时等待目录监视线程结束的最长时间（毫秒）
+WATCH_STOP_TIMEOUT_MS = 5000
 
 
 class LatexHighlighter(QSyntaxHighlighter):
@@ -80,6 +121,129 @@ class LatexHighlighter(QSyntaxHighlighter):
                 self.setFormat(match.capturedStart(), match.capturedLength(), format)
 
 
+class StatsPanel(QDialog):
+    """各阶段耗时的滚动分位数，每秒刷新一次"""
+
+    COLUMNS = ["Stage", "Count", "Mean (ms)", "p50 (ms)", "p95 (ms)", "p99 (ms)"]
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Stats")
+        self.resize(560, 360)
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.horizontalHeader().setSectionResizeMode(
+            0, QHeaderView.ResizeMode.Stretch
+        )
+        self.counters = QLabel()
+        self.counters.setWordWrap(True)
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.table)
+        layout.addWidget(self.counters)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(1000)
+        self.timer.timeout.connect(self.refresh)
+        self.refresh()
+
+    def showEvent(self, event):
+        self.refresh()
+        self.timer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+    def refresh(self):
+        snapshot = REGISTRY.snapshot()
+        stages = snapshot["stages"]
+        self.table.setRowCount(len(stages))
+        for row, (name, stats) in enumerate(stages.items()):
+            values = [
+                name,
+                str(stats["count"]),
+                f"{stats['mean_ms']:.1f}",
+                f"{stats['p50_ms']:.1f}",
+                f"{stats['p95_ms']:.1f}",
+                f"{stats['p99_ms']:.1f}",
+            ]
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                if column:
+                    item.setTextAlignment(
+                        Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
+                    )
+                self.table.setItem(row, column, item)
+        self.counters.setText(
+            ", ".join(
+                f"{name}: {value}"
+                for name, value in sorted(snapshot["counters"].items())
+            )
+        )
+
+
+class ExportOptionsDialog(QDialog):
+    """导出前选择日期范围和标题过滤条件，与 export.py 的 --since/--until/--title 相同"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Export History")
+        today = QDate.currentDate()
+        self.since_check = QCheckBox("From")
+        self.since_edit = QDateEdit(today.addMonths(-1))
+        self.until_check = QCheckBox("To")
+        self.until_edit = QDateEdit(today)
+        for check, edit in (
+            (self.since_check, self.since_edit),
+            (self.until_check, self.until_edit),
+        ):
+            edit.setCalendarPopup(True)
+            edit.setDisplayFormat("yyyy-MM-dd")
+            edit.setEnabled(False)
+            check.toggled.connect(edit.setEnabled)
+        self.title_edit = QLineEdit()
+        self.title_edit.setPlaceholderText("Title contains...")
+
+        form = QFormLayout()
+        form.addRow(self.since_check, self.since_edit)
+        form.addRow(self.until_check, self.until_edit)
+        form.addRow("Title", self.title_edit)
+        buttons = QDialogButtonBox(
+            QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel
+        )
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout = QVBoxLayout(self)
+        layout.addLayout(form)
+        layout.addWidget(buttons)
+
+    @staticmethod
+    def _timestamp(date, end=False):
+        """日期当天开始的时间戳，end 为 True 时取当天结束"""
+        day = datetime(date.year(), date.month(), date.day())
+        if end:
+            day += timedelta(days=1)
+        return day.timestamp()
+
+    def filters(self):
+        """返回 (since, until, title)，未选择的条件为 None"""
+        since = (
+            self._timestamp(self.since_edit.date())
+            if self.since_check.isChecked()
+            else None
+        )
+        until = (
+            self._timestamp(self.until_edit.date(), end=True)
+            if self.until_check.isChecked()
+            else None
+        )
+        title = self.title_edit.text().strip() or None
+        return since, until, title
+
+
 class MathFormulaConverter(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -88,7 +252,9 @@ class MathFormulaConverter(QMainWindow):
 
         # 初始化工具类
         FileManager.ensure_output_dir()
-        self.recognizer = FormulaRecognizer()
+        self.image_writer = ImageWriter()
+        # 按显示尺寸读取缩小图，解码后的图片保留在内存中
+        self.image_cache = ImageCache()
 
         # 创建主窗口部件
         main_widget = QWidget()
@@ -105,15 +271,32 @@ class MathFormulaConverter(QMainWindow):
         clear_history_btn = QPushButton("Clear All")
         clear_history_btn.clicked.connect(self.clear_history)
         history_header.addWidget(clear_history_btn)
+        export_history_btn = QPushButton("Export...")
+        export_history_btn.clicked.connect(self.export_history)
+        history_header.addWidget(export_history_btn)
+        self.watch_folder_btn = QPushButton("Watch Folder...")
+        self.watch_folder_btn.clicked.connect(self.toggle_watch_folder)
+        history_header.addWidget(self.watch_folder_btn)
         history_header.addStretch()
         left_layout.addLayout(history_header)
 
-        self.history_list = QListWidget()
+        # 搜索框，\int 等命令匹配用到该命令的公式，其他文字按子串匹配
+        self.history_search = QLineEdit()
+        self.history_search.setPlaceholderText("Search: \\int \\sum or text")
+        self.history_search.setClearButtonEnabled(True)
+        self.history_search_timer = QTimer(self)
+        self.history_search_timer.setSingleShot(True)
+        self.history_search_timer.setInterval(150)
+        self.history_search_timer.timeout.connect(self.search_history)
+        self.history_search.textChanged.connect(self.history_search_timer.start)
+        left_layout.addWidget(self.history_search)
+
+        self.history_list = QTableView()
         self.history_list.setSelectionMode(
-            QListWidget.SelectionMode.ExtendedSelection
+            QAbstractItemView.SelectionMode.ExtendedSelection
         )  # 允许多选
-        self.history_list.itemClicked.connect(self.show_history_item)
-        self.history_list.itemDoubleClicked.connect(
+        self.history_list.clicked.connect(self.show_history_item)
+        self.history_list.doubleClicked.connect(
             self.rename_history_item
         )  # 添加双击事件
         self.history_list.setContextMenuPolicy(
@@ -250,31 +433,184 @@ class MathFormulaConverter(QMainWindow):
 
         main_widget.setLayout(main_layout)
 
+        # 尽早加载预览页面，页面在渲染进程中加载，与模型加载并行
+        self.init_mathjax()
+
         # 初始化历史记录管理器
         self.history_manager = HistoryManager(self.history_list)
         self.history_manager.load_history()
 
         # 记录当前正在编辑的文件时间戳
         self.current_timestamp = None
-
-        # 初始化 KaTeX 渲染
-        self.init_mathjax()
+        # 识别完成前输入的编辑 {时间戳: 内容}，记录创建后再写入
+        self.pending_edits = {}
+        # 自动保存当前记录的编辑内容
+        self.autosaver = AutoSaver(self.history_manager.store, parent=self)
 
         # 重写文本框的粘贴事件
         self.latex_text.keyPressEvent = self.text_edit_key_press_event
 
-        # 保存当前显示的图片
+        # 当前显示的图片（适合当前显示尺寸的缩小图）及其原图路径
         self.current_pixmap = None
+        self.current_image_path = None
+        # 调整窗口大小时先快速缩放，停止调整后再平滑缩放
+        self.resize_timer = QTimer(self)
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.setInterval(120)
+        self.resize_timer.timeout.connect(self.refresh_current_image)
+
+        # 识别模型在后台线程中导入和加载，窗口无需等待
+        self.recognizer = None
+        self.models = load_model_config()
+        self.recognition_worker = RecognitionWorker(self.create_recognizer, self)
+        self.recognition_worker.model_ready.connect(self.on_model_ready)
+        self.recognition_worker.model_failed.connect(self.on_model_failed)
+        self.recognition_worker.models_switched.connect(self.on_models_switched)
+        self.recognition_worker.job_finished.connect(self.on_recognition_finished)
+        self.recognition_worker.job_failed.connect(self.on_recognition_failed)
+        self.recognition_worker.job_cancelled.connect(self.on_recognition_cancelled)
+        self.recognition_worker.job_profiled.connect(self.on_recognition_profiled)
+        self.recognition_worker.start()
+        # 最近一次提交的任务，只有它的结果会显示到编辑器
+        self.current_job_id = None
+        self.statusBar().showMessage("Model warming up...")
+        self.init_model_selector()
+
+        # 目录监视线程，未监视时为 None
+        self.watch_thread = None
+        self.watch_status = QLabel()
+        self.statusBar().addPermanentWidget(self.watch_status)
+
+        # 各阶段耗时统计面板，首次打开时创建
+        self.stats_panel = None
+        stats_btn = QPushButton("Stats")
+        stats_btn.setFlat(True)
+        stats_btn.clicked.connect(self.show_stats_panel)
+        self.statusBar().addPermanentWidget(stats_btn)
+
+        # 启动各阶段耗时，首次绘制在事件循环开始后记录
+        self.startup_timings = {}
+        QTimer.singleShot(0, self.on_first_paint)
+
+    def create_recognizer(self):
+        """在后台线程中创建识别器，各模型共用缓存、预处理和引擎配置"""
+        cache = RecognitionCache()
+        # 与命令行的 --preprocess 对应，在 output/models.json 中设置
+        preprocessor = Preprocessor() if load_preprocess_config() else None
+        engine = EngineConfig.load()
+        pool = ModelPool(
+            lambda name: FormulaRecognizer(
+                model_name=name, cache=cache, preprocessor=preprocessor, engine=engine
+            )
+        )
+        return CascadeRecognizer(pool, self.models, cache)
+
+    def init_model_selector(self):
+        """状态栏中的模型选择，切换后无需重启"""
+        self.model_selector = QComboBox()
+        for label, models in PRESETS.items():
+            self.model_selector.addItem(label, models)
+        index = self.model_selector.findData(self.models)
+        if index < 0:
+            # 配置文件中的自定义模型组合
+            self.model_selector.addItem(" → ".join(self.models), self.models)
+            index = self.model_selector.count() - 1
+        self.model_selector.setCurrentIndex(index)
+        self.model_selector.currentIndexChanged.connect(self.on_model_selected)
+        self.statusBar().addPermanentWidget(self.model_selector)
+
+    def on_model_selected(self, index):
+        """切换识别模型"""
+        models = self.model_selector.itemData(index)
+        if not models or models == self.models:
+            return
+        self.models = list(models)
+        save_model_config(self.models)
+        self.statusBar().showMessage(f"Loading {models[0]}...")
+        self.recognition_worker.switch_models(self.models)
+
+    def on_models_switched(self, models):
+        """模型切换完成"""
+        self.statusBar().showMessage(f"Using {' → '.join(models)}", 5000)
+
+    def on_first_paint(self):
+        """记录窗口首次绘制的时间"""
+        self.startup_timings["first_paint"] = time.perf_counter() - STARTUP_TIME
+        self.report_startup_timings()
+
+    def on_model_ready(self, timings):
+        """模型加载完成"""
+        self.recognizer = self.recognition_worker.recognizer
+        self.startup_timings.update(timings)
+        self.startup_timings["model_ready"] = time.perf_counter() - STARTUP_TIME
+        pending = self.recognition_worker.pending_count()
+        if pending:
+            self.statusBar().showMessage(
+                f"Model ready, recognizing {pending} queued image(s)..."
+            )
+        else:
+            self.statusBar().showMessage("Model ready", 5000)
+        self.report_startup_timings()
+
+    def on_model_failed(self, error):
+        """模型加载失败"""
+        self.statusBar().showMessage(f"Failed to load model: {error}")
+
+    def report_startup_timings(self):
+        """首次绘制和模型加载都完成后输出启动耗时"""
+        timings = self.startup_timings
+        if "first_paint" not in timings or "model_ready" not in timings:
+            return
+        print(
+            "启动耗时: "
+            f"首次绘制 {timings['first_paint']:.2f}s, "
+            f"导入 PaddleX {timings.get('import', 0.0):.2f}s, "
+            f"加载模型 {timings.get('model_load', 0.0):.2f}s, "
+            f"预热 {timings.get('warmup', 0.0):.2f}s, "
+            f"模型就绪 {timings['model_ready']:.2f}s"
+        )
 
     def resizeEvent(self, event):
         """处理窗口大小变化事件"""
         super().resizeEvent(event)
         if self.current_pixmap and not self.current_pixmap.isNull():
-            # 重新缩放当前图片
-            scaled_pixmap = self.scale_image(self.current_pixmap)
-            if scaled_pixmap and not scaled_pixmap.isNull():
-                self.image_label.setPixmap(scaled_pixmap)
-                self.image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+            self.display_image(smooth=False)
+            self.resize_timer.start()
+
+    def display_size(self):
+        """图片显示区域的可用尺寸"""
+        return (
+            max(1, self.image_container.width() - 20),  # 减去内边距
+            max(1, self.image_container.height() - 20),
+        )
+
+    def display_image(self, smooth=True):
+        """把当前图片缩放到显示区域"""
+        scaled_pixmap = self.scale_image(self.current_pixmap, smooth)
+        if scaled_pixmap and not scaled_pixmap.isNull():
+            self.image_label.setPixmap(scaled_pixmap)
+            self.image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+
+    def show_record_image(self, image_path):
+        """显示记录的图片，按显示尺寸选择缩小图"""
+        self.current_image_path = image_path
+        self.current_pixmap = self.image_cache.load(image_path, *self.display_size())
+        if self.current_pixmap is None:
+            self.image_label.clear()
+            return
+        self.display_image()
+        # 旧记录没有缩小图时在后台补齐
+        if self.image_cache.missing_pyramid(image_path):
+            self.image_writer.ensure_pyramid(image_path)
+
+    def refresh_current_image(self):
+        """窗口大小稳定后按新尺寸重新选择缩小图并平滑缩放"""
+        if self.current_image_path is None:
+            return
+        pixmap = self.image_cache.load(self.current_image_path, *self.display_size())
+        if pixmap is not None:
+            self.current_pixmap = pixmap
+            self.display_image()
 
     def text_edit_key_press_event(self, event):
         """处理文本框的按键事件"""
@@ -302,38 +638,8 @@ class MathFormulaConverter(QMainWindow):
 
     def init_mathjax(self):
         """初始化 KaTeX 渲染环境"""
-        html = """
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="utf-8">
-            <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/katex@0.16.21/dist/katex.min.css" integrity="sha384-zh0CIslj+VczCZtlzBcjt5ppRcsAmDnRem7ESsYwWwg3m/OaJ2l4x7YBZl9Kxxib" crossorigin="anonymous">
-            <script defer src="https://cdn.jsdelivr.net/npm/katex@0.16.21/dist/katex.min.js" integrity="sha384-Rma6DA2IPUwhNxmrB/7S3Tno0YY7sFu9WSYMCuulLhIqYSGZ2gKCJWIqhBWqMQfh" crossorigin="anonymous"></script>
-            <script defer src="https://cdn.jsdelivr.net/npm/katex@0.16.21/dist/contrib/auto-render.min.js" integrity="sha384-hCXGrW6PitJEwbkoStFjeJxv+fSOOQKOPbJxSfM6G5sWZjAyWhXiTIIAmQqnlLlh" crossorigin="anonymous"></script>
-            <style>
-                body { margin: 0; padding: 20px; }
-                #formula { font-size: 24px; text-align: center; }
-            </style>
-            <script>
-                document.addEventListener("DOMContentLoaded", function() {
-                    renderMathInElement(document.body, {
-                        delimiters: [
-                            {left: '$$', right: '$$', display: true},
-                            {left: '$', right: '$', display: false},
-                            {left: '\\(', right: '\\)', display: false},
-                            {left: '\\[', right: '\\]', display: true}
-                        ],
-                        throwOnError: false
-                    });
-                });
-            </script>
-        </head>
-        <body>
-            <div id="formula"></div>
-        </body>
-        </html>
-        """
-        self.web_view.setHtml(html)
+        self.preview = FormulaPreview(self.web_view, parent=self)
+        self.preview.load_page()
 
     def on_latex_changed(self):
         """处理 LaTeX 代码变化"""
@@ -345,58 +651,17 @@ class MathFormulaConverter(QMainWindow):
             self.save_current_edit()
 
     def save_current_edit(self):
-        """保存当前的编辑内容"""
-        try:
-            # 读取原始结果文件
-            result_file = os.path.join(
-                "output", f"{self.current_timestamp}_result.json"
-            )
-            if os.path.exists(result_file):
-                with open(result_file, "r", encoding="utf-8") as f:
-                    result = json.load(f)
-
-                # 更新 LaTeX 代码
-                result["rec_formula"] = self.latex_text.toPlainText()
-
-                # 保存更新后的结果
-                with open(result_file, "w", encoding="utf-8") as f:
-                    json.dump(result, f, ensure_ascii=False, indent=4)
-        except Exception as e:
-            print(f"保存编辑内容时出错: {str(e)}")
+        """保存当前的编辑内容，由自动保存合并后写入"""
+        text = self.latex_text.toPlainText()
+        if self.autosaver.record_id == self.current_timestamp:
+            self.autosaver.update(rec_formula=text)
+        else:
+            # 识别尚未完成，记录还不存在
+            self.pending_edits[self.current_timestamp] = text
 
     def update_formula_preview(self):
-        """更新公式预览"""
-        latex_code = self.latex_text.toPlainText()
-        try:
-            if latex_code:
-                # 转义反斜杠
-                latex_code = latex_code.replace("\\", "\\\\")
-                # 使用 KaTeX 渲染公式
-                js_code = f"""
-                document.getElementById('formula').innerHTML = '$${latex_code}$$';
-                renderMathInElement(document.getElementById('formula'), {{
-                    delimiters: [
-                        {{left: '$$', right: '$$', display: true}},
-                        {{left: '$', right: '$', display: false}},
-                        {{left: '\\\\(', right: '\\\\)', display: false}},
-                        {{left: '\\\\[', right: '\\\\]', display: true}}
-                    ],
-                    throwOnError: false
-                }});
-                """
-            else:
-                # 如果没有输入，显示提示信息
-                js_code = """
-                document.getElementById('formula').innerHTML = '<span style="color: gray;">请输入 LaTeX 公式</span>';
-                """
-            self.web_view.page().runJavaScript(js_code)
-        except Exception as e:
-            # 在渲染区域显示错误信息
-            error_msg = f"渲染错误:\n{str(e)}"
-            js_code = f"""
-            document.getElementById('formula').innerHTML = '<span style="color: red;">{error_msg}</span>';
-            """
-            self.web_view.page().runJavaScript(js_code)
+        """更新公式预览，连续输入时合并为一次渲染"""
+        self.preview.request(self.latex_text.toPlainText())
 
     def on_clipboard_changed(self):
         """处理剪贴板变化"""
@@ -407,48 +672,16 @@ class MathFormulaConverter(QMainWindow):
         if mime_data.hasImage():
             pixmap = self.clipboard.pixmap()
             if not pixmap.isNull():
-                # 显示图片
-                scaled_pixmap = self.scale_image(pixmap)
-                self.image_label.setPixmap(scaled_pixmap)
-
-                # 生成时间戳
-                timestamp = FileManager.get_timestamp()
-                self.current_timestamp = timestamp
-
-                # 保存原始图片
-                image_file = f"{timestamp}_image.png"
-                pixmap.save(os.path.join("output", image_file))
-
-                # 保存临时图片文件用于识别
-                temp_image_path = os.path.join("output", f"{timestamp}_temp.png")
-                pixmap.save(temp_image_path)
-
-                try:
-                    # 进行公式识别
-                    result = self.recognizer.recognize(temp_image_path, timestamp)
-                    if result:
-                        # 显示LaTeX代码
-                        self.latex_text.setText(result["rec_formula"])
-                        # 更新公式预览
-                        self.update_formula_preview()
-                        # 更新历史记录
-                        self.history_manager.load_history()
-
-                    # 删除临时文件
-                    os.remove(temp_image_path)
-                except Exception as e:
-                    self.latex_text.setText(f"Recognition Error: {str(e)}")
-                    self.update_formula_preview()
-
-    def scale_image(self, pixmap):
-        """缩放图片到合适的大小"""
+                self.process_image(pixmap)
+
+    def scale_image(self, pixmap, smooth=True):
+        """缩放图片到合适的大小，smooth 为 False 时使用更快的缩放"""
         # 获取原始尺寸
         width = pixmap.width()
         height = pixmap.height()
 
         # 获取容器的可用尺寸
-        container_width = self.image_container.width() - 20  # 减去内边距
-        container_height = self.image_container.height() - 20
+        container_width, container_height = self.display_size()
 
         # 如果图片尺寸小于容器尺寸，不进行缩放
         if width <= container_width and height <= container_height:
@@ -470,71 +703,142 @@ class MathFormulaConverter(QMainWindow):
             new_width,
             new_height,
             Qt.AspectRatioMode.KeepAspectRatio,
-            Qt.TransformationMode.SmoothTransformation,
+            (
+                Qt.TransformationMode.SmoothTransformation
+                if smooth
+                else Qt.TransformationMode.FastTransformation
+            ),
         )
 
-    def show_history_item(self, item):
+    def show_history_item(self, index):
         """显示选中的历史记录"""
-        timestamp = self.history_manager.get_selected_item_info(item)
-        result, image = FileManager.load_result(timestamp)
+        timestamp = self.history_manager.get_selected_item_info(index)
+        # 由自动保存读取，包含尚未写入磁盘的编辑
+        result = self.autosaver.set_record(timestamp)
 
         if result:
             self.current_timestamp = timestamp  # 记录当前正在编辑的文件时间戳
+            # 仍在识别的图片完成后不再切换到其结果
+            self.current_job_id = None
             self.latex_text.setText(result["rec_formula"])
-            if image and not image.isNull():
-                # 保存当前图片
-                self.current_pixmap = image.copy()  # 创建图片的副本
-                # 缩放图片
-                scaled_image = self.scale_image(self.current_pixmap)
-                if scaled_image and not scaled_image.isNull():
-                    self.image_label.setPixmap(scaled_image)
-                    self.image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+            self.show_record_image(FileManager.ensure_image(timestamp))
             # 更新公式预览
             self.update_formula_preview()
+        elif self.current_timestamp != timestamp:
+            # 读取失败时继续编辑原来的记录
+            self.autosaver.set_record(self.current_timestamp)
 
     def process_image(self, pixmap):
         """处理图片并显示结果"""
         if pixmap and not pixmap.isNull():
-            # 保存当前图片
-            self.current_pixmap = pixmap.copy()  # 创建图片的副本
-            # 缩放图片
-            scaled_pixmap = self.scale_image(self.current_pixmap)
-            if scaled_pixmap and not scaled_pixmap.isNull():
-                self.image_label.setPixmap(scaled_pixmap)
-                self.image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-
             # 生成时间戳
-            timestamp = FileManager.get_timestamp()
+            timestamp = FileManager.new_record_id()
             self.current_timestamp = timestamp  # 记录当前正在编辑的文件时间戳
+            # 识别完成前没有可保存的记录，期间的编辑在识别完成后写入
+            self.autosaver.set_record(None)
 
-            # 保存原始图片
-            image_file = f"{timestamp}_image.png"
-            pixmap.save(os.path.join("output", image_file))
-
-            # 保存临时图片文件用于识别
-            temp_image_path = os.path.join("output", f"{timestamp}_temp.png")
-            pixmap.save(temp_image_path)
-
-            try:
-                # 进行公式识别
-                result = self.recognizer.recognize(temp_image_path, timestamp)
-                if result:
-                    # 添加标题
-                    result["title"] = f"Formula {timestamp}"
-
-                    # 显示LaTeX代码
-                    self.latex_text.setText(result["rec_formula"])
-                    # 更新公式预览
-                    self.update_formula_preview()
-                    # 更新历史记录
-                    self.history_manager.load_history()
-
-                # 删除临时文件
-                os.remove(temp_image_path)
-            except Exception as e:
-                self.latex_text.setText(f"Recognition Error: {str(e)}")
-                # 更新公式预览以显示错误信息
-                self.update_formula_preview()
+            # 显示时只保留缩小后的图片
+            image_path = os.path.join("output", f"{timestamp}_image.png")
+            self.image_cache.seed(image_path, pixmap)
+            self.show_record_image(image_path)
+
+            # 在后台保存原始图片和缩小图，识别直接使用内存中的像素
+            image = pixmap.toImage()
+            self.image_writer.save(image, image_path, pyramid=True)
+
+            # 提交到后台识别，新的任务会取消尚未开始的旧任务
+            self.current_job_id = self.recognition_worker.submit(
+                ImageConverter.qimage_to_array(image), timestamp
+            )
+            if self.recognition_worker.is_ready():
+                self.statusBar().showMessage("Recognizing...")
+            else:
+                self.statusBar().showMessage(
+                    "Model warming up, image queued for recognition..."
+                )
+
+    def on_recognition_finished(self, job_id, timestamp, result, latency):
+        """处理后台识别完成"""
+        print(f"识别任务 {job_id} 完成，耗时 {latency:.3f}s")
+
+        # 增量更新历史记录
+        self.history_manager.add_record(timestamp, result, f"{timestamp}_image.png")
+
+        # 识别期间输入的内容优先于识别结果
+        pending_edit = self.pending_edits.pop(timestamp, None)
+        if job_id != self.current_job_id:
+            if pending_edit is not None:
+                # 已切换到其他记录，在后台写入
+                self.autosaver.save(timestamp, rec_formula=pending_edit)
+            return
+
+        self.autosaver.set_record(timestamp)
+        if pending_edit is not None:
+            self.autosaver.update(rec_formula=pending_edit)
+        else:
+            # 显示LaTeX代码
+            self.latex_text.setText(result["rec_formula"])
+        # 更新公式预览
+        self.update_formula_preview()
+        stats = self.recognizer.cache.stats()
+        self.statusBar().showMessage(
+            f"Recognized by {result.get('model_name', 'model')} "
+            f"in {latency:.2f}s "
+            f"(cache hits: {stats['hits']}, misses: {stats['misses']})",
+            5000,
+        )
+
+    def on_recognition_profiled(self, job_id, spans):
+        """输出一次识别各阶段的耗时"""
+        print(f"识别任务 {job_id} 各阶段耗时: {format_spans(spans)}")
+
+    def show_stats_panel(self):
+        """打开各阶段耗时统计面板"""
+        if self.stats_panel is None:
+            self.stats_panel = StatsPanel(self)
+        self.stats_panel.show()
+        self.stats_panel.raise_()
+        self.stats_panel.activateWindow()
+
+    def on_recognition_failed(self, job_id, timestamp, error):
+        """处理后台识别失败"""
+        # 识别失败的图片不会出现在历史记录中，删除已保存的图片和缩小图
+        image_path = os.path.join("output", f"{timestamp}_image.png")
+        self.image_writer.remove_image(image_path)
+        pending_edit = self.pending_edits.pop(timestamp, None)
+        if job_id != self.current_job_id:
+            self.image_cache.discard(image_path)
+            return
+
+        # 没有可保存的记录，仍显示的图片保留在内存中
+        self.current_timestamp = None
+        if pending_edit is not None:
+            # 保留识别期间输入的内容，只在状态栏提示错误
+            self.statusBar().showMessage(f"Recognition Error: {error}", 5000)
+            return
+        self.latex_text.setText(f"Recognition Error: {error}")
+        # 更新公式预览以显示错误信息
+        self.update_formula_preview()
+        self.statusBar().clearMessage()
+
+    def on_recognition_cancelled(self, job_id, timestamp):
+        """处理被新任务取代的识别任务"""
+        # 未识别的任务不会出现在历史记录中，删除其图片
+        self.pending_edits.pop(timestamp, None)
+        image_path = os.path.join("output", f"{timestamp}_image.png")
+        self.image_cache.discard(image_path)
+        self.image_writer.remove_image(image_path)
+
+    def closeEvent(self, event):
+        """关闭窗口时停止后台线程并保存未写入的编辑"""
+        if self.watch_thread is not None:
+            # 最多等待当前批次识别完成
+            if not self.watch_thread.stop(WATCH_STOP_TIMEOUT_MS):
+                print("目录监视线程未能及时停止")
+        self.recognition_worker.stop()
+        self.autosaver.shutdown()
+        self.image_writer.shutdown()
+        super().closeEvent(event)
 
     def select_image(self):
         """选择图片文件"""
@@ -557,86 +861,89 @@ class MathFormulaConverter(QMainWindow):
         rename_action = menu.addAction("Rename")
         delete_action = menu.addAction("Delete")
         rename_action.triggered.connect(
-            lambda: self.rename_history_item(self.history_list.itemAt(position))
+            lambda: self.rename_history_item(self.history_list.indexAt(position))
         )
         delete_action.triggered.connect(self.delete_selected_history)
         menu.exec(self.history_list.mapToGlobal(position))
 
-    def rename_history_item(self, item):
-        """重命名历史记录项"""
-        if not item:
+    def rename_history_item(self, index):
+        """重命名历史记录项，选中多项时批量重命名"""
+        if not index or not index.isValid():
+            return
+
+        # 点击的行在多选范围内时重命名所有选中项，否则只重命名该行
+        selected = self.history_manager.selected_records()
+        if index.row() not in {row for row, _ in selected}:
+            record_id = self.history_manager.get_selected_item_info(index)
+            selected = [(index.row(), record_id)] if record_id else []
+        if not selected:
             return
 
         # 获取当前名称
-        current_name = item.text()
+        current_name = index.data()
+        if len(selected) == 1:
+            prompt = "Enter new name:"
+        else:
+            prompt = f"Enter new name for {len(selected)} items (numbered in order):"
 
         # 创建输入对话框
         new_name, ok = QInputDialog.getText(
             self,
             "Rename History Item",
-            "Enter new name:",
+            prompt,
             QLineEdit.EchoMode.Normal,
             current_name,
         )
+        if not ok or not new_name:
+            return
 
-        if ok and new_name and new_name != current_name:
-            # 获取时间戳
-            timestamp = self.history_manager.get_selected_item_info(item)
-            if timestamp:
-                # 更新JSON文件
-                result_file = os.path.join("output", f"{timestamp}_result.json")
-                if os.path.exists(result_file):
-                    try:
-                        with open(result_file, "r", encoding="utf-8") as f:
-                            result = json.load(f)
-
-                        # 更新标题
-                        result["title"] = new_name
-
-                        with open(result_file, "w", encoding="utf-8") as f:
-                            json.dump(result, f, ensure_ascii=False, indent=4)
-
-                        # 更新列表显示
-                        item.setText(new_name)
-                    except Exception as e:
-                        QMessageBox.warning(
-                            self, "Error", f"Failed to rename: {str(e)}"
-                        )
+        if len(selected) == 1:
+            if new_name == current_name:
+                return
+            titles = {selected[0][1]: new_name}
+        else:
+            titles = {
+                record_id: f"{new_name} {number}"
+                for number, (_, record_id) in enumerate(selected, 1)
+            }
+        self.rename_records(titles)
+
+    def rename_records(self, titles):
+        """修改多条记录的标题，索引和列表立即更新，结果文件在后台写入"""
+        current = self.autosaver.record_id
+        if current in titles:
+            # 当前编辑的记录由自动保存写入，避免覆盖未保存的编辑
+            self.autosaver.update(title=titles[current])
+            self.autosaver.flush()
+        others = {
+            record_id: title for record_id, title in titles.items() if record_id != current
+        }
+        if others:
+            self.image_writer.update_titles(others)
+        self.history_manager.rename_records(titles)
 
     def delete_selected_history(self):
         """删除选中的历史记录"""
-        selected_items = self.history_list.selectedItems()
-        if not selected_items:
+        # 一次性解析所有选中行的记录 ID
+        selected = self.history_manager.selected_records()
+        if not selected:
             return
+        record_ids = [record_id for _, record_id in selected]
+        deleted_current = self.current_timestamp in set(record_ids)
 
-        # 获取选中的时间戳
-        timestamps = []
-        for item in selected_items:
-            timestamp = self.history_manager.get_selected_item_info(item)
-            if timestamp:
-                timestamps.append(timestamp)
-
-        # 删除文件
-        for timestamp in timestamps:
-            # 删除图片文件
-            image_file = os.path.join("output", f"{timestamp}_image.png")
-            if os.path.exists(image_file):
-                os.remove(image_file)
-
-            # 删除结果文件
-            result_file = os.path.join("output", f"{timestamp}_result.json")
-            if os.path.exists(result_file):
-                os.remove(result_file)
-
-        # 重新加载历史记录
-        self.history_manager.load_history()
+        # 丢弃正在编辑的记录的未保存修改，避免删除后被重新写入
+        if deleted_current:
+            self.autosaver.discard()
+
+        for record_id in record_ids:
+            self.image_cache.discard(os.path.join("output", f"{record_id}_image.png"))
+        # 先更新索引和列表，文件在后台线程中删除
+        self.history_manager.delete_records(selected)
+        self.image_writer.remove_records(record_ids)
 
         # 如果删除的是当前正在编辑的记录，清空当前编辑
-        if self.current_timestamp in timestamps:
-            self.current_timestamp = None
-            self.latex_text.clear()
-            self.image_label.clear()
-            self.update_formula_preview()
+        if deleted_current:
+            self.clear_current_record()
 
     def clear_history(self):
         """清空所有历史记录"""
@@ -649,36 +956,104 @@ class MathFormulaConverter(QMainWindow):
         )
 
         if reply == QMessageBox.StandardButton.Yes:
-            # 获取所有历史记录
-            items = [
-                self.history_list.item(i) for i in range(self.history_list.count())
-            ]
-            timestamps = []
-            for item in items:
-                timestamp = self.history_manager.get_selected_item_info(item)
-                if timestamp:
-                    timestamps.append(timestamp)
-
-            # 删除所有文件
-            for timestamp in timestamps:
-                # 删除图片文件
-                image_file = os.path.join("output", f"{timestamp}_image.png")
-                if os.path.exists(image_file):
-                    os.remove(image_file)
-
-                # 删除结果文件
-                result_file = os.path.join("output", f"{timestamp}_result.json")
-                if os.path.exists(result_file):
-                    os.remove(result_file)
-
-            # 清空当前编辑
-            self.current_timestamp = None
-            self.latex_text.clear()
-            self.image_label.clear()
-            self.update_formula_preview()
+            self.autosaver.discard()
+            # 先清空索引和列表，文件在后台线程中删除
+            record_ids = self.history_manager.clear_records()
+            self.image_cache.clear()
+            self.image_writer.remove_records(record_ids)
+            self.clear_current_record()
+
+    def clear_current_record(self):
+        """清空当前编辑"""
+        self.current_timestamp = None
+        self.latex_text.clear()
+        self.image_label.clear()
+        self.current_pixmap = None
+        self.current_image_path = None
+        self.update_formula_preview()
 
-            # 重新加载历史记录
-            self.history_manager.load_history()
+    def search_history(self):
+        """按搜索框内容过滤历史记录"""
+        self.history_manager.search(self.history_search.text())
+
+    def export_history(self):
+        """把历史记录导出为 LaTeX、Markdown 或 JSONL 文件，可按日期和标题过滤"""
+        options = ExportOptionsDialog(self)
+        if options.exec() != QDialog.DialogCode.Accepted:
+            return
+        since, until, title = options.filters()
+        file_name, selected_filter = QFileDialog.getSaveFileName(
+            self,
+            "Export History",
+            "formulas.tex",
+            "LaTeX (*.tex);;Markdown (*.md);;JSON Lines (*.jsonl)",
+        )
+        if not file_name:
+            return
+        # 先写入正在编辑的内容，导出结果与界面一致
+        self.autosaver.sync()
+        task = ExportTask(
+            self.history_manager.store, file_name, since=since, until=until, title=title
+        )
+        task.signals.finished.connect(self.on_export_finished)
+        QThreadPool.globalInstance().start(task)
+        self.statusBar().showMessage("Exporting history...")
+
+    def on_export_finished(self, path, count, error):
+        """导出完成"""
+        if error:
+            QMessageBox.warning(self, "Export Failed", error)
+            self.statusBar().clearMessage()
+            return
+        self.statusBar().showMessage(f"Exported {count} formula(s) to {path}", 5000)
+
+    def toggle_watch_folder(self):
+        """开始或停止监视目录，新放入的图片自动识别并加入历史记录"""
+        if self.watch_thread is not None:
+            # 不阻塞界面，当前批次识别完成后由 on_watch_finished 恢复按钮
+            self.watch_thread.request_stop()
+            self.watch_folder_btn.setEnabled(False)
+            self.watch_folder_btn.setText("Stopping...")
+            return
+        directory = QFileDialog.getExistingDirectory(self, "Watch Folder")
+        if not directory:
+            return
+        # 监视线程与粘贴识别共用已加载的模型，不再加载第二份；推理依次执行
+        thread = WatchThread(
+            directory,
+            self.recognition_worker.wait_for_recognizer,
+            self.history_manager.store,
+            self,
+        )
+        thread.record_added.connect(self.history_manager.record_added)
+        thread.metrics_updated.connect(self.on_watch_metrics)
+        thread.failed.connect(self.on_watch_failed)
+        thread.finished.connect(lambda: self.on_watch_finished(thread))
+        self.watch_thread = thread
+        thread.start()
+        self.watch_folder_btn.setText("Stop Watching")
+        self.watch_status.setText(f"Watching {os.path.basename(directory)}")
+
+    def on_watch_metrics(self, metrics):
+        """在状态栏显示目录监视的吞吐量和排队延迟"""
+        self.watch_status.setText(
+            f"Watch: {metrics['recognized']} added, {metrics['queued']} queued, "
+            f"{metrics['images_per_s']:.1f}/s, "
+            f"lag p95 {metrics['lag_p95_ms'] / 1000:.1f}s"
+        )
+
+    def on_watch_failed(self, error):
+        """目录监视启动失败，线程结束后由 on_watch_finished 恢复按钮"""
+        QMessageBox.warning(self, "Watch Folder Failed", error)
+
+    def on_watch_finished(self, thread):
+        """目录监视线程已结束"""
+        if thread is not self.watch_thread:
+            return
+        self.watch_thread = None
+        self.watch_folder_btn.setEnabled(True)
+        self.watch_folder_btn.setText("Watch Folder...")
+        self.watch_status.clear()
 
     def setup_shortcuts(self):
         """设置快捷键"""
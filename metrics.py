@@ -0,0 +1,183 @@
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+# 计算分位数时每个阶段保留的最近样本数
+WINDOW_SIZE = 1024
+# 导出的分位数
+QUANTILES = (0.5, 0.95, 0.99)
+# Prometheus 指标名前缀
+METRIC_PREFIX = "img2latex"
+
+_local = threading.local()
+
+
+class Histogram:
+    """最近 WINDOW_SIZE 个样本的滚动分位数，以及累计的次数和总耗时"""
+
+    def __init__(self, window=WINDOW_SIZE):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def quantiles(self):
+        values = sorted(self.samples)
+        if not values:
+            return {q: 0.0 for q in QUANTILES}
+        return {q: values[min(len(values) - 1, int(q * len(values)))] for q in QUANTILES}
+
+
+class MetricsRegistry:
+    """各阶段耗时直方图和事件计数，线程安全"""
+
+    def __init__(self, window=WINDOW_SIZE):
+        self.window = window
+        self._histograms = {}
+        self._counters = {}
+        # 调用 enable_export() 后才保留新样本，用于从工作进程汇总
+        self.exporting = False
+        self._pending = {}
+        self._pending_counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(self.window)
+            histogram.observe(seconds)
+            if self.exporting:
+                self._pending.setdefault(name, []).append(seconds)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+            if self.exporting:
+                self._pending_counters[name] = (
+                    self._pending_counters.get(name, 0) + value
+                )
+
+    def enable_export(self):
+        """开始保留新样本，之后需要定期调用 export_samples() 取走"""
+        self.exporting = True
+
+    def export_samples(self):
+        """取出自上次调用以来的新样本，可以传给其他进程的 merge()"""
+        with self._lock:
+            samples = (self._pending, self._pending_counters)
+            self._pending = {}
+            self._pending_counters = {}
+        return samples
+
+    def merge(self, samples):
+        """合并 export_samples() 的结果"""
+        observations, counters = samples
+        for name, values in observations.items():
+            for seconds in values:
+                self.observe(name, seconds)
+        for name, value in counters.items():
+            self.increment(name, value)
+
+    def snapshot(self):
+        """返回 {"stages": {阶段: 统计}, "counters": {事件: 次数}}，耗时单位为毫秒"""
+        with self._lock:
+            histograms = list(self._histograms.items())
+            counters = dict(self._counters)
+        stages = {}
+        for name, histogram in sorted(histograms):
+            quantiles = histogram.quantiles()
+            stages[name] = {
+                "count": histogram.count,
+                "mean_ms": histogram.total * 1000 / histogram.count,
+                "p50_ms": quantiles[0.5] * 1000,
+                "p95_ms": quantiles[0.95] * 1000,
+                "p99_ms": quantiles[0.99] * 1000,
+            }
+        return {"stages": stages, "counters": counters}
+
+    def to_prometheus(self, gauges=None):
+        """导出 Prometheus 文本格式，gauges 为额外的 {名称: 数值}"""
+        with self._lock:
+            histograms = sorted(
+                (name, histogram.quantiles(), histogram.total, histogram.count)
+                for name, histogram in self._histograms.items()
+            )
+            counters = sorted(self._counters.items())
+        name = f"{METRIC_PREFIX}_stage_seconds"
+        lines = [
+            f"# HELP {name} Time spent in each recognition pipeline stage.",
+            f"# TYPE {name} summary",
+        ]
+        for stage, quantiles, total, count in histograms:
+            for q, value in quantiles.items():
+                lines.append(f'{name}{{stage="{stage}",quantile="{q}"}} {value:.6f}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+        if counters:
+            name = f"{METRIC_PREFIX}_events_total"
+            lines.append(f"# HELP {name} Number of pipeline events.")
+            lines.append(f"# TYPE {name} counter")
+            for event, value in counters:
+                lines.append(f'{name}{{event="{event}"}} {value}')
+        for gauge, value in sorted((gauges or {}).items()):
+            name = f"{METRIC_PREFIX}_{gauge}"
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._pending = {}
+            self._pending_counters = {}
+
+
+# 进程内默认的指标
+REGISTRY = MetricsRegistry()
+
+
+def observe(name, seconds):
+    """记录一个阶段的耗时，同时加入当前线程正在收集的追踪"""
+    REGISTRY.observe(name, seconds)
+    spans = getattr(_local, "spans", None)
+    if spans is not None:
+        spans.append((name, seconds))
+
+
+def increment(name, value=1):
+    REGISTRY.increment(name, value)
+
+
+@contextmanager
+def span(name):
+    """测量代码块耗时"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+@contextmanager
+def trace():
+    """收集当前线程中一次请求的各阶段耗时，返回 [(阶段, 秒)] 列表"""
+    previous = getattr(_local, "spans", None)
+    spans = _local.spans = []
+    try:
+        yield spans
+    finally:
+        _local.spans = previous
+        if previous is not None:
+            previous.extend(spans)
+
+
+def format_spans(spans):
+    """把追踪结果格式化为一行，如 preprocess=1.2ms inference=80.5ms"""
+    return " ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in spans)
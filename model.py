@@ -1,22 +1,274 @@
-from paddlex import create_model
-from utils import FileManager
 import os
+import json
+import time
+import threading
+import imagesize
+import numpy as np
+import psutil
+
+import metrics
+from preprocess import join_lines
+
+# 批量识别的最大批次大小
+MAX_BATCH_SIZE = 16
+# 每张图片在推理过程中占用的固定内存估计（字节）
+PER_IMAGE_OVERHEAD = 64 * 1024 * 1024
+# 批量识别最多使用的可用内存比例
+MEMORY_FRACTION = 0.25
+
+
+def save_result(res, path):
+    """先写入同目录的临时文件再重命名，读取方不会看到写了一半的结果"""
+    # 临时文件仍以 .json 结尾，PaddleX 结果按扩展名判断保存路径
+    temp_path = f"{path[:-5]}.{os.getpid()}_{threading.get_ident()}.tmp.json"
+    try:
+        res.save_to_json(save_path=temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class FormulaResult(dict):
+    """与 PaddleX 结果接口一致的识别结果"""
+
+    def save_to_json(self, save_path):
+        with open(save_path, "w", encoding="utf-8") as f:
+            json.dump(dict(self), f, ensure_ascii=False, indent=4)
+
+
+class StubFormulaModel:
+    """不依赖 PaddleX 权重的占位模型，用于测试"""
+
+    def predict(self, input, batch_size=1):
+        inputs = input if isinstance(input, list) else [input]
+        for item in inputs:
+            if isinstance(item, str):
+                name = os.path.splitext(os.path.basename(item))[0]
+                yield FormulaResult(input_path=item, rec_formula=f"\\text{{{name}}}")
+            else:
+                height, width = item.shape[:2]
+                yield FormulaResult(
+                    input_path=None, rec_formula=f"\\text{{{width}x{height}}}"
+                )
 
 
 class FormulaRecognizer:
-    def __init__(self):
-        self.model = create_model(model_name="PP-FormulaNet-S")
+    def __init__(
+        self,
+        model_name="PP-FormulaNet-S",
+        stub=False,
+        cache=None,
+        preprocessor=None,
+        engine=None,
+    ):
+        self.model_name = model_name
+        self.cache = cache
+        self.preprocessor = preprocessor
+        self.engine = engine
+        # 各启动阶段耗时（秒）
+        self.timings = {}
+        # 最近一次 recognize() 失败的原因
+        self.last_error = None
+        if stub:
+            self.model = StubFormulaModel()
+            self.model_id = f"{model_name}@stub"
+        else:
+            # paddlex 导入较慢，只在真正需要模型时导入
+            start = time.perf_counter()
+            import paddlex
+            from paddlex import create_model
 
-    def recognize(self, image_path, timestamp):
-        """识别图片中的公式"""
+            self.timings["import"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            if engine is None:
+                self.model = create_model(model_name=model_name)
+            else:
+                self.model = create_model(
+                    model_name=model_name, **engine.create_model_kwargs()
+                )
+            self.timings["model_load"] = time.perf_counter() - start
+            self.model_id = f"{model_name}@{paddlex.__version__}"
+            # 量化权重的识别结果与默认权重不同，分开缓存
+            if engine is not None and engine.weights_id():
+                self.model_id += f"+{engine.weights_id()}"
+        # 预处理会改变输入，不同配置的结果分开缓存
+        if preprocessor is not None:
+            self.model_id += f"+{preprocessor.signature()}"
+
+    def warm_up(self):
+        """用空白图片执行一次推理，避免首次识别时的初始化开销"""
+        start = time.perf_counter()
+        blank = np.full((48, 192, 3), 255, dtype=np.uint8)
+        for _ in self.model.predict(input=blank, batch_size=1):
+            pass
+        self.timings["warmup"] = time.perf_counter() - start
+        return self.timings["warmup"]
+
+    def recognize(self, image, timestamp):
+        """识别图片中的公式，image 为图片路径或 BGR numpy 数组"""
         try:
-            output = self.model.predict(input=image_path, batch_size=1)
-            for res in output:
-                # 保存到带时间戳的文件
-                result_file = f"{timestamp}_result.json"
-                res.save_to_json(save_path=os.path.join("output", result_file))
-                return res
-            return None
+            # 先查询缓存，命中时跳过推理
+            with metrics.span("cache_lookup"):
+                cache_key = self._cache_key(image)
+                res = self._cache_get(cache_key)
+            if res is None:
+                res = self._predict(image)
+                if res is None:
+                    self.last_error = "No formula recognized"
+                    return None
+                if cache_key:
+                    self.cache.put(cache_key, res)
+            # 保存到带时间戳的文件
+            result_file = f"{timestamp}_result.json"
+            with metrics.span("save_result"):
+                save_result(res, os.path.join("output", result_file))
+            self.last_error = None
+            return res
         except Exception as e:
             print(f"识别出错: {str(e)}")
+            self.last_error = str(e)
             return None
+
+    def recognize_batch(self, images, batch_size=None):
+        """批量识别公式，images 为图片路径或 numpy 数组
+
+        按输入顺序返回 (result, error) 列表，单张图片出错不影响其他图片
+        """
+        images = list(images)
+        results = [(None, None)] * len(images)
+
+        # 缓存命中的图片不再参与推理
+        pending = []
+        with metrics.span("cache_lookup"):
+            keys = [self._cache_key(image) for image in images]
+            for index, key in enumerate(keys):
+                cached = self._cache_get(key)
+                if cached is not None:
+                    results[index] = (cached, None)
+                else:
+                    pending.append(index)
+
+        # 预处理后一张图片可能切分为多行，展开后统一分批推理
+        units = []
+        for index in pending:
+            try:
+                lines = self._preprocess(images[index])
+            except Exception as e:
+                results[index] = (None, str(e))
+                continue
+            units.extend((index, line) for line in lines)
+        if not units:
+            return results
+
+        if batch_size is None:
+            batch_size = self.suggest_batch_size([line for _, line in units])
+
+        outputs = [(None, None)] * len(units)
+        for start in range(0, len(units), batch_size):
+            chunk = [line for _, line in units[start : start + batch_size]]
+            try:
+                with metrics.span("inference"):
+                    predicted = list(
+                        self.model.predict(input=chunk, batch_size=len(chunk))
+                    )
+                if len(predicted) != len(chunk):
+                    raise RuntimeError(
+                        f"expected {len(chunk)} results, got {len(predicted)}"
+                    )
+                for offset, res in enumerate(predicted):
+                    outputs[start + offset] = (res, None)
+            except Exception as e:
+                # 整批失败时逐张识别，隔离出错的图片
+                print(f"批量识别出错，改为逐张识别: {str(e)}")
+                for offset, line in enumerate(chunk):
+                    outputs[start + offset] = self._predict_one(line)
+
+        # 合并同一张图片各行的结果
+        grouped = {}
+        for (index, _), output in zip(units, outputs):
+            grouped.setdefault(index, []).append(output)
+        for index, parts in grouped.items():
+            error = next((error for _, error in parts if error), None)
+            if error:
+                results[index] = (None, error)
+                continue
+            res = self._merge_lines(images[index], [res for res, _ in parts])
+            results[index] = (res, None)
+            if keys[index]:
+                self.cache.put(keys[index], res)
+        return results
+
+    def _preprocess(self, image):
+        """预处理图片，返回待识别的图片列表"""
+        if self.preprocessor is None:
+            return [image]
+        with metrics.span("preprocess"):
+            return self.preprocessor.process(image)
+
+    def _predict(self, image):
+        """预处理并识别单张图片"""
+        lines = self._preprocess(image)
+        with metrics.span("inference"):
+            outputs = list(self.model.predict(input=lines, batch_size=len(lines)))
+        if not outputs:
+            return None
+        return self._merge_lines(image, outputs)
+
+    @staticmethod
+    def _merge_lines(image, outputs):
+        """把多行图片的识别结果合并为一个结果"""
+        if len(outputs) == 1:
+            return outputs[0]
+        return FormulaResult(
+            input_path=image if isinstance(image, str) else None,
+            rec_formula=join_lines([res["rec_formula"] for res in outputs]),
+        )
+
+    def _cache_key(self, image):
+        """计算图片的缓存键，未启用缓存或图片无法解码时返回 None"""
+        if self.cache is None:
+            return None
+        try:
+            return self.cache.make_key(image, self.model_id)
+        except Exception as e:
+            print(f"计算缓存键出错: {str(e)}")
+            return None
+
+    def _cache_get(self, key):
+        """查询缓存，命中时返回识别结果"""
+        if not key:
+            return None
+        cached = self.cache.get(key)
+        metrics.increment("cache_hit" if cached is not None else "cache_miss")
+        return FormulaResult(cached) if cached is not None else None
+
+    def _predict_one(self, image):
+        """识别单张已预处理的图片，返回 (result, error)"""
+        try:
+            for res in self.model.predict(input=image, batch_size=1):
+                return res, None
+            return None, "No formula recognized"
+        except Exception as e:
+            return None, str(e)
+
+    @staticmethod
+    def suggest_batch_size(images, max_batch_size=MAX_BATCH_SIZE):
+        """根据图片尺寸和可用内存估计批次大小"""
+        largest = 0
+        for image in images:
+            try:
+                if isinstance(image, str):
+                    width, height = imagesize.get(image)
+                else:
+                    height, width = image.shape[:2]
+            except Exception:
+                continue
+            largest = max(largest, width * height)
+
+        # 解码后的图片按 float32 三通道估计
+        per_image = PER_IMAGE_OVERHEAD + largest * 3 * 4
+        available = psutil.virtual_memory().available * MEMORY_FRACTION
+        return max(1, min(max_batch_size, len(images), int(available // per_image)))
@@ -0,0 +1,120 @@
+import cv2
+import numpy as np
+
+from preprocess import to_gray, foreground_mask
+
+# 公式区域检测使用的 PaddleX 版面分析模型
+DEFAULT_LAYOUT_MODEL = "PP-DocLayout-S"
+# 版面分析结果中属于公式的类别
+FORMULA_LABELS = ("formula", "display_formula", "inline_formula")
+# 裁剪区域时四周额外保留的像素
+REGION_PADDING = 4
+
+
+def detect_regions(image, min_width=16, min_height=8, min_area=256):
+    """用连通域启发式查找候选公式区域，返回 (x, y, w, h) 列表
+
+    先横向膨胀把同一行相邻的符号连成一块，再取连通域外接矩形，
+    适合以公式为主的页面；图文混排的页面建议使用版面分析模型
+    """
+    gray = to_gray(image)
+    mask = foreground_mask(gray).astype(np.uint8)
+    # 膨胀核随字高变化，横向合并符号间距，纵向合并上下标；
+    # 按页面尺寸选择时小图上的短公式会被拆开
+    glyph = glyph_height(mask)
+    kernel = cv2.getStructuringElement(
+        cv2.MORPH_RECT, (max(3, glyph * 3 // 2), max(3, glyph // 2))
+    )
+    merged = cv2.dilate(mask, kernel)
+    count, _, stats, _ = cv2.connectedComponentsWithStats(merged, connectivity=8)
+
+    boxes = []
+    for x, y, w, h, _ in stats[1:count]:
+        if w < min_width or h < min_height or w * h < min_area:
+            continue
+        boxes.append((int(x), int(y), int(w), int(h)))
+    return sort_reading_order(boxes)
+
+
+def glyph_height(mask):
+    """前景中单个符号高度的中位数，没有符号时按页面高度估计"""
+    count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    heights = stats[1:count, cv2.CC_STAT_HEIGHT]
+    # 忽略噪点和分数线等很扁的连通域
+    heights = heights[heights >= 3]
+    if not len(heights):
+        return max(3, mask.shape[0] // 50)
+    return int(np.median(heights))
+
+
+def sort_reading_order(boxes):
+    """按从上到下、从左到右的阅读顺序排序"""
+    if not boxes:
+        return boxes
+    # 纵向位置相近的区域视为同一行
+    tolerance = max(1, int(np.median([h for _, _, _, h in boxes]) // 2))
+    return sorted(boxes, key=lambda box: (box[1] // tolerance, box[0]))
+
+
+class LayoutDetector:
+    """使用 PaddleX 版面分析模型检测公式区域"""
+
+    def __init__(self, model_name=DEFAULT_LAYOUT_MODEL, threshold=0.5):
+        from paddlex import create_model
+
+        self.model = create_model(model_name=model_name)
+        self.threshold = threshold
+
+    def __call__(self, image):
+        boxes = []
+        for res in self.model.predict(input=image, batch_size=1):
+            for box in res["boxes"]:
+                if box["label"] not in FORMULA_LABELS or box["score"] < self.threshold:
+                    continue
+                x1, y1, x2, y2 = (int(round(v)) for v in box["coordinate"])
+                boxes.append((x1, y1, x2 - x1, y2 - y1))
+        return sort_reading_order(boxes)
+
+
+def crop_regions(image, boxes, padding=REGION_PADDING):
+    """按区域裁剪图片"""
+    height, width = image.shape[:2]
+    crops = []
+    for x, y, w, h in boxes:
+        left = max(x - padding, 0)
+        top = max(y - padding, 0)
+        right = min(x + w + padding, width)
+        bottom = min(y + h + padding, height)
+        crops.append(image[top:bottom, left:right])
+    return crops
+
+
+class PageRecognizer:
+    """整页识别：检测所有公式区域后一次批量识别"""
+
+    def __init__(self, recognizer, detector=None):
+        self.recognizer = recognizer
+        # 未指定检测器时使用连通域启发式
+        self.detector = detector or detect_regions
+
+    def recognize_page(self, image, batch_size=None):
+        """识别整页图片，返回每个区域的 bbox 和 LaTeX"""
+        if isinstance(image, str):
+            path = image
+            image = cv2.imread(path, cv2.IMREAD_COLOR)
+            if image is None:
+                raise ValueError(f"unable to read image: {path}")
+
+        boxes = self.detector(image)
+        if not boxes:
+            return []
+        crops = crop_regions(image, boxes)
+        results = self.recognizer.recognize_batch(crops, batch_size=batch_size)
+        return [
+            {
+                "bbox": list(box),
+                "rec_formula": res["rec_formula"] if res else None,
+                "error": error,
+            }
+            for box, (res, error) in zip(boxes, results)
+        ]
@@ -0,0 +1,298 @@
+import sys
+import json
+import time
+import argparse
+
+import cv2
+import numpy as np
+
+# 与背景灰度差超过该值的像素视为前景
+FOREGROUND_THRESHOLD = 40
+# 裁剪后保留的边距（像素）
+CROP_MARGIN = 8
+# 小于该高度的图片会被放大
+MIN_HEIGHT = 32
+# 长边超过该值的图片会被缩小
+MAX_SIDE = 1024
+# 只校正小于该角度的倾斜（度）
+MAX_SKEW_ANGLE = 10.0
+# 多行切分时行间至少需要的空白行数
+MIN_LINE_GAP = 6
+
+
+def to_gray(image):
+    """转换为灰度图"""
+    if image.ndim == 2:
+        return image
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def to_bgr(image):
+    """转换为三通道 BGR 图"""
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+    return image
+
+
+def background_level(gray):
+    """以四周边缘像素的中位数估计背景灰度"""
+    if gray.size == 0:
+        # 空图片按白底处理
+        return 255.0
+    border = np.concatenate((gray[0], gray[-1], gray[:, 0], gray[:, -1]))
+    return float(np.median(border))
+
+
+def foreground_mask(gray, threshold=FOREGROUND_THRESHOLD):
+    """与背景差异明显的像素"""
+    return np.abs(gray.astype(np.int16) - background_level(gray)) > threshold
+
+
+def trim_borders(image, threshold=FOREGROUND_THRESHOLD, margin=CROP_MARGIN):
+    """裁掉四周的空白边距"""
+    if image.size == 0:
+        return image
+    mask = foreground_mask(to_gray(image), threshold)
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if rows.size == 0 or cols.size == 0:
+        return image
+    top = max(rows[0] - margin, 0)
+    bottom = min(rows[-1] + margin + 1, image.shape[0])
+    left = max(cols[0] - margin, 0)
+    right = min(cols[-1] + margin + 1, image.shape[1])
+    return image[top:bottom, left:right]
+
+
+def normalize_contrast(image, binarize=False):
+    """统一为白底黑字并拉伸对比度，binarize 为 True 时使用 Otsu 二值化"""
+    gray = to_gray(image)
+    # 深色背景（如暗色主题截图）反色为白底
+    if background_level(gray) < 128:
+        gray = 255 - gray
+    if binarize:
+        _, gray = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    else:
+        low, high = np.percentile(gray, (1, 99))
+        if high > low:
+            scaled = (gray.astype(np.float32) - low) * (255.0 / (high - low))
+            gray = np.clip(scaled, 0, 255).astype(np.uint8)
+    return to_bgr(gray)
+
+
+def deskew(image, max_angle=MAX_SKEW_ANGLE):
+    """根据前景像素的最小外接矩形校正小角度倾斜"""
+    gray = to_gray(image)
+    coords = np.column_stack(np.nonzero(foreground_mask(gray)))
+    if len(coords) < 10:
+        return image
+    angle = cv2.minAreaRect(coords[:, ::-1].astype(np.float32))[-1]
+    # minAreaRect 的角度范围随 OpenCV 版本不同，统一到 [-45, 45)
+    if angle >= 45:
+        angle -= 90
+    elif angle < -45:
+        angle += 90
+    if abs(angle) < 0.5 or abs(angle) > max_angle:
+        return image
+    height, width = image.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    return cv2.warpAffine(
+        image,
+        matrix,
+        (width, height),
+        flags=cv2.INTER_CUBIC,
+        borderMode=cv2.BORDER_REPLICATE,
+    )
+
+
+def rescale(image, min_height=MIN_HEIGHT, max_side=MAX_SIDE):
+    """放大过小的图片，缩小过大的图片"""
+    height, width = image.shape[:2]
+    if height == 0 or width == 0:
+        return image
+    scale = 1.0
+    if height < min_height:
+        scale = min_height / height
+    if max(height, width) * scale > max_side:
+        scale = max_side / max(height, width)
+    if scale == 1.0:
+        return image
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(image, size, interpolation=interpolation)
+
+
+def split_lines(image, min_gap=MIN_LINE_GAP, threshold=FOREGROUND_THRESHOLD):
+    """按水平投影中的空白行把多行公式切分为单行图片"""
+    has_ink = foreground_mask(to_gray(image), threshold).any(axis=1)
+    # 标记每段连续有墨迹的行的起止位置
+    padded = np.concatenate(([0], has_ink.astype(np.int8), [0]))
+    edges = np.flatnonzero(np.diff(padded))
+    segments = list(zip(edges[::2], edges[1::2]))
+    if not segments:
+        return [image]
+
+    # 合并间距过小的段，避免把分数线、上下标切开
+    merged = [list(segments[0])]
+    for start, end in segments[1:]:
+        if start - merged[-1][1] < min_gap:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [image[start:end] for start, end in merged]
+
+
+class Preprocessor:
+    """识别前的图片预处理流水线，记录每个步骤的耗时"""
+
+    def __init__(
+        self,
+        trim=True,
+        normalize=True,
+        binarize=False,
+        deskew=False,
+        rescale=True,
+        split=False,
+    ):
+        self.trim = trim
+        self.normalize = normalize
+        self.binarize = binarize
+        self.deskew = deskew
+        self.rescale = rescale
+        self.split = split
+        # 步骤名称 -> [次数, 总耗时(秒)]
+        self.timings = {}
+
+    def signature(self):
+        """预处理配置标识，用于区分缓存"""
+        flags = ["trim", "normalize", "binarize", "deskew", "rescale", "split"]
+        return "pre:" + ",".join(flag for flag in flags if getattr(self, flag))
+
+    def _timed(self, name, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        entry = self.timings.setdefault(name, [0, 0.0])
+        entry[0] += 1
+        entry[1] += time.perf_counter() - start
+        return result
+
+    def load(self, image):
+        """读取图片路径或直接使用数组"""
+        if isinstance(image, str):
+            loaded = self._timed("decode", cv2.imread, image, cv2.IMREAD_COLOR)
+            if loaded is None:
+                raise ValueError(f"unable to read image: {image}")
+            return loaded
+        return image
+
+    def process(self, image):
+        """执行预处理，返回图片列表（未启用多行切分时只有一张）"""
+        image = self.load(image)
+        if image.size == 0:
+            raise ValueError("empty image")
+        if self.trim:
+            image = self._timed("trim", trim_borders, image)
+        if self.deskew:
+            image = self._timed("deskew", deskew, image)
+        if self.normalize or self.binarize:
+            image = self._timed("normalize", normalize_contrast, image, self.binarize)
+        else:
+            image = to_bgr(image)
+        if self.rescale:
+            image = self._timed("rescale", rescale, image)
+        if self.split:
+            return self._timed("split", split_lines, image)
+        return [image]
+
+    def stats(self):
+        """返回每个步骤的平均耗时（毫秒）"""
+        return {
+            name: {"count": count, "avg_ms": total * 1000 / count}
+            for name, (count, total) in self.timings.items()
+        }
+
+
+def join_lines(formulas):
+    """合并多行识别结果"""
+    if len(formulas) == 1:
+        return formulas[0]
+    return "\\begin{gathered} " + " \\\\ ".join(formulas) + " \\end{gathered}"
+
+
+def benchmark(paths, recognizer, preprocessor, repeat=1):
+    """对比预处理前后的平均推理耗时，无法读取或处理的图片跳过并记录在 skipped 中"""
+    raw_images = []
+    processed = []
+    skipped = []
+    for path in paths:
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is None or image.size == 0:
+            print(f"无法读取图片，已跳过: {path}", file=sys.stderr)
+            skipped.append(path)
+            continue
+        try:
+            lines = preprocessor.process(image)
+        except Exception as e:
+            print(f"预处理出错，已跳过: {path}: {str(e)}", file=sys.stderr)
+            skipped.append(path)
+            continue
+        raw_images.append(image)
+        processed.extend(lines)
+
+    def average_inference(images):
+        if not raw_images:
+            return 0.0
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for image in images:
+                for _ in recognizer.model.predict(input=image, batch_size=1):
+                    pass
+        return (time.perf_counter() - start) * 1000 / (repeat * len(raw_images))
+
+    raw_pixels = sum(image.shape[0] * image.shape[1] for image in raw_images)
+    processed_pixels = sum(image.shape[0] * image.shape[1] for image in processed)
+    return {
+        "images": len(raw_images),
+        "skipped": skipped,
+        "raw_inference_ms": average_inference(raw_images),
+        "preprocessed_inference_ms": average_inference(processed),
+        "pixel_ratio": processed_pixels / raw_pixels if raw_pixels else 0.0,
+        "steps": preprocessor.stats(),
+    }
+
+
+def main(argv=None):
+    from cli import collect_images
+    from model import FormulaRecognizer
+
+    parser = argparse.ArgumentParser(description="评估预处理对识别耗时的影响")
+    parser.add_argument("inputs", nargs="+", help="图片目录、通配符或图片文件")
+    parser.add_argument("--model", default="PP-FormulaNet-S", help="模型名称")
+    parser.add_argument("--repeat", type=int, default=1, help="重复次数")
+    parser.add_argument("--binarize", action="store_true", help="启用二值化")
+    parser.add_argument("--deskew", action="store_true", help="启用倾斜校正")
+    parser.add_argument("--split", action="store_true", help="启用多行切分")
+    parser.add_argument(
+        "--stub", action="store_true", help="使用占位模型，无需 PaddleX 权重"
+    )
+    args = parser.parse_args(argv)
+
+    paths = collect_images(args.inputs)
+    if not paths:
+        print("没有找到图片", file=sys.stderr)
+        return 1
+    recognizer = FormulaRecognizer(model_name=args.model, stub=args.stub)
+    preprocessor = Preprocessor(
+        binarize=args.binarize, deskew=args.deskew, split=args.split
+    )
+    report = benchmark(paths, recognizer, preprocessor, args.repeat)
+    print(json.dumps(report, ensure_ascii=False, indent=4))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+import os
+import json
+from PyQt6.QtCore import QObject, QTimer, QUrl, pyqtSignal
+
+import metrics
+
+# 输入停止后多久刷新预览（毫秒）
+DEFAULT_DEBOUNCE_MS = 150
+# 超过该耗时的渲染会输出提示（毫秒）
+SLOW_RENDER_MS = 100
+# 随程序分发的 KaTeX 资源目录
+KATEX_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "static", "katex"
+)
+# 预热时渲染的公式，触发常用字体加载
+WARMUP_FORMULA = r"\sum_{i=1}^{n} \int_a^b \frac{\partial f}{\partial x} \mathbb{R} \mathcal{L} \mathrm{d}x"
+
+PREVIEW_HTML = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <link rel="stylesheet" href="katex.min.css">
+    <script src="katex.min.js"></script>
+    <style>
+        body { margin: 0; padding: 20px; }
+        #formula { font-size: 24px; text-align: center; }
+        #error { color: red; font-family: monospace; white-space: pre-wrap; }
+        #warmup { position: absolute; visibility: hidden; font-size: 24px; }
+    </style>
+    <script>
+        // 直接调用 katex.render 渲染公式，返回耗时和错误信息
+        function renderFormula(tex) {
+            var formula = document.getElementById('formula');
+            var error = document.getElementById('error');
+            if (!tex) {
+                formula.innerHTML = '<span style="color: gray;">请输入 LaTeX 公式</span>';
+                error.textContent = '';
+                return {ms: 0, error: null};
+            }
+            var start = performance.now();
+            try {
+                katex.render(tex, formula, {displayMode: true, throwOnError: true});
+                error.textContent = '';
+                return {ms: performance.now() - start, error: null};
+            } catch (e) {
+                // 保留上一次成功渲染的结果，只显示错误信息
+                error.textContent = e.message;
+                return {ms: performance.now() - start, error: String(e.message)};
+            }
+        }
+
+        // 在隐藏元素中渲染示例公式，提前加载字体并预热 KaTeX
+        function warmUp(tex) {
+            var start = performance.now();
+            katex.render(tex, document.getElementById('warmup'), {displayMode: true});
+            return performance.now() - start;
+        }
+    </script>
+</head>
+<body>
+    <div id="formula"></div>
+    <div id="error"></div>
+    <div id="warmup"></div>
+</body>
+</html>
+"""
+
+
+class FormulaPreview(QObject):
+    """公式预览渲染，合并连续输入并跳过未变化的内容"""
+
+    # 渲染耗时(毫秒), 错误信息（无错误时为空字符串）
+    rendered = pyqtSignal(float, str)
+
+    def __init__(self, web_view, debounce_ms=DEFAULT_DEBOUNCE_MS, parent=None):
+        super().__init__(parent)
+        self.web_view = web_view
+        self.page_ready = False
+        self.render_count = 0
+        self.skip_count = 0
+        self.error_count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.warmup_ms = None
+        self._pending = None
+        self._last_rendered = None
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(debounce_ms)
+        self._timer.timeout.connect(self._render)
+        self.web_view.loadFinished.connect(self._on_load_finished)
+
+    def load_page(self):
+        """从本地 KaTeX 资源加载预览页面，不依赖网络"""
+        self.page_ready = False
+        self._last_rendered = None
+        self.web_view.setHtml(
+            PREVIEW_HTML, QUrl.fromLocalFile(os.path.join(KATEX_DIR, ""))
+        )
+
+    def request(self, latex_code):
+        """请求刷新预览，停止输入一段时间后才渲染"""
+        self._pending = latex_code
+        self._timer.start()
+
+    def render_now(self, latex_code):
+        """立即刷新预览"""
+        self._pending = latex_code
+        self._timer.stop()
+        self._render()
+
+    def _on_load_finished(self, ok):
+        self.page_ready = ok
+        if not ok:
+            print("公式预览页面加载失败")
+            return
+        self.web_view.page().runJavaScript(
+            f"warmUp({json.dumps(WARMUP_FORMULA)})", self._on_warmed_up
+        )
+        if self._pending is not None:
+            self._render()
+
+    def _on_warmed_up(self, elapsed):
+        if isinstance(elapsed, (int, float)):
+            self.warmup_ms = float(elapsed)
+
+    def _render(self):
+        # 页面加载完成后会再次渲染
+        if not self.page_ready or self._pending is None:
+            return
+        latex_code = self._pending
+        if latex_code == self._last_rendered:
+            self.skip_count += 1
+            return
+        self._last_rendered = latex_code
+        self.web_view.page().runJavaScript(
+            f"renderFormula({json.dumps(latex_code)})", self._on_rendered
+        )
+
+    def _on_rendered(self, result):
+        if not isinstance(result, dict):
+            return
+        elapsed = float(result.get("ms") or 0.0)
+        error = result.get("error") or ""
+        self.render_count += 1
+        self.total_ms += elapsed
+        metrics.observe("katex_render", elapsed / 1000)
+        self.max_ms = max(self.max_ms, elapsed)
+        if error:
+            self.error_count += 1
+        if elapsed > SLOW_RENDER_MS:
+            print(f"公式渲染耗时 {elapsed:.1f}ms")
+        self.rendered.emit(elapsed, error)
+
+    def stats(self):
+        """返回渲染统计"""
+        return {
+            "renders": self.render_count,
+            "skipped": self.skip_count,
+            "errors": self.error_count,
+            "avg_ms": self.total_ms / self.render_count if self.render_count else 0.0,
+            "max_ms": self.max_ms,
+            "warmup_ms": self.warmup_ms,
+        }
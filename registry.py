@@ -0,0 +1,320 @@
+import gc
+import os
+import re
+import json
+import time
+import threading
+from collections import OrderedDict
+
+import psutil
+
+import metrics
+from model import FormulaRecognizer, save_result
+
+# 可选的公式识别模型及加载后大致占用的内存（MB），实际占用在加载时测量
+MODEL_MEMORY_MB = OrderedDict(
+    [
+        ("PP-FormulaNet-S", 300),
+        ("PP-FormulaNet_plus-S", 300),
+        ("PP-FormulaNet_plus-M", 700),
+        ("PP-FormulaNet-L", 900),
+        ("PP-FormulaNet_plus-L", 900),
+        ("UniMERNet", 1500),
+    ]
+)
+# 界面中可选的识别策略，多个模型时先用小模型，结果无效时再换大模型
+PRESETS = OrderedDict(
+    [
+        ("Fast first (S → L)", ["PP-FormulaNet-S", "PP-FormulaNet-L"]),
+        ("PP-FormulaNet-S", ["PP-FormulaNet-S"]),
+        ("PP-FormulaNet-L", ["PP-FormulaNet-L"]),
+        ("PP-FormulaNet_plus-L", ["PP-FormulaNet_plus-L"]),
+        ("UniMERNet", ["UniMERNet"]),
+    ]
+)
+DEFAULT_MODELS = ["PP-FormulaNet-S"]
+# 模型选择的保存位置
+DEFAULT_MODEL_CONFIG = os.path.join("output", "models.json")
+# 同时驻留的模型数上限
+MAX_RESIDENT_MODELS = 2
+# 超过该时间未使用的模型会被释放（秒）
+MAX_IDLE_SECONDS = 600
+# 加载新模型前需要保留的可用内存倍数
+MEMORY_HEADROOM = 1.5
+
+# 同一片段连续重复多次通常是解码陷入循环
+_REPEAT_PATTERN = re.compile(r"(.{2,24}?)\1{7,}")
+_ENVIRONMENT_PATTERN = re.compile(r"\\(begin|end)\s*\{([^}]*)\}")
+
+
+def check_latex(latex):
+    """检查识别结果是否为有效的 LaTeX，有效时返回 None，否则返回原因"""
+    if not latex or not latex.strip():
+        return "empty result"
+
+    # 跳过转义的 \{ \}，统计花括号是否配对
+    depth = 0
+    for match in re.finditer(r"\\.|[{}]", latex):
+        token = match.group()
+        if token == "{":
+            depth += 1
+        elif token == "}":
+            depth -= 1
+            if depth < 0:
+                return "unbalanced braces"
+    if depth:
+        return "unbalanced braces"
+
+    stack = []
+    for kind, name in _ENVIRONMENT_PATTERN.findall(latex):
+        if kind == "begin":
+            stack.append(name)
+        elif not stack or stack.pop() != name:
+            return f"unmatched \\end{{{name}}}"
+    if stack:
+        return f"unclosed \\begin{{{stack[-1]}}}"
+
+    if len(re.findall(r"\\left\b", latex)) != len(re.findall(r"\\right\b", latex)):
+        return "unbalanced \\left and \\right"
+    if _REPEAT_PATTERN.search(latex):
+        return "repeated output"
+    return None
+
+
+def parse_models(value):
+    """解析逗号分隔的模型列表"""
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+def _read_model_config(path):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        return config if isinstance(config, dict) else {}
+    except Exception as e:
+        print(f"读取模型配置出错: {str(e)}")
+        return {}
+
+
+def load_model_config(path=DEFAULT_MODEL_CONFIG):
+    """读取保存的模型选择，文件不存在或无效时返回默认模型"""
+    models = _read_model_config(path).get("models")
+    return list(models) if models else list(DEFAULT_MODELS)
+
+
+def load_preprocess_config(path=DEFAULT_MODEL_CONFIG):
+    """读取图形界面是否在识别前预处理图片，默认开启"""
+    return bool(_read_model_config(path).get("preprocess", True))
+
+
+def save_model_config(models, path=DEFAULT_MODEL_CONFIG):
+    """保存模型选择，保留配置文件中的其他选项"""
+    from utils import FileManager
+
+    config = _read_model_config(path)
+    config["models"] = list(models)
+    FileManager.write_json_atomic(path, config)
+
+
+class ModelPool:
+    """按需加载的模型池，内存不足或模型过多时释放最久未使用的模型"""
+
+    def __init__(
+        self,
+        factory,
+        max_models=MAX_RESIDENT_MODELS,
+        max_idle_seconds=MAX_IDLE_SECONDS,
+    ):
+        # factory(model_name) -> FormulaRecognizer
+        self.factory = factory
+        self.max_models = max_models
+        self.max_idle_seconds = max_idle_seconds
+        # 模型名称 -> [识别器, 最近使用时间, 占用内存(字节)]，按使用先后排列
+        self._models = OrderedDict()
+        self._lock = threading.RLock()
+        self.load_count = 0
+        self.evict_count = 0
+
+    def get(self, model_name):
+        """返回已加载的模型，未加载时先加载"""
+        with self._lock:
+            entry = self._models.get(model_name)
+            if entry is None:
+                entry = self._load(model_name)
+            entry[1] = time.monotonic()
+            self._models.move_to_end(model_name)
+            return entry[0]
+
+    def peek(self, model_name):
+        """返回已加载的模型，未加载时返回 None，不加载也不改变使用顺序"""
+        with self._lock:
+            entry = self._models.get(model_name)
+            return entry[0] if entry is not None else None
+
+    def _load(self, model_name):
+        estimate = MODEL_MEMORY_MB.get(model_name, 1000) * 1024 * 1024
+        self._make_room(estimate)
+        process = psutil.Process()
+        before = process.memory_info().rss
+        recognizer = self.factory(model_name)
+        used = max(process.memory_info().rss - before, 0) or estimate
+        entry = [recognizer, time.monotonic(), used]
+        self._models[model_name] = entry
+        self.load_count += 1
+        return entry
+
+    def _make_room(self, needed):
+        """加载新模型前释放最久未使用的模型"""
+        while self._models and (
+            len(self._models) >= self.max_models
+            or psutil.virtual_memory().available < needed * MEMORY_HEADROOM
+        ):
+            self.evict(next(iter(self._models)))
+
+    def evict(self, model_name):
+        """释放模型"""
+        with self._lock:
+            if self._models.pop(model_name, None) is None:
+                return False
+            self.evict_count += 1
+        gc.collect()
+        print(f"已释放模型 {model_name}")
+        return True
+
+    def release_idle(self):
+        """释放长时间未使用的模型，始终保留最近使用的一个"""
+        now = time.monotonic()
+        with self._lock:
+            idle = [
+                name
+                for name, (_, last_used, _) in list(self._models.items())[:-1]
+                if now - last_used > self.max_idle_seconds
+            ]
+        for name in idle:
+            self.evict(name)
+        return idle
+
+    def loaded(self):
+        with self._lock:
+            return list(self._models)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": {
+                    name: {"memory_mb": used / (1024 * 1024)}
+                    for name, (_, _, used) in self._models.items()
+                },
+                "loads": self.load_count,
+                "evictions": self.evict_count,
+            }
+
+
+class CascadeRecognizer:
+    """按顺序尝试多个模型，结果无法通过 LaTeX 检查时换用下一个模型
+
+    接口与 FormulaRecognizer 一致，可以直接替换
+    """
+
+    def __init__(self, pool, models, cache=None):
+        self.pool = pool
+        self.cache = cache
+        self.models = list(models)
+        self.escalation_count = 0
+        # 最近一次 recognize() 失败的原因，为最后尝试的模型的错误
+        self.last_error = None
+        # 界面识别和目录监视共用识别器，同一模型不能被多个线程同时推理
+        self._lock = threading.RLock()
+
+    @property
+    def model_id(self):
+        return ">".join(self.models)
+
+    @property
+    def timings(self):
+        """首选模型的加载耗时，模型未加载（如已被释放）时为空"""
+        recognizer = self.pool.peek(self.models[0])
+        return dict(recognizer.timings) if recognizer is not None else {}
+
+    def set_models(self, models):
+        """切换使用的模型，下一次识别生效"""
+        self.models = list(models)
+
+    def warm_up(self):
+        """加载并预热首选模型"""
+        with self._lock:
+            return self.pool.get(self.models[0]).warm_up()
+
+    def release_idle(self):
+        return self.pool.release_idle()
+
+    def recognize(self, image, timestamp):
+        """识别图片中的公式，保存结果并返回"""
+        try:
+            res, error = self.recognize_batch([image], batch_size=1)[0]
+            if res is None:
+                if error:
+                    print(f"识别出错: {error}")
+                self.last_error = error or "No formula recognized"
+                return None
+            result_file = f"{timestamp}_result.json"
+            with metrics.span("save_result"):
+                save_result(res, os.path.join("output", result_file))
+            self.last_error = None
+            return res
+        except Exception as e:
+            print(f"识别出错: {str(e)}")
+            self.last_error = str(e)
+            return None
+
+    def recognize_batch(self, images, batch_size=None):
+        """批量识别，只把未通过检查的图片交给下一个模型，多个线程调用时依次执行"""
+        with self._lock:
+            return self._recognize_batch(list(images), batch_size)
+
+    def _recognize_batch(self, images, batch_size):
+        results = [(None, "No model configured")] * len(images)
+        pending = list(range(len(images)))
+        models = list(self.models)
+        for level, model_name in enumerate(models):
+            recognizer = self.pool.get(model_name)
+            outputs = recognizer.recognize_batch(
+                [images[index] for index in pending], batch_size=batch_size
+            )
+            retry = []
+            for index, (res, error) in zip(pending, outputs):
+                if res is not None:
+                    res["model_name"] = model_name
+                    error = check_latex(res["rec_formula"])
+                # 最后一个模型的结果即使未通过检查也直接返回
+                if error and level + 1 < len(models):
+                    retry.append(index)
+                results[index] = (res, None) if res is not None else (None, error)
+            if not retry:
+                break
+            self.escalation_count += len(retry)
+            metrics.increment("escalation", len(retry))
+            pending = retry
+        return results
+
+
+def create_recognizer(
+    models, stub=False, cache=None, preprocessor=None, engine=None
+):
+    """根据模型列表创建识别器，多个模型时使用逐级升级的识别策略"""
+    models = list(models) or list(DEFAULT_MODELS)
+
+    def factory(model_name):
+        return FormulaRecognizer(
+            model_name=model_name,
+            stub=stub,
+            cache=cache,
+            preprocessor=preprocessor,
+            engine=engine,
+        )
+
+    if len(models) == 1:
+        return factory(models[0])
+    return CascadeRecognizer(ModelPool(factory), models, cache)
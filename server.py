@@ -0,0 +1,365 @@
+import sys
+import time
+import base64
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from aiohttp import web
+
+import metrics
+from cache import RecognitionCache
+from preprocess import Preprocessor
+from page import detect_regions, crop_regions
+from engine import add_engine_arguments, engine_from_args
+from registry import create_recognizer, parse_models
+
+# 单次请求体大小上限
+MAX_REQUEST_SIZE = 32 * 1024 * 1024
+
+
+class QueueFullError(Exception):
+    """等待识别的图片过多"""
+
+
+class RequestTooLargeError(Exception):
+    """单次请求的图片数超过队列上限，重试也无法成功"""
+
+    def __init__(self, count, limit):
+        super().__init__(f"{count} images exceed queue limit {limit}")
+        self.count = count
+        self.limit = limit
+
+
+class MicroBatcher:
+    """把并发请求中的图片合并为一次批量推理
+
+    收到第一张图片后最多等待 max_wait_ms 收集更多图片，凑满 max_batch_size 时立即推理
+    """
+
+    def __init__(self, recognizer, max_batch_size=8, max_wait_ms=10, max_queue=64):
+        self.recognizer = recognizer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+        self.batch_count = 0
+        self.image_count = 0
+        self._queue = None
+        self._task = None
+        # 推理在单独线程中串行执行，不阻塞事件循环
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=True)
+
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue else 0
+
+    async def submit(self, images, timings=None):
+        """提交图片并等待识别结果，返回 (result, error) 列表
+
+        timings 为字典时写入排队和推理的最长耗时（秒）
+        """
+        if len(images) > self.max_queue:
+            raise RequestTooLargeError(len(images), self.max_queue)
+        if self.queue_depth() + len(images) > self.max_queue:
+            raise QueueFullError(f"queue depth limit {self.max_queue} reached")
+        loop = asyncio.get_running_loop()
+        futures = []
+        for image in images:
+            future = loop.create_future()
+            self._queue.put_nowait((image, future, loop.time(), timings))
+            futures.append(future)
+        return await asyncio.gather(*futures)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # 已取消的请求不再参与推理
+            batch = [item for item in batch if not item[1].done()]
+            if not batch:
+                continue
+            started = loop.time()
+            for _, _, enqueued, _ in batch:
+                metrics.observe("server_queue", started - enqueued)
+            try:
+                results = await loop.run_in_executor(
+                    self._executor,
+                    self.recognizer.recognize_batch,
+                    [image for image, _, _, _ in batch],
+                    len(batch),
+                )
+            except Exception as e:
+                results = [(None, str(e))] * len(batch)
+            elapsed = loop.time() - started
+            metrics.observe("server_inference", elapsed)
+
+            self.batch_count += 1
+            self.image_count += len(batch)
+            for (_, future, enqueued, timings), result in zip(batch, results):
+                if timings is not None:
+                    timings["queue"] = max(timings.get("queue", 0), started - enqueued)
+                    timings["inference"] = max(timings.get("inference", 0), elapsed)
+                if not future.done():
+                    future.set_result(result)
+
+
+BATCHER_KEY = web.AppKey("batcher", MicroBatcher)
+
+
+@web.middleware
+async def timing_middleware(request, handler):
+    """记录识别请求的总耗时，并通过 Server-Timing 响应头返回各阶段耗时"""
+    if not request.path.startswith("/recognize"):
+        return await handler(request)
+    timings = request["timings"] = {}
+    start = time.perf_counter()
+    response = await handler(request)
+    total = time.perf_counter() - start
+    metrics.observe("server_request", total)
+    timings["total"] = total
+    response.headers["Server-Timing"] = ", ".join(
+        f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()
+    )
+    return response
+
+
+def decode_image(data):
+    """将图片文件内容解码为 BGR 数组"""
+    if not data:
+        raise ValueError("empty image")
+    try:
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    except cv2.error:
+        raise ValueError("unable to decode image")
+    if image is None:
+        raise ValueError("unable to decode image")
+    return image
+
+
+async def read_images(request):
+    """从请求中读取图片，支持原始图片、base64 JSON 和 multipart 表单"""
+    content_type = request.content_type
+    if content_type == "application/json":
+        body = await request.json()
+        encoded = body.get("images") or [body.get("image")]
+        return [base64.b64decode(item) for item in encoded if item]
+    if content_type.startswith("multipart/"):
+        images = []
+        reader = await request.multipart()
+        async for part in reader:
+            images.append(await part.read(decode=False))
+        return images
+    data = await request.read()
+    return [data] if data else []
+
+
+def to_response(result):
+    res, error = result
+    return {"rec_formula": res["rec_formula"] if res else None, "error": error}
+
+
+async def recognize_images(request, limit=None):
+    try:
+        payloads = await read_images(request)
+    except web.HTTPException:
+        # 如请求体超过 client_max_size 时的 413
+        raise
+    except Exception as e:
+        raise web.HTTPBadRequest(
+            reason="invalid request body", text=f"invalid request body: {e}"
+        )
+    if not payloads:
+        raise web.HTTPBadRequest(reason="no image in request")
+    if limit and len(payloads) > limit:
+        raise web.HTTPBadRequest(reason=f"expected at most {limit} image")
+
+    # 无法解码的图片单独返回错误，不影响其他图片
+    images = []
+    results = [None] * len(payloads)
+    for index, data in enumerate(payloads):
+        try:
+            images.append((index, decode_image(data)))
+        except ValueError as e:
+            results[index] = (None, str(e))
+
+    batcher = request.app[BATCHER_KEY]
+    try:
+        recognized = await batcher.submit(
+            [image for _, image in images], request.get("timings")
+        )
+    except RequestTooLargeError as e:
+        raise web.HTTPRequestEntityTooLarge(e.limit, e.count, text=str(e))
+    except QueueFullError as e:
+        raise web.HTTPServiceUnavailable(reason=str(e), headers={"Retry-After": "1"})
+    for (index, _), result in zip(images, recognized):
+        results[index] = result
+    return [to_response(result) for result in results]
+
+
+async def handle_recognize(request):
+    """识别单张图片"""
+    results = await recognize_images(request, limit=1)
+    return web.json_response(results[0])
+
+
+async def handle_recognize_batch(request):
+    """识别多张图片，结果按提交顺序返回"""
+    results = await recognize_images(request)
+    return web.json_response({"results": results})
+
+
+async def handle_recognize_page(request):
+    """识别整页图片中的所有公式区域，各区域与其他请求一起批量推理"""
+    try:
+        payloads = await read_images(request)
+    except web.HTTPException:
+        # 如请求体超过 client_max_size 时的 413
+        raise
+    except Exception as e:
+        raise web.HTTPBadRequest(
+            reason="invalid request body", text=f"invalid request body: {e}"
+        )
+    if not payloads:
+        raise web.HTTPBadRequest(reason="no image in request")
+    try:
+        image = decode_image(payloads[0])
+    except ValueError as e:
+        raise web.HTTPBadRequest(reason="invalid image", text=f"invalid image: {e}")
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    boxes = await loop.run_in_executor(None, detect_regions, image)
+    request["timings"]["detect"] = loop.time() - start
+    metrics.observe("detect_regions", request["timings"]["detect"])
+    batcher = request.app[BATCHER_KEY]
+    try:
+        recognized = await batcher.submit(
+            crop_regions(image, boxes), request["timings"]
+        )
+    except RequestTooLargeError as e:
+        raise web.HTTPRequestEntityTooLarge(e.limit, e.count, text=str(e))
+    except QueueFullError as e:
+        raise web.HTTPServiceUnavailable(reason=str(e), headers={"Retry-After": "1"})
+    regions = []
+    for box, result in zip(boxes, recognized):
+        regions.append(dict(bbox=list(box), **to_response(result)))
+    return web.json_response({"regions": regions})
+
+
+async def handle_health(request):
+    batcher = request.app[BATCHER_KEY]
+    return web.json_response(
+        {
+            "model": batcher.recognizer.model_id,
+            "queue_depth": batcher.queue_depth(),
+            "batches": batcher.batch_count,
+            "images": batcher.image_count,
+        }
+    )
+
+
+async def handle_metrics(request):
+    """Prometheus 文本格式的各阶段耗时分位数和计数"""
+    batcher = request.app[BATCHER_KEY]
+    text = metrics.REGISTRY.to_prometheus(
+        gauges={
+            "queue_depth": batcher.queue_depth(),
+            "batches": batcher.batch_count,
+            "images": batcher.image_count,
+        }
+    )
+    return web.Response(text=text, content_type="text/plain", charset="utf-8")
+
+
+def create_app(recognizer, max_batch_size=8, max_wait_ms=10, max_queue=64):
+    """创建识别服务应用"""
+    app = web.Application(
+        client_max_size=MAX_REQUEST_SIZE, middlewares=[timing_middleware]
+    )
+    batcher = MicroBatcher(recognizer, max_batch_size, max_wait_ms, max_queue)
+    app[BATCHER_KEY] = batcher
+
+    async def on_startup(app):
+        batcher.start()
+
+    async def on_cleanup(app):
+        await batcher.stop()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_post("/recognize", handle_recognize)
+    app.router.add_post("/recognize/batch", handle_recognize_batch)
+    app.router.add_post("/recognize/page", handle_recognize_page)
+    app.router.add_get("/health", handle_health)
+    app.router.add_get("/metrics", handle_metrics)
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地公式识别 HTTP 服务")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=8765, help="监听端口")
+    parser.add_argument(
+        "--model",
+        default="PP-FormulaNet-S",
+        help="模型名称，逗号分隔多个模型时先用前面的模型，结果无效再换下一个",
+    )
+    parser.add_argument("--max-batch-size", type=int, default=8, help="最大批次大小")
+    parser.add_argument(
+        "--max-wait-ms", type=int, default=10, help="凑批时最多等待的毫秒数"
+    )
+    parser.add_argument(
+        "--max-queue", type=int, default=64, help="排队图片上限，超出时返回 503"
+    )
+    parser.add_argument("--cache", help="识别缓存数据库路径")
+    parser.add_argument(
+        "--preprocess", action="store_true", help="识别前裁剪空白边距并归一化图片"
+    )
+    add_engine_arguments(parser)
+    parser.add_argument(
+        "--stub", action="store_true", help="使用占位模型，无需 PaddleX 权重"
+    )
+    args = parser.parse_args(argv)
+
+    cache = RecognitionCache(args.cache) if args.cache else None
+    preprocessor = Preprocessor() if args.preprocess else None
+    recognizer = create_recognizer(
+        parse_models(args.model),
+        stub=args.stub,
+        cache=cache,
+        preprocessor=preprocessor,
+        engine=engine_from_args(args),
+    )
+    app = create_app(
+        recognizer, args.max_batch_size, args.max_wait_ms, args.max_queue
+    )
+    web.run_app(app, host=args.host, port=args.port)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,31 @@
+import os
+import sys
+import argparse
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench import STRESS_FAILURES, bench_stress  # noqa: E402
+
+# 自动测试使用较少的识别次数，完整压力测试见 python bench.py stress --stub
+STRESS_COUNT = 200
+STRESS_PROCESSES = 2
+STRESS_THREADS = 4
+
+
+class StressTest(unittest.TestCase):
+    """多实例、多线程并发识别时记录 ID 不重复、结果不丢失、不残留临时文件"""
+
+    def test_concurrent_recognition(self):
+        args = argparse.Namespace(
+            stress_count=STRESS_COUNT,
+            stress_processes=STRESS_PROCESSES,
+            stress_threads=STRESS_THREADS,
+        )
+        results = bench_stress(args)
+        for key in STRESS_FAILURES:
+            self.assertEqual(results[key], 0, key)
+
+
+if __name__ == "__main__":
+    unittest.main()
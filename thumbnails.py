@@ -0,0 +1,188 @@
+import os
+import threading
+from collections import OrderedDict
+from PyQt6.QtCore import Qt
+from PyQt6.QtGui import QImageReader, QPixmap
+
+# 预先生成的缩小图长边尺寸，从大到小，每级为上一级的一半
+PYRAMID_LEVELS = (2048, 1024, 512, 256, 128)
+# 内存中解码后图片的总大小上限（字节）
+MAX_CACHE_BYTES = 96 * 1024 * 1024
+
+
+def save_image_atomic(image, path):
+    """先保存到临时文件再重命名，避免其他进程读到写了一半的图片"""
+    base, extension = os.path.splitext(path)
+    temp_path = f"{base}.{os.getpid()}_{threading.get_ident()}.tmp{extension}"
+    if not image.save(temp_path):
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False
+    os.replace(temp_path, path)
+    return True
+
+
+def level_path(image_path, level):
+    """缩小图保存在原图旁边，如 output/xxx_image@512.png"""
+    base, extension = os.path.splitext(image_path)
+    return f"{base}@{level}{extension}"
+
+
+def pyramid_paths(image_path):
+    """原图对应的所有缩小图路径"""
+    return [level_path(image_path, level) for level in PYRAMID_LEVELS]
+
+
+def build_pyramid(image, image_path):
+    """逐级缩小 QImage 并保存，只生成比原图小的级别"""
+    current = image
+    for level in PYRAMID_LEVELS:
+        if max(current.width(), current.height()) <= level:
+            continue
+        # 从上一级缩小，每一级的开销只有原图的几分之一
+        current = current.scaled(
+            level,
+            level,
+            Qt.AspectRatioMode.KeepAspectRatio,
+            Qt.TransformationMode.SmoothTransformation,
+        )
+        path = level_path(image_path, level)
+        if not save_image_atomic(current, path):
+            print(f"保存缩小图出错: {path}")
+
+
+def remove_pyramid(image_path):
+    """删除原图和所有缩小图"""
+    for path in [image_path] + pyramid_paths(image_path):
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"删除文件出错: {str(e)}")
+
+
+def smallest_level_path(image_path, min_side=0):
+    """返回长边不小于 min_side 的最小缩小图，没有时返回原图"""
+    for level in reversed(PYRAMID_LEVELS):
+        if level < min_side:
+            continue
+        path = level_path(image_path, level)
+        if os.path.exists(path):
+            return path
+    return image_path
+
+
+class ImageCache:
+    """按显示尺寸选择合适级别的缩小图，解码后的图片按最近使用保留在内存中"""
+
+    def __init__(self, max_bytes=MAX_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._pixmaps = OrderedDict()
+        self._bytes = 0
+        # 原图路径 -> 原图尺寸 (宽, 高)
+        self._sizes = {}
+
+    def load(self, image_path, width, height):
+        """返回足够显示在 width x height 区域内的最小图片，图片不存在时返回 None"""
+        size = self._original_size(image_path)
+        if size is None:
+            return None
+        original_width, original_height = size
+        scale = min(1.0, width / original_width, height / original_height)
+        needed = max(original_width, original_height) * scale
+
+        for level in reversed(PYRAMID_LEVELS):
+            if level < needed or level >= max(original_width, original_height):
+                continue
+            path = level_path(image_path, level)
+            if path in self._pixmaps or os.path.exists(path):
+                pixmap = self._get(path)
+                if pixmap is not None:
+                    return pixmap
+        # 需要原图大小显示，或还没有生成缩小图
+        pixmap = self._get(image_path)
+        if pixmap is None:
+            # 原图尚未写入磁盘时使用内存中已有的缩小图
+            for level in PYRAMID_LEVELS:
+                path = level_path(image_path, level)
+                if path in self._pixmaps:
+                    return self._get(path)
+        return pixmap
+
+    def seed(self, image_path, pixmap):
+        """放入刚粘贴的图片，缩小图写入磁盘前也无需保留原图"""
+        self._sizes[image_path] = (pixmap.width(), pixmap.height())
+        largest = max(pixmap.width(), pixmap.height())
+        levels = [level for level in PYRAMID_LEVELS if level < largest]
+        if not levels:
+            self._put(image_path, pixmap)
+            return
+        scaled = pixmap.scaled(
+            levels[0],
+            levels[0],
+            Qt.AspectRatioMode.KeepAspectRatio,
+            Qt.TransformationMode.SmoothTransformation,
+        )
+        self._put(level_path(image_path, levels[0]), scaled)
+
+    def missing_pyramid(self, image_path):
+        """原图大于最小级别但还没有生成缩小图"""
+        size = self._original_size(image_path)
+        if size is None or max(size) <= PYRAMID_LEVELS[-1]:
+            return False
+        return not os.path.exists(level_path(image_path, PYRAMID_LEVELS[-1]))
+
+    def discard(self, image_path):
+        """从内存中移除原图及其缩小图"""
+        self._sizes.pop(image_path, None)
+        for path in [image_path] + pyramid_paths(image_path):
+            pixmap = self._pixmaps.pop(path, None)
+            if pixmap is not None:
+                self._bytes -= self._cost(pixmap)
+
+    def clear(self):
+        """清空内存中的所有图片"""
+        self._sizes.clear()
+        self._pixmaps.clear()
+        self._bytes = 0
+
+    def _original_size(self, image_path):
+        size = self._sizes.get(image_path)
+        if size is None:
+            # 只读取文件头，不解码像素
+            reader_size = QImageReader(image_path).size()
+            if not reader_size.isValid() or reader_size.isEmpty():
+                return None
+            size = (reader_size.width(), reader_size.height())
+            self._sizes[image_path] = size
+        return size
+
+    def _get(self, path):
+        pixmap = self._pixmaps.get(path)
+        if pixmap is not None:
+            self.hits += 1
+            self._pixmaps.move_to_end(path)
+            return pixmap
+        self.misses += 1
+        pixmap = QPixmap(path)
+        if pixmap.isNull():
+            return None
+        self._put(path, pixmap)
+        return pixmap
+
+    def _put(self, path, pixmap):
+        previous = self._pixmaps.pop(path, None)
+        if previous is not None:
+            self._bytes -= self._cost(previous)
+        self._pixmaps[path] = pixmap
+        self._bytes += self._cost(pixmap)
+        # 至少保留刚放入的图片
+        while self._bytes > self.max_bytes and len(self._pixmaps) > 1:
+            _, evicted = self._pixmaps.popitem(last=False)
+            self._bytes -= self._cost(evicted)
+
+    @staticmethod
+    def _cost(pixmap):
+        return pixmap.width() * pixmap.height() * 4
@@ -1,9 +1,26 @@
 import os
 import json
+import tempfile
+import itertools
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from PyQt6.QtGui import QPixmap, QClipboard
+from PyQt6.QtGui import QPixmap, QClipboard, QImage
 from PyQt6.QtWidgets import QApplication
 
+import metrics
+from thumbnails import build_pyramid, remove_pyramid, save_image_atomic
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+# 可以识别的图片扩展名
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+# 进程内的记录序号
+_record_counter = itertools.count(1)
+
 
 class FileManager:
     @staticmethod
@@ -13,30 +30,129 @@ class FileManager:
             os.makedirs("output")
 
     @staticmethod
-    def get_timestamp():
-        """获取当前时间戳"""
-        return datetime.now().strftime("%Y%m%d_%H%M%S")
+    def new_record_id():
+        """生成唯一的记录 ID
+
+        以秒级时间戳开头，与旧记录一样按时间排序；附加微秒、进程号和进程内序号，
+        同一秒内的多次识别以及共用 output/ 的多个实例都不会冲突
+        """
+        now = datetime.now()
+        return (
+            f"{now:%Y%m%d_%H%M%S}_{now.microsecond:06d}"
+            f"_{os.getpid()}_{next(_record_counter)}"
+        )
+
+    @staticmethod
+    def write_json_atomic(path, data):
+        """先写入临时文件再重命名，避免写入中断导致文件损坏"""
+        directory = os.path.dirname(path) or "."
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    @staticmethod
+    def write_bytes_atomic(path, data):
+        """先写入临时文件再重命名"""
+        directory = os.path.dirname(path) or "."
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
 
     @staticmethod
-    def load_result(timestamp):
-        """加载指定时间戳的结果"""
-        result_file = f"{timestamp}_result.json"
-        image_file = f"{timestamp}_image.png"
+    def load_result(timestamp, load_image=True):
+        """加载指定时间戳的结果，load_image 为 False 时不解码原图
+
+        单独的结果文件不存在时从归档中读取
+        """
+        result_file = os.path.join("output", f"{timestamp}_result.json")
+        image_file = os.path.join("output", f"{timestamp}_image.png")
 
         result = None
         image = None
 
         try:
-            with open(os.path.join("output", result_file), "r", encoding="utf-8") as f:
-                result = json.load(f)
+            if os.path.exists(result_file):
+                with open(result_file, "r", encoding="utf-8") as f:
+                    result = json.load(f)
+                if load_image and os.path.exists(image_file):
+                    image = QPixmap(image_file)
+            else:
+                from archive import open_archive
 
-            if os.path.exists(os.path.join("output", image_file)):
-                image = QPixmap(os.path.join("output", image_file))
+                archive = open_archive()
+                if archive is None:
+                    raise FileNotFoundError(result_file)
+                result, image_data = archive.get(timestamp)
+                if result is None:
+                    raise FileNotFoundError(result_file)
+                if load_image and image_data:
+                    image = QPixmap()
+                    image.loadFromData(image_data)
         except Exception as e:
             print(f"加载结果出错: {str(e)}")
 
         return result, image
 
+    @staticmethod
+    def ensure_image(timestamp):
+        """返回记录的图片路径，图片只在归档中时先还原到 output/"""
+        image_file = os.path.join("output", f"{timestamp}_image.png")
+        if os.path.exists(image_file):
+            return image_file
+        from archive import open_archive
+
+        archive = open_archive()
+        if archive is not None:
+            _, image_data = archive.get(timestamp)
+            if image_data:
+                try:
+                    FileManager.write_bytes_atomic(image_file, image_data)
+                except OSError as e:
+                    print(f"还原图片出错: {str(e)}")
+        return image_file
+
+
+class FileLock:
+    """跨进程的排他文件锁，多个实例共用 output/ 时保护读-改-写操作"""
+
+    def __init__(self, path=os.path.join("output", ".lock")):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, "a+b")
+        if os.name == "nt":
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if os.name == "nt":
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._file.close()
+            self._file = None
+
 
 class ClipboardManager:
     @staticmethod
@@ -48,3 +164,115 @@ class ClipboardManager:
         if mime_data.hasImage():
             return QPixmap(clipboard.pixmap())
         return None
+
+
+class ImageConverter:
+    @staticmethod
+    def qimage_to_array(image):
+        """将 QImage 转换为模型可直接使用的 BGR numpy 数组"""
+        if image.format() != QImage.Format.Format_RGB32:
+            image = image.convertToFormat(QImage.Format.Format_RGB32)
+        width = image.width()
+        height = image.height()
+
+        # 直接读取 QImage 的像素缓冲区，Format_RGB32 在内存中按 B, G, R, X 排列
+        buffer = image.constBits()
+        buffer.setsize(image.sizeInBytes())
+        pixels = np.frombuffer(buffer, dtype=np.uint8).reshape(
+            height, image.bytesPerLine() // 4, 4
+        )
+        # 复制一次，脱离 QImage 的内存并去掉行尾填充和 X 通道
+        return np.ascontiguousarray(pixels[:, :width, :3])
+
+
+class ImageWriter:
+    """在后台线程中按提交顺序保存和删除 output/ 中的图片和结果文件"""
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def save(self, image, path, pyramid=False):
+        """异步保存 QImage，pyramid 为 True 时同时生成各级缩小图"""
+        return self._executor.submit(self._save, image, path, pyramid)
+
+    def remove(self, path):
+        """异步删除文件，会在之前提交的保存完成后执行"""
+        return self._executor.submit(self._remove, path)
+
+    def remove_image(self, path):
+        """异步删除图片及其缩小图"""
+        return self._executor.submit(remove_pyramid, path)
+
+    def remove_records(self, record_ids, output_dir="output"):
+        """异步删除多条记录的结果文件、图片及其缩小图"""
+        return self._executor.submit(self._remove_records, list(record_ids), output_dir)
+
+    def update_titles(self, titles, output_dir="output"):
+        """异步把新标题写入多条记录的结果文件，titles 为 {记录 ID: 标题}"""
+        return self._executor.submit(self._update_titles, dict(titles), output_dir)
+
+    def ensure_pyramid(self, path):
+        """异步为已有图片补齐缩小图"""
+        return self._executor.submit(self._ensure_pyramid, path)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    @staticmethod
+    def _save(image, path, pyramid=False):
+        with metrics.span("save_image"):
+            saved = save_image_atomic(image, path)
+        if not saved:
+            print(f"保存图片出错: {path}")
+            return
+        if pyramid:
+            with metrics.span("build_pyramid"):
+                build_pyramid(image, path)
+
+    @staticmethod
+    def _remove_records(record_ids, output_dir):
+        from archive import open_archive
+
+        for record_id in record_ids:
+            remove_pyramid(os.path.join(output_dir, f"{record_id}_image.png"))
+            ImageWriter._remove(os.path.join(output_dir, f"{record_id}_result.json"))
+        archive = open_archive(os.path.join(output_dir, "archive.lmdb"))
+        if archive is not None:
+            archive.delete(record_ids)
+
+    @staticmethod
+    def _update_titles(titles, output_dir):
+        # 其他实例可能同时修改这些记录，整批读-改-写期间加锁
+        from archive import open_archive
+
+        archived = {}
+        with FileLock(os.path.join(output_dir, ".lock")):
+            for record_id, title in titles.items():
+                path = os.path.join(output_dir, f"{record_id}_result.json")
+                if not os.path.exists(path):
+                    archived[record_id] = title
+                    continue
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        result = json.load(f)
+                    result["title"] = title
+                    FileManager.write_json_atomic(path, result)
+                except Exception as e:
+                    print(f"更新标题出错: {str(e)}")
+        archive = open_archive(os.path.join(output_dir, "archive.lmdb"))
+        if archived and archive is not None:
+            archive.update_titles(archived)
+
+    @staticmethod
+    def _ensure_pyramid(path):
+        image = QImage(path)
+        if not image.isNull():
+            build_pyramid(image, path)
+
+    @staticmethod
+    def _remove(path):
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"删除文件出错: {str(e)}")
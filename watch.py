@@ -0,0 +1,684 @@
+import os
+import sys
+import json
+import time
+import errno
+import select
+import sqlite3
+import struct
+import hashlib
+import argparse
+import threading
+import ctypes
+import ctypes.util
+from collections import deque
+from datetime import datetime
+
+import cv2
+import numpy as np
+from PyQt6.QtCore import QThread, pyqtSignal
+from PyQt6.QtGui import QImage
+
+import metrics
+from cache import RecognitionCache
+from preprocess import Preprocessor
+from engine import add_engine_arguments, engine_from_args
+from registry import create_recognizer, parse_models
+from history import HistoryStore
+from utils import FileManager, IMAGE_EXTENSIONS
+from thumbnails import build_pyramid
+
+# 文件大小和修改时间保持不变多久后才认为已写完（秒）
+SETTLE_SECONDS = 1.0
+# 轮询模式下扫描目录的间隔（秒）
+POLL_INTERVAL = 1.0
+# 每批识别的最大图片数
+BATCH_SIZE = 8
+# 图片不足一批时最多等待多久（秒）
+MAX_BATCH_WAIT = 2.0
+# 已导入图片的记录，按内容去重
+DEFAULT_LEDGER_PATH = os.path.join("output", "watch.db")
+# 计算队列延迟分位数时保留的样本数
+LAG_SAMPLES = 1000
+# 界面中等待模型加载时检查是否已停止的间隔（秒）
+RECOGNIZER_WAIT_INTERVAL = 0.2
+
+# inotify 事件，见 <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def is_image(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS) and not name.startswith(".")
+
+
+def list_images(directory):
+    """目录中的图片文件名，不递归子目录"""
+    try:
+        return [
+            entry.name
+            for entry in os.scandir(directory)
+            if entry.is_file() and is_image(entry.name)
+        ]
+    except OSError as e:
+        print(f"读取目录出错: {str(e)}")
+        return []
+
+
+class InotifyWatcher:
+    """通过 ctypes 调用 Linux inotify，返回发生变化的图片文件名"""
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.directory = directory
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY
+        if libc.inotify_add_watch(self._fd, os.fsencode(directory), mask) < 0:
+            error = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(error, f"inotify_add_watch failed: {directory}")
+
+    def wait(self, timeout):
+        """等待文件变化，超时返回空列表"""
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+        names = []
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # 事件队列溢出，重新扫描整个目录
+                return list_images(self.directory)
+            name = os.fsdecode(name)
+            if name and is_image(name):
+                names.append(name)
+        return list(dict.fromkeys(names))
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingWatcher:
+    """定期扫描目录，返回大小或修改时间变化的图片文件名"""
+
+    def __init__(self, directory, interval=POLL_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        # 启动时已有的文件由调用方自行处理
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for name in list_images(self.directory):
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            snapshot[name] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        snapshot = self._scan()
+        changed = [
+            name
+            for name, state in snapshot.items()
+            if self._snapshot.get(name) != state
+        ]
+        self._snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+def create_watcher(directory, polling=False, interval=POLL_INTERVAL):
+    """优先使用 inotify，不支持时退回轮询"""
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError) as e:
+            print(f"inotify 不可用，改为轮询: {str(e)}")
+    return PollingWatcher(directory, interval)
+
+
+class WatchLedger:
+    """已导入图片的内容摘要，同一张图片只导入一次
+
+    sources: 内容摘要 -> 首次导入的文件和记录 ID
+    paths: 已处理过的文件（包括重复内容的文件）-> 大小、修改时间和内容摘要
+    """
+
+    def __init__(self, path=DEFAULT_LEDGER_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        has_paths = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'paths'"
+        ).fetchone()
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sources (
+                digest TEXT PRIMARY KEY,
+                path TEXT,
+                size INTEGER,
+                mtime_ns INTEGER,
+                record_id TEXT,
+                added TEXT
+            );
+            CREATE INDEX IF NOT EXISTS sources_path ON sources (path);
+            CREATE TABLE IF NOT EXISTS paths (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime_ns INTEGER,
+                digest TEXT
+            );
+            """
+        )
+        if not has_paths:
+            # 旧版本只记录了首次导入的文件
+            self._conn.execute(
+                "INSERT OR IGNORE INTO paths "
+                "SELECT path, size, mtime_ns, digest FROM sources"
+            )
+        self._conn.commit()
+
+    def seen(self, digest):
+        row = self._conn.execute(
+            "SELECT record_id FROM sources WHERE digest = ?", (digest,)
+        ).fetchone()
+        return row is not None
+
+    def unchanged(self, path, size, mtime_ns):
+        """该路径的文件已导入且之后没有修改过，重启时无需重新读取"""
+        row = self._conn.execute(
+            "SELECT 1 FROM paths WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (path, size, mtime_ns),
+        ).fetchone()
+        return row is not None
+
+    def add(self, digest, path, size, mtime_ns, record_id):
+        self._conn.execute(
+            "INSERT OR IGNORE INTO sources VALUES (?, ?, ?, ?, ?, ?)",
+            (digest, path, size, mtime_ns, record_id, datetime.now().isoformat()),
+        )
+        self.add_path(path, size, mtime_ns, digest)
+
+    def add_path(self, path, size, mtime_ns, digest):
+        """记录已处理的文件，内容与已导入的图片重复时也记录，重启后无需重新读取"""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO paths VALUES (?, ?, ?, ?)",
+            (path, size, mtime_ns, digest),
+        )
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+class WatchMetrics:
+    """导入吞吐量和队列延迟（从发现文件到写入历史记录）"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.detected = 0
+        self.recognized = 0
+        self.failed = 0
+        self.duplicates = 0
+        self.batches = 0
+        self.queued = 0
+        self._lags = deque(maxlen=LAG_SAMPLES)
+        self._lock = threading.Lock()
+
+    def add_lag(self, seconds):
+        with self._lock:
+            self._lags.append(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            lags = sorted(self._lags)
+        elapsed = time.monotonic() - self.started
+
+        def percentile(q):
+            if not lags:
+                return 0.0
+            return lags[min(len(lags) - 1, int(q * len(lags)))] * 1000
+
+        return {
+            "detected": self.detected,
+            "recognized": self.recognized,
+            "failed": self.failed,
+            "duplicates": self.duplicates,
+            "batches": self.batches,
+            "queued": self.queued,
+            "images_per_s": self.recognized / elapsed if elapsed else 0.0,
+            "lag_p50_ms": percentile(0.5),
+            "lag_p95_ms": percentile(0.95),
+            "lag_max_ms": lags[-1] * 1000 if lags else 0.0,
+        }
+
+
+class FolderIngester:
+    """监视目录中的新图片，写完后按批识别并加入历史记录
+
+    只监视目录本身，不递归子目录；同一内容的图片只导入一次
+    """
+
+    def __init__(
+        self,
+        directory,
+        recognizer,
+        store,
+        ledger=None,
+        batch_size=BATCH_SIZE,
+        settle_seconds=SETTLE_SECONDS,
+        max_batch_wait=MAX_BATCH_WAIT,
+        polling=False,
+        interval=POLL_INTERVAL,
+        on_record=None,
+    ):
+        self.directory = os.path.abspath(directory)
+        self.recognizer = recognizer
+        self.store = store
+        self.ledger = ledger or WatchLedger()
+        self.batch_size = batch_size
+        self.settle_seconds = settle_seconds
+        self.max_batch_wait = max_batch_wait
+        # on_record(record_id) 在每条记录写入历史后调用
+        self.on_record = on_record
+        self.metrics = WatchMetrics()
+        self.watcher = create_watcher(self.directory, polling, interval)
+        # 文件名 -> [大小, 修改时间, 最近变化时间, 首次发现时间]
+        self._candidates = {}
+        # 已写完、等待识别的 (文件名, 首次发现时间)
+        self._ready = []
+        self._ready_since = None
+        self._stop = threading.Event()
+        self._notice(
+            [name for name in list_images(self.directory) if not self._imported(name)]
+        )
+
+    def _imported(self, name):
+        path = os.path.join(self.directory, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        return self.ledger.unchanged(path, stat.st_size, stat.st_mtime_ns)
+
+    def _notice(self, names):
+        now = time.monotonic()
+        for name in names:
+            if name not in self._candidates:
+                self.metrics.detected += 1
+                self._candidates[name] = [None, None, now, now]
+
+    def _settle(self):
+        """大小和修改时间在 settle_seconds 内不变的文件移入待识别队列"""
+        now = time.monotonic()
+        for name, state in list(self._candidates.items()):
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                # 文件已被移走
+                del self._candidates[name]
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != (state[0], state[1]):
+                state[0], state[1], state[2] = current[0], current[1], now
+            elif stat.st_size and now - state[2] >= self.settle_seconds:
+                del self._candidates[name]
+                if not self._ready:
+                    self._ready_since = now
+                self._ready.append((name, state[3]))
+        self.metrics.queued = len(self._candidates) + len(self._ready)
+
+    def _next_timeout(self):
+        if self._ready:
+            return max(0.0, self._ready_since + self.max_batch_wait - time.monotonic())
+        if self._candidates:
+            return self.settle_seconds / 2
+        return 1.0
+
+    def poll(self):
+        """等待一轮文件变化，凑够一批或等待超时后识别，返回写入的记录数"""
+        self._notice(self.watcher.wait(self._next_timeout()))
+        self._settle()
+        if not self._ready:
+            return 0
+        waited = time.monotonic() - self._ready_since
+        if len(self._ready) < self.batch_size and waited < self.max_batch_wait:
+            return 0
+        added = 0
+        while self._ready:
+            batch, self._ready = (
+                self._ready[: self.batch_size],
+                self._ready[self.batch_size :],
+            )
+            added += self.process_batch(batch)
+        self._ready_since = None
+        self.metrics.queued = len(self._candidates)
+        return added
+
+    def drain(self):
+        """处理目录中现有的所有图片，用于单次运行"""
+        # 一直在变化的文件最多等待 10 个 settle_seconds
+        deadline = time.monotonic() + self.settle_seconds * 10
+        while True:
+            self._settle()
+            if not self._candidates or time.monotonic() >= deadline:
+                break
+            time.sleep(self.settle_seconds / 4)
+        added = 0
+        while self._ready:
+            batch, self._ready = (
+                self._ready[: self.batch_size],
+                self._ready[self.batch_size :],
+            )
+            added += self.process_batch(batch)
+        self._ready_since = None
+        self.metrics.queued = len(self._candidates)
+        return added
+
+    def process_batch(self, batch):
+        """识别一批已写完的图片，返回写入的记录数"""
+        items = []
+        digests = set()
+        # 与本批次中其他图片内容相同的文件，该图片导入成功后再记录
+        batch_duplicates = []
+        for name, detected_at in batch:
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+                with open(path, "rb") as f:
+                    data = f.read()
+            except OSError as e:
+                print(f"读取图片出错: {str(e)}")
+                self.metrics.failed += 1
+                continue
+            digest = hashlib.sha1(data).hexdigest()
+            if digest in digests:
+                self.metrics.duplicates += 1
+                batch_duplicates.append((path, stat, digest))
+                continue
+            if self.ledger.seen(digest):
+                self.metrics.duplicates += 1
+                self.ledger.add_path(path, stat.st_size, stat.st_mtime_ns, digest)
+                continue
+            image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                # 可能仍未写完，文件再次变化时会重新识别
+                print(f"无法解码图片: {path}")
+                self.metrics.failed += 1
+                continue
+            digests.add(digest)
+            items.append((name, path, digest, image, detected_at, stat))
+        if not items:
+            return 0
+
+        outputs = self.recognizer.recognize_batch(
+            [item[3] for item in items], batch_size=self.batch_size
+        )
+        self.metrics.batches += 1
+        added = 0
+        for (name, path, digest, image, detected_at, stat), (res, error) in zip(
+            items, outputs
+        ):
+            if res is None:
+                print(f"识别出错: {path}: {error}")
+                self.metrics.failed += 1
+                continue
+            record_id = FileManager.new_record_id()
+            try:
+                self._save_record(record_id, name, path, digest, image, res)
+            except Exception as e:
+                print(f"保存记录出错: {str(e)}")
+                self.metrics.failed += 1
+                continue
+            self.ledger.add(
+                digest, path, stat.st_size, stat.st_mtime_ns, record_id
+            )
+            self.metrics.recognized += 1
+            lag = time.monotonic() - detected_at
+            self.metrics.add_lag(lag)
+            metrics.observe("watch_lag", lag)
+            added += 1
+            if self.on_record is not None:
+                self.on_record(record_id)
+        for path, stat, digest in batch_duplicates:
+            if self.ledger.seen(digest):
+                self.ledger.add_path(path, stat.st_size, stat.st_mtime_ns, digest)
+        return added
+
+    def _save_record(self, record_id, name, path, digest, image, res):
+        output_dir = self.store.output_dir
+        image_file = f"{record_id}_image.png"
+        ok, encoded = cv2.imencode(".png", image)
+        if not ok:
+            raise RuntimeError(f"failed to encode {path}")
+        image_path = os.path.join(output_dir, image_file)
+        data = encoded.tobytes()
+        with metrics.span("save_image"):
+            FileManager.write_bytes_atomic(image_path, data)
+        # 与界面保存的图片一样生成缩小图，首次显示时无需解码原图
+        with metrics.span("build_pyramid"):
+            build_pyramid(QImage.fromData(data, "PNG"), image_path)
+
+        result = {
+            "input_path": path,
+            "rec_formula": res["rec_formula"],
+            "title": os.path.splitext(name)[0],
+            "source_sha1": digest,
+        }
+        if res.get("model_name"):
+            result["model_name"] = res["model_name"]
+        FileManager.write_json_atomic(
+            os.path.join(output_dir, f"{record_id}_result.json"), result
+        )
+        self.store.add(record_id, result, image_file)
+
+    def run(self, on_metrics=None, metrics_interval=10.0):
+        """持续监视，直到调用 stop()"""
+        last_report = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"导入出错: {str(e)}")
+                time.sleep(1.0)
+            if on_metrics is not None and time.monotonic() - last_report >= metrics_interval:
+                last_report = time.monotonic()
+                on_metrics(self.metrics.snapshot())
+        if on_metrics is not None:
+            on_metrics(self.metrics.snapshot())
+
+    def stop(self):
+        self._stop.set()
+
+    def close(self):
+        self.watcher.close()
+        self.ledger.close()
+
+
+class WatchThread(QThread):
+    """在界面中后台运行目录监视
+
+    get_recognizer(timeout) 返回共用的识别器，尚未加载完成时返回 None，
+    加载失败时抛出异常；等待期间可以随时停止
+    """
+
+    # 新写入历史的记录 ID
+    record_added = pyqtSignal(str)
+    # 导入指标
+    metrics_updated = pyqtSignal(dict)
+    # 错误信息
+    failed = pyqtSignal(str)
+
+    def __init__(self, directory, get_recognizer, store, parent=None):
+        super().__init__(parent)
+        self.directory = directory
+        self.get_recognizer = get_recognizer
+        self.store = store
+        self.ingester = None
+        self._stopped = threading.Event()
+
+    def run(self):
+        try:
+            recognizer = None
+            while recognizer is None:
+                if self._stopped.is_set():
+                    return
+                recognizer = self.get_recognizer(RECOGNIZER_WAIT_INTERVAL)
+            ingester = FolderIngester(
+                self.directory,
+                recognizer,
+                self.store,
+                on_record=self.record_added.emit,
+            )
+        except Exception as e:
+            print(f"启动目录监视出错: {str(e)}")
+            self.failed.emit(str(e))
+            return
+        self.ingester = ingester
+        if self._stopped.is_set():
+            ingester.stop()
+        try:
+            ingester.run(on_metrics=self.metrics_updated.emit, metrics_interval=2.0)
+        finally:
+            ingester.close()
+
+    def request_stop(self):
+        """通知线程停止，不等待；当前批次识别完成后发出 finished"""
+        self._stopped.set()
+        if self.ingester is not None:
+            self.ingester.stop()
+
+    def stop(self, timeout_ms=None):
+        """通知线程停止并等待，返回线程是否已结束"""
+        self.request_stop()
+        if timeout_ms is None:
+            return self.wait()
+        return self.wait(timeout_ms)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="监视目录，自动识别新放入的公式图片")
+    parser.add_argument("directory", help="要监视的目录")
+    parser.add_argument(
+        "--model",
+        default="PP-FormulaNet-S",
+        help="模型名称，逗号分隔多个模型时先用前面的模型，结果无效再换下一个",
+    )
+    parser.add_argument(
+        "-b", "--batch-size", type=int, default=BATCH_SIZE, help="每批识别的图片数"
+    )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=SETTLE_SECONDS,
+        help="文件多久不再变化后才识别（秒）",
+    )
+    parser.add_argument(
+        "--max-wait",
+        type=float,
+        default=MAX_BATCH_WAIT,
+        help="不足一批时最多等待多久（秒）",
+    )
+    parser.add_argument(
+        "--polling", action="store_true", help="使用轮询代替 inotify（如网络共享目录）"
+    )
+    parser.add_argument(
+        "--interval", type=float, default=POLL_INTERVAL, help="轮询间隔（秒）"
+    )
+    parser.add_argument(
+        "--metrics-interval", type=float, default=10.0, help="输出导入指标的间隔（秒）"
+    )
+    parser.add_argument(
+        "--metrics-file",
+        help="每次输出导入指标时，把各阶段耗时分位数写入该文件（Prometheus 文本格式）",
+    )
+    parser.add_argument(
+        "--once", action="store_true", help="只处理目录中现有的图片后退出"
+    )
+    parser.add_argument("--cache", help="识别缓存数据库路径，重复图片跳过推理")
+    parser.add_argument(
+        "--preprocess", action="store_true", help="识别前裁剪空白边距并归一化图片"
+    )
+    add_engine_arguments(parser)
+    parser.add_argument(
+        "--stub", action="store_true", help="使用占位模型，无需 PaddleX 权重"
+    )
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.directory):
+        parser.error(f"目录不存在: {args.directory}")
+
+    FileManager.ensure_output_dir()
+    recognizer = create_recognizer(
+        parse_models(args.model),
+        stub=args.stub,
+        cache=RecognitionCache(args.cache) if args.cache else None,
+        preprocessor=Preprocessor() if args.preprocess else None,
+        engine=engine_from_args(args),
+    )
+    recognizer.warm_up()
+    store = HistoryStore()
+    ingester = FolderIngester(
+        args.directory,
+        recognizer,
+        store,
+        batch_size=args.batch_size,
+        settle_seconds=args.settle,
+        max_batch_wait=args.max_wait,
+        polling=args.polling,
+        interval=args.interval,
+    )
+
+    def report(snapshot):
+        print(json.dumps(snapshot, ensure_ascii=False), file=sys.stderr)
+        if args.metrics_file:
+            text = metrics.REGISTRY.to_prometheus(
+                gauges={
+                    "watch_queued": snapshot["queued"],
+                    "watch_recognized": snapshot["recognized"],
+                    "watch_failed": snapshot["failed"],
+                }
+            )
+            FileManager.write_bytes_atomic(args.metrics_file, text.encode("utf-8"))
+
+    try:
+        if args.once:
+            ingester.drain()
+            report(ingester.metrics.snapshot())
+        else:
+            print(f"正在监视 {ingester.directory}，按 Ctrl+C 停止", file=sys.stderr)
+            ingester.run(on_metrics=report, metrics_interval=args.metrics_interval)
+    except KeyboardInterrupt:
+        report(ingester.metrics.snapshot())
+    finally:
+        ingester.close()
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+import threading
+import time
+from collections import deque
+from PyQt6.QtCore import QThread, pyqtSignal
+
+import metrics
+
+
+class RecognitionJob:
+    """一次识别任务"""
+
+    def __init__(self, job_id, image, timestamp):
+        self.job_id = job_id
+        # 图片路径或 numpy 数组
+        self.image = image
+        self.timestamp = timestamp
+        self.submitted_at = time.perf_counter()
+
+
+class RecognitionWorker(QThread):
+    """后台识别线程，先在线程中加载模型，再按队列顺序执行识别任务
+
+    模型加载完成前提交的任务会排队等待
+    """
+
+    # job_id, timestamp, result, 耗时(秒)
+    job_finished = pyqtSignal(int, str, object, float)
+    # job_id, timestamp, 错误信息
+    job_failed = pyqtSignal(int, str, str)
+    # job_id, timestamp
+    job_cancelled = pyqtSignal(int, str)
+    # job_id, 各阶段耗时 [(阶段, 秒)]，在 job_finished / job_failed 之前发出
+    job_profiled = pyqtSignal(int, list)
+    # 各加载阶段耗时
+    model_ready = pyqtSignal(dict)
+    # 错误信息
+    model_failed = pyqtSignal(str)
+    # 切换后的模型列表
+    models_switched = pyqtSignal(list)
+
+    # 空闲时每隔多久检查一次未使用的模型（秒）
+    IDLE_CHECK_SECONDS = 60
+
+    def __init__(self, recognizer_factory, parent=None):
+        super().__init__(parent)
+        self.recognizer_factory = recognizer_factory
+        self.recognizer = None
+        self._jobs = deque()
+        self._condition = threading.Condition()
+        self._next_id = 1
+        self._running = True
+        self._switch_to = None
+        # 模型加载结束（无论成功与否）后设置
+        self._loaded = threading.Event()
+
+    def submit(self, image, timestamp, supersede=True):
+        """提交识别任务，supersede 为 True 时取消所有尚未开始的任务"""
+        cancelled = []
+        with self._condition:
+            job = RecognitionJob(self._next_id, image, timestamp)
+            self._next_id += 1
+            if supersede:
+                cancelled = list(self._jobs)
+                self._jobs.clear()
+            self._jobs.append(job)
+            self._condition.notify()
+
+        for old_job in cancelled:
+            self.job_cancelled.emit(old_job.job_id, old_job.timestamp)
+        return job.job_id
+
+    def cancel_pending(self):
+        """取消所有尚未开始的任务"""
+        with self._condition:
+            cancelled = list(self._jobs)
+            self._jobs.clear()
+        for job in cancelled:
+            self.job_cancelled.emit(job.job_id, job.timestamp)
+
+    def pending_count(self):
+        """返回排队中的任务数量"""
+        with self._condition:
+            return len(self._jobs)
+
+    def stop(self):
+        """停止线程，正在执行的任务会先完成"""
+        self.cancel_pending()
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self.wait()
+
+    def switch_models(self, models):
+        """切换识别模型，在后台线程中加载完成后发出 models_switched"""
+        with self._condition:
+            self._switch_to = list(models)
+            self._condition.notify()
+
+    def _apply_switch(self, models):
+        # 之前的模型加载失败时，按新的选择重新加载
+        if self.recognizer is None:
+            self._load_model()
+            return
+        try:
+            self.recognizer.set_models(models)
+            self.recognizer.warm_up()
+        except Exception as e:
+            print(f"切换模型出错: {str(e)}")
+            self.model_failed.emit(str(e))
+            return
+        self.models_switched.emit(list(models))
+
+    def is_ready(self):
+        """模型是否已加载完成"""
+        return self.recognizer is not None
+
+    def wait_for_recognizer(self, timeout=None):
+        """等待模型加载完成并返回识别器，供其他线程共用同一份模型
+
+        超时仍未加载完成时返回 None，加载失败时抛出 RuntimeError
+        """
+        if not self._loaded.wait(timeout):
+            return None
+        if self.recognizer is None:
+            raise RuntimeError("Model failed to load")
+        return self.recognizer
+
+    def _load_model(self):
+        try:
+            recognizer = self.recognizer_factory()
+        except Exception as e:
+            print(f"加载模型出错: {str(e)}")
+            self._loaded.set()
+            self.model_failed.emit(str(e))
+            return
+        try:
+            recognizer.warm_up()
+        except Exception as e:
+            # 预热失败不影响正常识别
+            print(f"模型预热出错: {str(e)}")
+        self.recognizer = recognizer
+        self._loaded.set()
+        self.model_ready.emit(dict(recognizer.timings))
+
+    def _release_idle(self):
+        """释放长时间未使用的模型"""
+        release_idle = getattr(self.recognizer, "release_idle", None)
+        if release_idle is not None:
+            release_idle()
+
+    def run(self):
+        self._load_model()
+        while True:
+            idle = False
+            with self._condition:
+                while self._running and not self._jobs and not self._switch_to:
+                    if not self._condition.wait(self.IDLE_CHECK_SECONDS):
+                        idle = True
+                        break
+                if not self._running:
+                    return
+                switch_to, self._switch_to = self._switch_to, None
+                job = self._jobs.popleft() if self._jobs else None
+
+            if idle:
+                self._release_idle()
+            if switch_to:
+                self._apply_switch(switch_to)
+            if job is None:
+                continue
+
+            if self.recognizer is None:
+                self.job_failed.emit(job.job_id, job.timestamp, "Model failed to load")
+                continue
+
+            with metrics.trace() as spans:
+                metrics.observe("queue_wait", time.perf_counter() - job.submitted_at)
+                try:
+                    with metrics.span("recognize"):
+                        result = self.recognizer.recognize(job.image, job.timestamp)
+                except Exception as e:
+                    error = str(e)
+                    result = None
+                else:
+                    error = None
+            self.job_profiled.emit(job.job_id, spans)
+            if error is not None:
+                self.job_failed.emit(job.job_id, job.timestamp, error)
+                continue
+
+            latency = time.perf_counter() - job.submitted_at
+            metrics.observe("job_latency", latency)
+            if result:
+                self.job_finished.emit(job.job_id, job.timestamp, result, latency)
+            else:
+                # 识别器记录的失败原因，如最后一个模型的错误
+                error = getattr(self.recognizer, "last_error", None)
+                self.job_failed.emit(
+                    job.job_id, job.timestamp, error or "No formula recognized"
+                )
+